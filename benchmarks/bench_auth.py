@@ -0,0 +1,89 @@
+"""
+Microbenchmark for the auth dependency (`get_current_user`) and the JWT helpers behind it.
+
+The user lookup is stubbed out, so this only measures the CPU cost of the auth path itself (i.e.
+what every authenticated request pays before the database comes into play).
+
+Usage:
+    python benchmarks/bench_auth.py [--iterations 20000]
+"""
+import os
+import sys
+import asyncio
+import argparse
+from time import perf_counter
+from pathlib import Path
+from uuid import uuid4
+
+# makes sure that "src" is importable without setting PYTHONPATH manually
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+if str(SRC) not in sys.path:
+    sys.path.insert(0, str(SRC))
+
+# NOTE: these MUST come before we import anything from "srv", otherwise the import will fail
+os.environ.setdefault("DB_URL", f"sqlite+aiosqlite:///{ROOT / 'bench_auth.db'}")
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark-secret-" + "0" * 32)
+
+import services.users as users_service  # noqa: E402
+from srv.schemas import UserPublic  # noqa: E402
+from srv.security import create_access_token, decode_access_token, get_current_user, token_cache  # noqa: E402
+
+USER = UserPublic(id=str(uuid4()), username="benchmark")
+
+
+async def _lookup_user(session, username):
+    return USER
+
+
+def time_sync(fn, iterations: int) -> float:
+    """Returns the mean time per call (in microseconds)."""
+    start = perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (perf_counter() - start) / iterations * 1e6
+
+
+async def time_async(fn, iterations: int) -> float:
+    """Returns the mean time per call (in microseconds)."""
+    start = perf_counter()
+    for _ in range(iterations):
+        await fn()
+    return (perf_counter() - start) / iterations * 1e6
+
+
+async def run(iterations: int) -> dict[str, float]:
+    users_service.get_user = _lookup_user
+    token = create_access_token({"sub": USER.username})
+
+    def _decode_cold():
+        token_cache.clear()
+        decode_access_token(token)
+
+    async def _current_user_cold():
+        token_cache.clear()
+        users_service.user_cache.clear()
+        await get_current_user(token, None)
+
+    results = {
+        "create_access_token": time_sync(lambda: create_access_token({"sub": USER.username}), iterations),
+        "decode_access_token (cold)": time_sync(_decode_cold, iterations),
+        "decode_access_token (cached)": time_sync(lambda: decode_access_token(token), iterations),
+        "get_current_user (cold)": await time_async(_current_user_cold, iterations),
+        "get_current_user (cached)": await time_async(lambda: get_current_user(token, None), iterations),
+    }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.iterations))
+    for name, us in results.items():
+        print(f"{name:>30}: {us:8.2f} us/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Microbenchmark for password hashing at different costs.
+
+Reports how long one hash (and one verification) takes for each cost, so that you can pick
+`PASSWORD_HASH_ROUNDS` for an environment (e.g. a cheap cost for staging and load tests).
+
+Usage:
+    python benchmarks/bench_hashing.py [--scheme bcrypt] [--rounds 4 8 10 12] [--iterations 5]
+"""
+import os
+import sys
+import argparse
+from time import perf_counter
+from pathlib import Path
+
+# makes sure that "src" is importable without setting PYTHONPATH manually
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+if str(SRC) not in sys.path:
+    sys.path.insert(0, str(SRC))
+
+# NOTE: these MUST come before we import anything from "srv", otherwise the import will fail
+os.environ.setdefault("DB_URL", f"sqlite+aiosqlite:///{ROOT / 'bench_hashing.db'}")
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark-secret-" + "0" * 32)
+
+from srv.security import PASSWORD_HASH_SCHEMES, build_pwd_context  # noqa: E402
+
+# sensible costs to compare for each scheme (bcrypt's cost is a log2, the others are linear)
+DEFAULT_ROUNDS = {
+    "bcrypt": [4, 8, 10, 12],
+    "pbkdf2_sha256": [1000, 29000, 100000],
+    "sha256_crypt": [1000, 5000, 535000],
+    "sha512_crypt": [1000, 5000, 656000],
+}
+
+
+def run(scheme: str, rounds: list[int], iterations: int) -> dict[int, tuple[float, float]]:
+    """Returns the mean time (in milliseconds) to hash and to verify a password, per cost."""
+    results = {}
+    for cost in rounds:
+        context = build_pwd_context(scheme, cost)
+        # warm up (the first hash pays for loading the backend)
+        context.hash("warm up")
+        start = perf_counter()
+        for _ in range(iterations):
+            hashed = context.hash("correct horse battery staple")
+        hash_ms = (perf_counter() - start) / iterations * 1e3
+
+        start = perf_counter()
+        for _ in range(iterations):
+            context.verify("correct horse battery staple", hashed)
+        verify_ms = (perf_counter() - start) / iterations * 1e3
+        results[cost] = (hash_ms, verify_ms)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scheme", choices=PASSWORD_HASH_SCHEMES, default="bcrypt")
+    parser.add_argument("--rounds", type=int, nargs="+")
+    parser.add_argument("--iterations", type=int, default=5)
+    args = parser.parse_args()
+
+    results = run(args.scheme, args.rounds or DEFAULT_ROUNDS[args.scheme], args.iterations)
+    for cost, (hash_ms, verify_ms) in results.items():
+        print(f"{args.scheme} (rounds={cost:>6}): {hash_ms:9.2f} ms/hash, {verify_ms:9.2f} ms/verify")
+
+
+if __name__ == "__main__":
+    main()
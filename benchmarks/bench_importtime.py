@@ -0,0 +1,72 @@
+"""
+Startup benchmark for importing the app (i.e. what every worker pays before it can serve).
+
+Imports the module in a fresh interpreter per run, and uses `python -X importtime` to show which
+of its imports are the most expensive.
+
+Usage:
+    python benchmarks/bench_importtime.py [--runs 5] [--module srv.app] [--top 15]
+"""
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+
+
+def _env() -> dict[str, str]:
+    env = dict(os.environ)
+    # makes sure that "src" is importable in the child interpreter
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(SRC), env.get("PYTHONPATH")]))
+    env.setdefault("DB_URL", f"sqlite+aiosqlite:///{ROOT / 'bench_importtime.db'}")
+    env.setdefault("OPENAI_API_KEY", "benchmark")
+    env.setdefault("JWT_SECRET_KEY", "benchmark-secret-" + "0" * 32)
+    return env
+
+
+def import_times(module: str) -> list[tuple[str, int, int]]:
+    """Returns `(module, self_us, cumulative_us)` for every module imported by `module`."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=_env(), capture_output=True, text=True, check=True
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        # e.g. "import time:       350 |       3129 |           jwt.api_jwk"
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def run(module: str, runs: int) -> tuple[list[float], list[tuple[str, int, int]]]:
+    """Returns the total import time (in milliseconds) of every run, and the imports of the last run."""
+    totals, rows = [], []
+    for _ in range(runs):
+        rows = import_times(module)
+        total = next(cumulative for name, _, cumulative in rows if name == module)
+        totals.append(total / 1000)
+    return totals, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--module", default="srv.app")
+    parser.add_argument("--top", type=int, default=15, help="how many of the slowest imports to show")
+    args = parser.parse_args()
+
+    totals, rows = run(args.module, args.runs)
+    print(f"import {args.module}: mean {statistics.fmean(totals):.1f} ms | p50 {statistics.median(totals):.1f} ms | max {max(totals):.1f} ms")
+    print("\nslowest imports (self time, last run):")
+    for name, self_us, cumulative_us in sorted(rows, key=lambda r: r[1], reverse=True)[:args.top]:
+        print(f"{self_us / 1000:8.1f} ms self | {cumulative_us / 1000:8.1f} ms cumulative | {name}")
+
+
+if __name__ == "__main__":
+    main()
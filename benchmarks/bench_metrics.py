@@ -0,0 +1,60 @@
+"""
+Microbenchmark for the metrics instrumentation, to make sure that it stays cheap enough for the
+hot paths (an analysis records about a dozen observations).
+
+Usage:
+    python benchmarks/bench_metrics.py [--iterations 200000]
+"""
+import sys
+import argparse
+from time import perf_counter
+from pathlib import Path
+
+# makes sure that "src" is importable without setting PYTHONPATH manually
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+if str(SRC) not in sys.path:
+    sys.path.insert(0, str(SRC))
+
+from core.metrics import Counter, Histogram, Registry, generate_latest  # noqa: E402
+
+
+def time_sync(fn, iterations: int) -> float:
+    """Returns the mean time per call (in microseconds)."""
+    start = perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (perf_counter() - start) / iterations * 1e6
+
+
+def run(iterations: int) -> dict[str, float]:
+    registry = Registry()
+    counter = Counter("events", "Events.", labelnames=("type",), registry=registry)
+    histogram = Histogram("stage_seconds", "Stages.", labelnames=("stage",), registry=registry)
+    child = histogram.labels("llm")
+
+    def _timed():
+        with child.time():
+            pass
+
+    results = {
+        "counter.inc": time_sync(counter.labels("a").inc, iterations),
+        "counter.labels().inc": time_sync(lambda: counter.labels("a").inc(), iterations),
+        "histogram.observe": time_sync(lambda: child.observe(0.3), iterations),
+        "histogram.time": time_sync(_timed, iterations),
+        "generate_latest": time_sync(lambda: generate_latest(registry), max(1, iterations // 100)),
+    }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args()
+
+    for name, us in run(args.iterations).items():
+        print(f"{name:>22}: {us:8.3f} us/call")
+
+
+if __name__ == "__main__":
+    main()
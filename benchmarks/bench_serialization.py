@@ -0,0 +1,88 @@
+"""
+Serialization benchmark for the analysis response.
+
+Compares FastAPI's default JSON path (`jsonable_encoder` + the standard library's `json`) against
+pydantic's `model_dump_json()` (what the API sends), orjson and MessagePack on an `AnalyzeResponse`
+with 1,000 dependencies, both in time per response and in payload size.
+
+Usage:
+    python benchmarks/bench_serialization.py [--dependencies 1000] [--iterations 200]
+"""
+import os
+import sys
+import argparse
+from datetime import date
+from time import perf_counter
+from pathlib import Path
+
+# makes sure that "src" is importable without setting PYTHONPATH manually
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+if str(SRC) not in sys.path:
+    sys.path.insert(0, str(SRC))
+
+# NOTE: these MUST come before we import anything from "srv", otherwise the import will fail
+os.environ.setdefault("DB_URL", f"sqlite+aiosqlite:///{ROOT / 'bench_serialization.db'}")
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark-secret-" + "0" * 32)
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from srv.responses import MsgPackResponse, ORJSONResponse  # noqa: E402
+from srv.schemas import AnalysisResult, AnalyzeResponse, DependencyReport, Status  # noqa: E402
+
+
+def build_response(dependencies: int) -> AnalyzeResponse:
+    return AnalyzeResponse(
+        project_id="93fe969a-c0fc-4c01-8b92-b866927c552f",
+        status=Status.COMPLETED,
+        result=AnalysisResult(
+            project_name="benchmark",
+            analysis_date=date.today(),
+            files=[
+                DependencyReport(
+                    name=f"package-{i}",
+                    version=f"{i % 10}.{i % 7}.{i % 3}",
+                    license="License :: OSI Approved :: MIT License" if i % 2 else "Apache-2.0",
+                    confidence_score=(i % 100) / 100
+                )
+                for i in range(dependencies)
+            ]
+        )
+    )
+
+
+# NOTE: every serializer starts from the model, since that's what the route has in hand
+SERIALIZERS = {
+    "fastapi default (json)": lambda model: JSONResponse(jsonable_encoder(model)).body,
+    "pydantic model_dump_json": lambda model: model.model_dump_json().encode(),
+    "orjson": lambda model: ORJSONResponse(model.model_dump(mode="json")).body,
+    "msgpack": lambda model: MsgPackResponse(model.model_dump(mode="json")).body,
+}
+
+
+def run(dependencies: int, iterations: int) -> dict[str, tuple[float, int]]:
+    """Returns the mean time (in milliseconds) and the payload size (in bytes) of every serializer."""
+    model = build_response(dependencies)
+    results = {}
+    for name, serialize in SERIALIZERS.items():
+        body = serialize(model)     # warm up
+        start = perf_counter()
+        for _ in range(iterations):
+            serialize(model)
+        results[name] = ((perf_counter() - start) / iterations * 1e3, len(body))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dependencies", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    results = run(args.dependencies, args.iterations)
+    for name, (ms, size) in results.items():
+        print(f"{name:>26}: {ms:8.3f} ms/response | {size / 1024:8.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Startup-time benchmark for `init_engine`.
+
+Compares the "create_all" startup mode against the "verify" startup mode (which only checks the
+Alembic revision) on a fresh engine per run, which is what every worker pays on a (re)deploy.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 20] [--db-url sqlite+aiosqlite:///./bench_startup.db]
+"""
+import os
+import sys
+import asyncio
+import argparse
+import statistics
+from time import perf_counter
+from pathlib import Path
+
+# makes sure that "src" is importable without setting PYTHONPATH manually
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+if str(SRC) not in sys.path:
+    sys.path.insert(0, str(SRC))
+
+DEFAULT_DB_FILE = ROOT / "bench_startup.db"
+DEFAULT_DB_URL = f"sqlite+aiosqlite:///{DEFAULT_DB_FILE}"
+# NOTE: this MUST come before we import anything from "db", otherwise the import will fail
+os.environ.setdefault("DB_URL", DEFAULT_DB_URL)
+
+from sqlalchemy import text  # noqa: E402
+from sqlalchemy.ext.asyncio import create_async_engine  # noqa: E402
+from sqlmodel import SQLModel  # noqa: E402
+from db.session import init_engine, close_engine, get_head_revisions  # noqa: E402
+import srv.schemas  # noqa: E402,F401 (registers the tables on SQLModel.metadata)
+
+
+async def prepare_db(db_url: str) -> None:
+    """Creates the tables and stamps the DB at the latest revision (like `alembic upgrade head` would)."""
+    eng = create_async_engine(db_url)
+    async with eng.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+        await conn.execute(text("DROP TABLE IF EXISTS alembic_version"))
+        await conn.execute(text("CREATE TABLE alembic_version (version_num VARCHAR(32) NOT NULL)"))
+        for rev in get_head_revisions():
+            await conn.execute(text("INSERT INTO alembic_version (version_num) VALUES (:rev)"), {"rev": rev})
+    await eng.dispose()
+
+
+async def time_startup(db_url: str, mode: str, runs: int) -> list[float]:
+    timings = []
+    for _ in range(runs):
+        start = perf_counter()
+        await init_engine(db_url, max_retries=1, startup_mode=mode)
+        timings.append((perf_counter() - start) * 1000)
+        await close_engine()
+    return timings
+
+
+async def run(db_url: str, runs: int) -> dict[str, dict[str, float]]:
+    await prepare_db(db_url)
+    # warm up the module-level caches (e.g. the Alembic heads) so that they don't skew the first run
+    await time_startup(db_url, "verify", 1)
+
+    results = {}
+    for mode in ("create_all", "verify"):
+        timings = await time_startup(db_url, mode, runs)
+        results[mode] = {
+            "mean_ms": statistics.fmean(timings),
+            "p50_ms": statistics.median(timings),
+            "max_ms": max(timings),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--db-url", default=os.environ["DB_URL"])
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.db_url, args.runs))
+    for mode, stats in results.items():
+        print(f"{mode:>10}: mean {stats['mean_ms']:.2f} ms | p50 {stats['p50_ms']:.2f} ms | max {stats['max_ms']:.2f} ms")
+
+    # clean up the default SQLite file, if we made it
+    if args.db_url == DEFAULT_DB_URL:
+        try:
+            os.remove(DEFAULT_DB_FILE)
+        except OSError:
+            pass
+
+
+if __name__ == "__main__":
+    main()
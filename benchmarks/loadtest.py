@@ -0,0 +1,257 @@
+"""
+Load test for `POST /analyze`: keeps a fixed number of analyses in flight for a while, then reports
+the throughput and the latency percentiles.
+
+By default, it starts the whole stack itself: the OpenAI stand-in from "mock_openai.py" (with the
+latency/error/429 options below) and the API (through `cli.serve`, on a throwaway SQLite database).
+The analyses then take the real HTTP path to the "LLM", including the OpenAI client's retries. Pass
+`--url` to load test an API that's already running instead (turn its analyze rate limits off
+first, e.g. ANALYZE_RATE_LIMIT_PER_MINUTE=0 and ANALYZE_MAX_CONCURRENT_PER_USER=0).
+
+Usage:
+    python benchmarks/loadtest.py [--concurrency 16] [--duration 30] [--lines 50] [--workers 1]
+        [--latency lognormal --latency-mean 1.5 --latency-jitter 0.5] [--rate-limit-rate 0.02] [--output results.json]
+    python benchmarks/loadtest.py --url http://localhost:80 --username loadtest --password loadtest
+"""
+import os
+import sys
+import json
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from time import monotonic, perf_counter, sleep
+from pathlib import Path
+from typing import Iterator, Optional
+import httpx
+
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+BENCHMARKS = Path(__file__).resolve().parent
+if str(BENCHMARKS) not in sys.path:
+    sys.path.insert(0, str(BENCHMARKS))
+
+from mock_openai import add_mock_arguments  # noqa: E402
+
+
+@dataclass
+class Stack:
+    """The servers that `spawn_stack` started (and how to reach them)."""
+    api_url: str
+    mock_url: str
+    db_file: Path
+    api: subprocess.Popen
+    mock: subprocess.Popen
+    env: dict[str, str] = field(default_factory=dict)
+
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = monotonic() + timeout
+    while monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode} before it came up.")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.TransportError:
+            sleep(0.1)
+    raise RuntimeError(f"{url} didn't come up within {timeout:.0f}s.")
+
+
+def mock_arguments(args: argparse.Namespace) -> list[str]:
+    """Turns the mock's options (see `add_mock_arguments`) back into command line arguments."""
+    argv = ["--latency", args.latency, "--latency-mean", str(args.latency_mean),
+            "--latency-jitter", str(args.latency_jitter), "--error-rate", str(args.error_rate),
+            "--rate-limit-rate", str(args.rate_limit_rate), "--retry-after", str(args.retry_after)]
+    if args.seed is not None:
+        argv += ["--seed", str(args.seed)]
+    return argv
+
+
+@contextmanager
+def spawn_stack(mock_argv: list[str], workers: int = 1, extra_env: Optional[dict[str, str]] = None, verbose: bool = False) -> Iterator[Stack]:
+    """
+    Starts the OpenAI stand-in and the API (on a fresh SQLite database), and stops both on the way out. Unless `verbose` is set, the API's stdout (i.e. an access log line per request) is thrown away; its stderr is always kept.
+    """
+    mock_port, api_port = get_free_port(), get_free_port()
+    db_dir = Path(tempfile.mkdtemp(prefix="licenseguard-loadtest-"))
+    db_file = db_dir / "loadtest.db"
+    env = {
+        **os.environ,
+        "DB_URL": f"sqlite+aiosqlite:///{db_file}",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{mock_port}/v1",
+        "OPENAI_API_KEY": "mock",
+        "JWT_SECRET_KEY": os.environ.get("JWT_SECRET_KEY", "loadtest-secret-" + "0" * 32),
+        # a load test measures the API, not how well the rate limits turn it away
+        "ANALYZE_RATE_LIMIT_PER_MINUTE": "0",
+        "ANALYZE_MAX_CONCURRENT_PER_USER": "0",
+        # logging in shouldn't cost a CPU core per request
+        "PASSWORD_HASH_ROUNDS": "4",
+        "LOG_LEVEL": "WARNING",
+        **(extra_env or {}),
+    }
+    mock = subprocess.Popen([sys.executable, str(BENCHMARKS / "mock_openai.py"), "--port", str(mock_port), *mock_argv])
+    api = subprocess.Popen([sys.executable, "-m", "cli.serve", "--host", "127.0.0.1", "--port", str(api_port),
+                            "--workers", str(workers)], cwd=SRC, env=env,
+                           stdout=None if verbose else subprocess.DEVNULL)
+    stack = Stack(f"http://127.0.0.1:{api_port}", f"http://127.0.0.1:{mock_port}", db_file, api, mock, env)
+    try:
+        wait_until_up(f"{stack.mock_url}/v1/models", mock)
+        wait_until_up(f"{stack.api_url}/openapi.json", api)
+        yield stack
+    finally:
+        for process in (api, mock):
+            process.terminate()
+        for process in (api, mock):
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        for path in db_dir.iterdir():
+            path.unlink()
+        db_dir.rmdir()
+
+
+async def login(client: httpx.AsyncClient, username: str, password: str, register: bool = True) -> str:
+    """
+    Returns an access token for the user (registering it first, if it doesn't exist yet).
+    """
+    if register:
+        r = await client.post("/users/", json={"username": username, "password": password})
+        # a 400 means that the user already exists, which is fine
+        if r.status_code not in (201, 400):
+            raise RuntimeError(f"Couldn't register {username}: {r.status_code} {r.text}")
+    r = await client.post("/users/token", data={"username": username, "password": password})
+    r.raise_for_status()
+    return r.json()["access_token"]
+
+
+def make_requirements(lines: int) -> bytes:
+    return "\n".join(f"package-{i}=={1 + i % 9}.{i % 13}.{i % 7}" for i in range(lines)).encode()
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """The nearest-rank percentile (`q` between 0 and 100) of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(latencies: list[float], elapsed: float) -> dict[str, float]:
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p90_ms": percentile(latencies, 90) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+    }
+
+
+async def drive_analyze(client: httpx.AsyncClient, token: str, concurrency: int, duration: float, warmup: float, lines: int) -> dict:
+    """
+    Keeps `concurrency` analyses in flight for `warmup + duration` seconds. Only the requests that start after the warm-up count.
+    """
+    data = make_requirements(lines)
+    headers = {"Authorization": f"Bearer {token}"}
+    latencies: list[float] = []
+    statuses: dict[str, int] = {}
+    outcomes: dict[str, int] = {}
+    start = monotonic()
+    measure_from, stop_at = start + warmup, start + warmup + duration
+
+    async def _worker(n: int) -> None:
+        i = 0
+        while monotonic() < stop_at:
+            counted = monotonic() >= measure_from
+            began = perf_counter()
+            try:
+                r = await client.post("/analyze", headers=headers, data={"project_name": f"loadtest-{n}-{i}"},
+                                      files={"file": ("requirements.txt", data, "text/plain")})
+                status = str(r.status_code)
+            except httpx.HTTPError as e:
+                r, status = None, type(e).__name__
+            took = perf_counter() - began
+            i += 1
+            if not counted:
+                continue
+            statuses[status] = statuses.get(status, 0) + 1
+            if r is not None and r.status_code == 200:
+                latencies.append(took)
+                outcome = r.json().get("status", "unknown")
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    await asyncio.gather(*(_worker(n) for n in range(concurrency)))
+    elapsed = monotonic() - measure_from
+    return {
+        "concurrency": concurrency,
+        "duration_s": elapsed,
+        "lines": lines,
+        **summarize(latencies, elapsed),
+        "statuses": statuses,
+        "analysis_statuses": outcomes,
+    }
+
+
+async def run(url: str, args: argparse.Namespace) -> dict:
+    # NOTE: every in-flight analysis needs a connection of its own
+    limits = httpx.Limits(max_connections=args.concurrency + 4, max_keepalive_connections=args.concurrency + 4)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=args.timeout) as client:
+        token = await login(client, args.username, args.password, register=args.register)
+        return await drive_analyze(client, token, args.concurrency, args.duration, args.warmup, args.lines)
+
+
+def print_report(results: dict) -> None:
+    print(f"{results['requests']} successful analyses in {results['duration_s']:.1f}s "
+          f"at concurrency {results['concurrency']}: {results['throughput_rps']:.2f} req/s", file=sys.stderr)
+    print("latency: " + " | ".join(f"{p} {results[f'{p}_ms']:.0f} ms" for p in ("p50", "p90", "p95", "p99", "max")),
+          file=sys.stderr)
+    print(f"HTTP statuses: {results['statuses']}, analyses: {results['analysis_statuses']}", file=sys.stderr)
+    if "mock" in results:
+        print(f"mock LLM: {results['mock']}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="load test this API instead of starting one")
+    parser.add_argument("--workers", type=int, default=1, help="API worker processes (when starting the API)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30.0, help="how long to measure (in seconds)")
+    parser.add_argument("--warmup", type=float, default=3.0, help="seconds of traffic before measuring")
+    parser.add_argument("--lines", type=int, default=50, help="lines per requirements file")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-request timeout (in seconds)")
+    parser.add_argument("--username", default="loadtest")
+    parser.add_argument("--password", default="loadtest")
+    parser.add_argument("--no-register", dest="register", action="store_false",
+                        help="log in as an existing user instead of registering one")
+    parser.add_argument("--output", "-o", help="also write the results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="show the API's access log")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    if args.url:
+        results = asyncio.run(run(args.url, args))
+    else:
+        with spawn_stack(mock_arguments(args), args.workers, verbose=args.verbose) as stack:
+            results = asyncio.run(run(stack.api_url, args))
+            results["mock"] = httpx.get(f"{stack.mock_url}/mock/stats").json()
+
+    print_report(results)
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
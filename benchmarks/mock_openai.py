@@ -0,0 +1,221 @@
+"""
+A local stand-in for the OpenAI chat completions API, so that load tests can go through the real
+HTTP path to the LLM (LangChain, the OpenAI client and its retries) without paying for tokens.
+
+Every completion is a schema-valid `AnalysisResult` for the packages in the prompt, either as a
+tool call (when the request has `tools`) or as JSON content (when it asks for a `response_format`).
+The latency of every completion is drawn from a distribution, and a share of the requests can be
+failed with a 500 or rate limited with a 429 (with a "Retry-After" header, like OpenAI does).
+
+Point the API at it with OPENAI_BASE_URL (the API key can be anything):
+    python benchmarks/mock_openai.py --port 8100 --latency lognormal --latency-mean 1.5 --rate-limit-rate 0.02
+    OPENAI_BASE_URL=http://127.0.0.1:8100/v1 OPENAI_API_KEY=mock python -m cli.serve
+
+GET /mock/stats returns how many completions were served, failed and rate limited.
+"""
+import re
+import math
+import random
+import asyncio
+import argparse
+from dataclasses import dataclass
+from datetime import date
+from hashlib import sha256
+from time import time
+from typing import Any, Literal, Optional
+from uuid import uuid4
+import orjson
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
+
+# the licenses that the mock hands out (picked by a hash of the package name, so they're stable)
+LICENSES = ("MIT", "Apache-2.0", "BSD-3-Clause", "BSD-2-Clause", "ISC", "MPL-2.0", "PSF-2.0")
+
+# these match the prompt that `get_llm_analysis` builds
+REQUIREMENTS_RE = re.compile(r"\(one per line\)\..*?:\n\n(.*?)\n\nUse this exact project name: ", re.DOTALL)
+PROJECT_NAME_RE = re.compile(r"Use this exact project name: (.*?) \(you may infer")
+PACKAGE_RE = re.compile(r"^\s*([A-Za-z0-9][A-Za-z0-9._-]*)\s*(?:\[[^\]]*\])?\s*(?:===?\s*([^\s;,#]+))?")
+
+
+@dataclass
+class MockConfig:
+    latency: Literal["constant", "uniform", "normal", "lognormal"] = "constant"
+    # the mean latency (in seconds), and how much it varies (the standard deviation for "normal"
+    # and "lognormal", or the half-width for "uniform")
+    latency_mean: float = 0.0
+    latency_jitter: float = 0.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after: float = 1.0
+    seed: Optional[int] = None
+
+
+class LatencySampler:
+    def __init__(self, config: MockConfig) -> None:
+        self.config = config
+        self._rng = random.Random(config.seed)
+
+    def sample(self) -> float:
+        c = self.config
+        if c.latency_mean <= 0:
+            return 0.0
+        if c.latency == "uniform":
+            return max(0.0, self._rng.uniform(c.latency_mean - c.latency_jitter, c.latency_mean + c.latency_jitter))
+        if c.latency == "normal":
+            return max(0.0, self._rng.gauss(c.latency_mean, c.latency_jitter))
+        if c.latency == "lognormal":
+            # picks mu/sigma so that the samples have the configured mean and standard deviation
+            # (LLM latencies have a long right tail, which is what makes this one realistic)
+            sigma2 = math.log(1 + (c.latency_jitter / c.latency_mean) ** 2)
+            return self._rng.lognormvariate(math.log(c.latency_mean) - sigma2 / 2, math.sqrt(sigma2))
+        return c.latency_mean
+
+    def roll(self) -> float:
+        return self._rng.random()
+
+
+def _text(content: Any) -> str:
+    # message content is either a string or a list of parts (e.g. [{"type": "text", "text": ...}])
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "\n".join(p.get("text", "") for p in content if isinstance(p, dict))
+    return ""
+
+
+def build_analysis(messages: list[dict[str, Any]]) -> dict[str, Any]:
+    """
+    Builds an `AnalysisResult` (as a dict) for the packages listed in the last user message.
+    """
+    prompt = next((_text(m.get("content")) for m in reversed(messages) if m.get("role") == "user"), "")
+    project = PROJECT_NAME_RE.search(prompt)
+    reqs = REQUIREMENTS_RE.search(prompt)
+    files = []
+    for line in (reqs.group(1).splitlines() if reqs else []):
+        match = PACKAGE_RE.match(line)
+        # DependencyReport needs a name of at least 2 characters
+        if not match or len(match.group(1)) < 2:
+            continue
+        name = match.group(1)
+        digest = sha256(name.lower().encode()).digest()
+        files.append({
+            "name": name,
+            "version": (match.group(2) or "unknown")[:80],
+            "license": LICENSES[digest[0] % len(LICENSES)],
+            "confidence_score": round(0.5 + digest[1] / 255 * 0.45, 2),
+        })
+    return {
+        "project_name": project.group(1) if project else "untitled",
+        "analysis_date": date.today().isoformat(),
+        "files": files,
+    }
+
+
+def _error(status_code: int, message: str, error_type: str, code: Optional[str] = None, headers: Optional[dict[str, str]] = None) -> Response:
+    body = {"error": {"message": message, "type": error_type, "param": None, "code": code}}
+    return Response(orjson.dumps(body), status_code=status_code, media_type="application/json", headers=headers)
+
+
+def create_mock_app(config: Optional[MockConfig] = None) -> FastAPI:
+    config = config or MockConfig()
+    sampler = LatencySampler(config)
+    stats = {"completions": 0, "errors": 0, "rate_limited": 0}
+    app = FastAPI(title="Mock OpenAI")
+    app.state.config = config
+    app.state.stats = stats
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request) -> Response:
+        body = orjson.loads(await request.body())
+        # the failures are decided before the wait, like a real gateway would turn you away early
+        roll = sampler.roll()
+        if roll < config.rate_limit_rate:
+            stats["rate_limited"] += 1
+            return _error(429, "Rate limit reached for requests (mock).", "requests", "rate_limit_exceeded",
+                          headers={"Retry-After": f"{config.retry_after:g}"})
+        await asyncio.sleep(sampler.sample())
+        if roll < config.rate_limit_rate + config.error_rate:
+            stats["errors"] += 1
+            return _error(500, "The server had an error while processing your request (mock).", "server_error")
+
+        content = orjson.dumps(build_analysis(body.get("messages", []))).decode()
+        message: dict[str, Any] = {"role": "assistant", "content": content, "refusal": None}
+        finish_reason = "stop"
+        tools = body.get("tools") or []
+        if tools:
+            # answer with the forced tool if there is one, otherwise with the first tool
+            choice = body.get("tool_choice")
+            name = (choice.get("function", {}).get("name") if isinstance(choice, dict) else None) \
+                or tools[0]["function"]["name"]
+            message["content"] = None
+            message["tool_calls"] = [{
+                "id": f"call_{uuid4().hex[:24]}",
+                "type": "function",
+                "function": {"name": name, "arguments": content},
+            }]
+            finish_reason = "tool_calls"
+
+        stats["completions"] += 1
+        prompt_tokens = sum(len(_text(m.get("content"))) for m in body.get("messages", [])) // 4
+        completion_tokens = len(content) // 4
+        return Response(orjson.dumps({
+            "id": f"chatcmpl-{uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "choices": [{"index": 0, "message": message, "logprobs": None, "finish_reason": finish_reason}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }), media_type="application/json")
+
+    @app.get("/v1/models")
+    async def list_models() -> dict[str, Any]:
+        return {"object": "list", "data": [{"id": "gpt-4o-mini", "object": "model", "created": 0, "owned_by": "mock"}]}
+
+    @app.get("/mock/stats")
+    async def read_stats() -> dict[str, int]:
+        return stats
+
+    return app
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency", choices=("constant", "uniform", "normal", "lognormal"), default="constant")
+    parser.add_argument("--latency-mean", type=float, default=0.0, help="mean latency per completion (in seconds)")
+    parser.add_argument("--latency-jitter", type=float, default=0.0,
+                        help="standard deviation (or half-width, for 'uniform') of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of completions that fail with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of requests that get a 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="the 429s' Retry-After (in seconds)")
+    parser.add_argument("--seed", type=int, help="makes the latencies and failures reproducible")
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+    return MockConfig(
+        latency=args.latency,
+        latency_mean=args.latency_mean,
+        latency_jitter=args.latency_jitter,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    uvicorn.run(create_mock_app(config_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+Soak test: runs a steady mix of analyses, logins and event listings against the API for hours (on
+SQLite, with the OpenAI stand-in from "mock_openai.py"), and watches the API for slow leaks.
+
+Every `--sample-interval` seconds, it scrapes the API's "/metrics" for the workers' RSS, their open
+file descriptors (which is where leaked sockets and upload temp files show up), the connections
+checked out of the DB pool, and the event loop's lag. Once the run is over, it fits a trend line
+to every one of them (skipping the `--warmup`, while caches are still filling up) and fails if any
+of them grows faster than its threshold per hour.
+
+The samples are summed over all of the workers (i.e. their "pid" labels). A scrape only reaches one
+worker, though, so with `--url`, the API must share its metrics between its workers (which
+"cli/serve.py" does by default); otherwise the samples jump from one worker to another.
+
+Usage:
+    python benchmarks/soak.py [--duration 4h] [--concurrency 8] [--sample-interval 30] [--output soak.json]
+        [--max-rss-growth 32] [--max-fd-growth 5] [--max-pool-growth 1] [--max-lag-growth 10]
+    python benchmarks/soak.py --url http://localhost:80 --duration 30m
+"""
+import sys
+import json
+import random
+import asyncio
+import argparse
+import statistics
+from collections import deque
+from time import monotonic
+from pathlib import Path
+import httpx
+
+BENCHMARKS = Path(__file__).resolve().parent
+if str(BENCHMARKS) not in sys.path:
+    sys.path.insert(0, str(BENCHMARKS))
+
+from loadtest import login, make_requirements, mock_arguments, spawn_stack  # noqa: E402
+from mock_openai import add_mock_arguments  # noqa: E402
+
+# what every trend is measured in (per hour), and how the thresholds are named on the command line
+TRENDS = {
+    "rss_mib": "max_rss_growth",
+    "open_fds": "max_fd_growth",
+    "db_pool_checked_out": "max_pool_growth",
+    "loop_lag_ms": "max_lag_growth",
+}
+
+
+def parse_duration(value: str) -> float:
+    """Parses a duration like "90", "45s", "30m" or "4h" into seconds."""
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    value = value.strip().lower()
+    if value and value[-1] in units:
+        return float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+
+def parse_metrics(text: str) -> dict[str, float]:
+    """
+    Parses the Prometheus text format into `{"name{labels}": value}`. Samples of the same name with different labels are also summed up under the bare name.
+    """
+    samples: dict[str, float] = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        key, _, value = line.rpartition(" ")
+        samples[key] = float(value)
+        name = key.split("{", 1)[0]
+        if name != key:
+            samples[name] = samples.get(name, 0.0) + float(value)
+    return samples
+
+
+class Sampler:
+    """Turns consecutive scrapes of "/metrics" into samples (the loop lag is averaged over the time between scrapes)."""
+
+    def __init__(self) -> None:
+        self._lag_sum = 0.0
+        self._lag_count = 0.0
+
+    def sample(self, elapsed: float, metrics: dict[str, float]) -> dict[str, float]:
+        lag_sum = metrics.get("event_loop_lag_seconds_sum", 0.0)
+        lag_count = metrics.get("event_loop_lag_seconds_count", 0.0)
+        measured = lag_count - self._lag_count
+        lag = (lag_sum - self._lag_sum) / measured if measured > 0 else 0.0
+        self._lag_sum, self._lag_count = lag_sum, lag_count
+        return {
+            "elapsed_s": elapsed,
+            "rss_mib": metrics.get("process_resident_memory_bytes", 0.0) / 2**20,
+            "open_fds": metrics.get("process_open_fds", 0.0),
+            "db_pool_checked_out": metrics.get("db_pool_checked_out", 0.0),
+            "loop_lag_ms": lag * 1000,
+        }
+
+
+def fit_trends(samples: list[dict[str, float]]) -> dict[str, float]:
+    """
+    Fits a least-squares line to every metric, and returns its slope (per hour).
+    """
+    hours = [s["elapsed_s"] / 3600 for s in samples]
+    trends = {}
+    for name in TRENDS:
+        values = [s[name] for s in samples]
+        if len(samples) < 3 or len(set(hours)) < 2:
+            trends[name] = 0.0
+        elif len(set(values)) == 1:
+            trends[name] = 0.0
+        else:
+            trends[name] = statistics.linear_regression(hours, values).slope
+    return trends
+
+
+async def drive_traffic(client: httpx.AsyncClient, token: str, stop_at: float, lines: int, rng: random.Random, counts: dict[str, int], projects: deque) -> None:
+    """
+    One simulated user: analyzes a project, lists the events of one of the recent ones, or logs in again (weighted 1:3:1).
+    """
+    headers = {"Authorization": f"Bearer {token}"}
+    data = make_requirements(lines)
+    while monotonic() < stop_at:
+        action = rng.choices(("analyze", "events", "login"), weights=(1, 3, 1))[0]
+        if action == "events" and not projects:
+            action = "analyze"
+        try:
+            if action == "analyze":
+                # every analysis gets a new project, so that listing events stays the same amount of work
+                project = f"soak-{counts.get('analyze', 0)}-{rng.getrandbits(32):08x}"
+                r = await client.post("/analyze", headers=headers, data={"project_name": project},
+                                      files={"file": ("requirements.txt", data, "text/plain")})
+                if r.status_code == 200:
+                    projects.append(project)
+            elif action == "events":
+                r = await client.get(f"/projects/{rng.choice(projects)}/events", headers=headers)
+            else:
+                r = await client.post("/users/token", data={"username": "soaktest", "password": "soaktest"})
+            key = f"{action} {r.status_code}"
+        except httpx.HTTPError as e:
+            key = f"{action} {type(e).__name__}"
+        counts[action] = counts.get(action, 0) + 1
+        counts[key] = counts.get(key, 0) + 1
+
+
+async def run(url: str, args: argparse.Namespace) -> dict:
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.concurrency + 4, max_keepalive_connections=args.concurrency + 4)
+    counts: dict[str, int] = {}
+    # the projects that were analyzed most recently (that's what people look at)
+    projects: deque = deque(maxlen=100)
+    samples: list[dict[str, float]] = []
+    sampler = Sampler()
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=args.timeout) as client, \
+            httpx.AsyncClient(base_url=url, timeout=30.0) as scraper:
+        token = await login(client, "soaktest", "soaktest")
+        start = monotonic()
+        stop_at = start + args.duration
+        users = [asyncio.create_task(drive_traffic(client, token, stop_at, args.lines, random.Random(rng.random()), counts, projects))
+                 for _ in range(args.concurrency)]
+        try:
+            while monotonic() < stop_at:
+                await asyncio.sleep(min(args.sample_interval, max(0.0, stop_at - monotonic())))
+                r = await scraper.get("/metrics")
+                r.raise_for_status()
+                sample = sampler.sample(monotonic() - start, parse_metrics(r.text))
+                samples.append(sample)
+                print(f"[{sample['elapsed_s']:8.0f}s] rss {sample['rss_mib']:.1f} MiB | fds {sample['open_fds']:.0f} | "
+                      f"pool {sample['db_pool_checked_out']:.0f} | lag {sample['loop_lag_ms']:.1f} ms | "
+                      f"analyses {counts.get('analyze', 0)}", file=sys.stderr)
+        finally:
+            await asyncio.gather(*users, return_exceptions=True)
+
+    measured = [s for s in samples if s["elapsed_s"] >= args.warmup]
+    trends = fit_trends(measured)
+    failures = [
+        f"{name} grew by {trends[name]:.2f}/h (more than {getattr(args, threshold):g}/h)"
+        for name, threshold in TRENDS.items() if trends[name] > getattr(args, threshold)
+    ]
+    if len(measured) < 3:
+        failures.append(f"only {len(measured)} sample(s) after the warm-up, which isn't enough for a trend")
+    return {
+        "duration_s": args.duration,
+        "concurrency": args.concurrency,
+        "requests": counts,
+        "trends_per_hour": trends,
+        "thresholds_per_hour": {name: getattr(args, threshold) for name, threshold in TRENDS.items()},
+        "failures": failures,
+        "samples": samples,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="soak this API instead of starting one (it needs METRICS_ENABLED)")
+    parser.add_argument("--duration", type=parse_duration, default="4h", help='e.g. "90m" or "12h"')
+    parser.add_argument("--warmup", type=parse_duration, default="5m",
+                        help="samples from before this are left out of the trends")
+    parser.add_argument("--sample-interval", type=parse_duration, default="30s")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--lines", type=int, default=20, help="lines per requirements file")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-request timeout (in seconds)")
+    parser.add_argument("--max-rss-growth", type=float, default=32.0, help="MiB per hour")
+    parser.add_argument("--max-fd-growth", type=float, default=5.0, help="file descriptors per hour")
+    parser.add_argument("--max-pool-growth", type=float, default=1.0, help="checked out connections per hour")
+    parser.add_argument("--max-lag-growth", type=float, default=10.0, help="milliseconds of loop lag per hour")
+    parser.add_argument("--output", "-o", help="also write the samples and trends as JSON")
+    parser.add_argument("--verbose", action="store_true", help="show the API's access log")
+    add_mock_arguments(parser)
+    # a soak test should look like production, so the stand-in takes a while to answer by default
+    parser.set_defaults(latency="lognormal", latency_mean=0.5, latency_jitter=0.2)
+    args = parser.parse_args()
+
+    if args.url:
+        results = asyncio.run(run(args.url, args))
+    else:
+        with spawn_stack(mock_arguments(args), verbose=args.verbose) as stack:
+            results = asyncio.run(run(stack.api_url, args))
+
+    print("trends per hour: " + " | ".join(
+        f"{name} {slope:+.2f}" for name, slope in results["trends_per_hour"].items()), file=sys.stderr)
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+    if results["failures"]:
+        sys.exit("Soak test failed: " + "; ".join(results["failures"]))
+    print("Soak test passed.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
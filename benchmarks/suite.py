@@ -0,0 +1,325 @@
+"""
+Benchmark suite for the hot paths of the API:
+- validators: `validate_requirements_file`/`parse_requirements_file` on files of 10 to 10,000 lines
+- security: `create_access_token` and `get_current_user` (with the user lookup stubbed out)
+- crud: `upsert_event`/`select_project_events` on SQLite
+- analyze: `POST /analyze` end to end, with the `FakeLLM` double from "tests/conftest.py" (which
+  waits `--llm-latency` seconds per call, so the numbers can be made to look like production)
+
+`run` writes the results as JSON. `compare` checks them against a saved baseline, and exits with 1
+if any benchmark got slower by more than `--threshold` (10% by default). Medians are compared,
+since they're less noisy than means.
+
+Usage:
+    python benchmarks/suite.py run [--output results.json] [--only validators crud] [--quick]
+    python benchmarks/suite.py compare baseline.json results.json [--threshold 0.10]
+"""
+import io
+import os
+import sys
+import json
+import asyncio
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+from datetime import datetime, timezone
+from time import perf_counter
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+from uuid import uuid4
+
+# makes sure that "src" (and "tests", for the fake LLM) are importable without setting PYTHONPATH manually
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+TESTS = ROOT / "tests"
+for path in (SRC, TESTS):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+# every benchmark gets a throwaway SQLite database. NOTE: DB_URL is overridden on purpose (instead of
+# `setdefault`), so that the benchmarks never write to whatever real database an exported DB_URL
+# points at
+DB_DIR = Path(tempfile.mkdtemp(prefix="licenseguard-bench-"))
+CRUD_DB_URL = f"sqlite+aiosqlite:///{DB_DIR / 'crud.db'}"
+
+# NOTE: these MUST come before we import anything from "srv", since the settings are read (and
+# cached) on import
+os.environ["DB_URL"] = f"sqlite+aiosqlite:///{DB_DIR / 'analyze.db'}"
+os.environ.pop("DB_READ_URL", None)
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark-secret-" + "0" * 32)
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+# the rate limits would turn most of the /analyze runs into 429s
+os.environ.setdefault("ANALYZE_RATE_LIMIT_PER_MINUTE", "0")
+os.environ.setdefault("ANALYZE_MAX_CONCURRENT_PER_USER", "0")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from fastapi import UploadFile  # noqa: E402
+from starlette.datastructures import Headers  # noqa: E402
+
+GROUPS = ("validators", "security", "crud", "analyze")
+
+Stats = dict[str, Any]
+
+
+def _stats(timings: list[float], iterations: int) -> Stats:
+    """Summarizes the rounds (in microseconds per call)."""
+    per_call = [t / iterations * 1e6 for t in timings]
+    return {
+        "unit": "us",
+        "median": statistics.median(per_call),
+        "mean": statistics.fmean(per_call),
+        "min": min(per_call),
+        "stdev": statistics.stdev(per_call) if len(per_call) > 1 else 0.0,
+        "rounds": len(per_call),
+        "iterations": iterations,
+    }
+
+
+def time_sync(fn: Callable[[], Any], iterations: int, rounds: int) -> Stats:
+    fn()  # warm up
+    timings = []
+    for _ in range(rounds):
+        start = perf_counter()
+        for _ in range(iterations):
+            fn()
+        timings.append(perf_counter() - start)
+    return _stats(timings, iterations)
+
+
+async def time_async(fn: Callable[[], Awaitable[Any]], iterations: int, rounds: int) -> Stats:
+    await fn()  # warm up
+    timings = []
+    for _ in range(rounds):
+        start = perf_counter()
+        for _ in range(iterations):
+            await fn()
+        timings.append(perf_counter() - start)
+    return _stats(timings, iterations)
+
+
+def make_requirements(lines: int) -> bytes:
+    return "\n".join(f"package-{i}=={1 + i % 9}.{i % 13}.{i % 7}" for i in range(lines)).encode()
+
+
+def _upload(data: bytes) -> UploadFile:
+    return UploadFile(io.BytesIO(data), filename="requirements.txt",
+                      headers=Headers({"content-type": "text/plain"}))
+
+
+async def bench_validators(quick: bool) -> dict[str, Stats]:
+    from srv.validators import parse_requirements_file, validate_requirements_file
+
+    results = {}
+    for lines in (10, 100, 1000, 10000):
+        file = _upload(make_requirements(lines))
+        # keep every benchmark at roughly the same total time
+        iterations = max(1, (200 if quick else 2000) // lines)
+        rounds = 3 if quick else 7
+
+        async def _validate():
+            await file.seek(0)
+            await validate_requirements_file(file)
+
+        async def _parse():
+            await file.seek(0)
+            await parse_requirements_file(file)
+
+        results[f"validators.validate_requirements_file[{lines}]"] = await time_async(_validate, iterations, rounds)
+        results[f"validators.parse_requirements_file[{lines}]"] = await time_async(_parse, iterations, rounds)
+    return results
+
+
+async def bench_security(quick: bool) -> dict[str, Stats]:
+    import services.users as users_service
+    from srv.schemas import UserPublic
+    from srv.security import create_access_token, get_current_user, token_cache
+
+    user = UserPublic(id=str(uuid4()), username="benchmark")
+
+    async def _lookup_user(session, username):
+        return user
+
+    # only the CPU cost of the auth path is measured, not the database
+    lookup_user, users_service.get_user = users_service.get_user, _lookup_user
+    token = create_access_token({"sub": user.username})
+    iterations = 500 if quick else 5000
+    rounds = 3 if quick else 7
+
+    async def _current_user_cold():
+        token_cache.clear()
+        users_service.user_cache.clear()
+        await get_current_user(token, None)
+
+    try:
+        return {
+            "security.create_access_token": time_sync(lambda: create_access_token({"sub": user.username}), iterations, rounds),
+            "security.get_current_user[cold]": await time_async(_current_user_cold, iterations, rounds),
+            "security.get_current_user[cached]": await time_async(lambda: get_current_user(token, None), iterations, rounds),
+        }
+    finally:
+        users_service.get_user = lookup_user
+        token_cache.clear()
+        users_service.user_cache.clear()
+
+
+async def bench_crud(quick: bool) -> dict[str, Stats]:
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from sqlmodel import SQLModel
+    from sqlmodel.ext.asyncio.session import AsyncSession
+    from crud.events import select_project_events, upsert_event
+    from srv.schemas import Event, EventType
+
+    engine = create_async_engine(CRUD_DB_URL)
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    sessionmaker = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    user_id = str(uuid4())
+    iterations = 50 if quick else 200
+    rounds = 3 if quick else 5
+
+    try:
+        async with sessionmaker() as session:
+            async def _upsert():
+                await upsert_event(session, Event(
+                    user_id=user_id, project_name="upserted", event=EventType.ANALYSIS_STARTED,
+                    timestamp=datetime.now(timezone.utc)))
+
+            results = {"crud.upsert_event": await time_async(_upsert, iterations, rounds)}
+
+            # a project with a handful of events (i.e. one analysis), and one with a long history
+            for count in (5, 500):
+                project_name = f"project-{count}"
+                session.add_all([Event(
+                    user_id=user_id, project_name=project_name, event=EventType.ANALYSIS_COMPLETED,
+                    content="{}", timestamp=datetime.now(timezone.utc)) for _ in range(count)])
+                await session.commit()
+                results[f"crud.select_project_events[{count}]"] = await time_async(
+                    lambda: select_project_events(session, user_id, project_name), iterations, rounds)
+        return results
+    finally:
+        await engine.dispose()
+
+
+def bench_analyze(quick: bool, llm_latency: float) -> dict[str, Stats]:
+    from fastapi.testclient import TestClient
+    from conftest import FakeLLM
+    import srv.app as app_module
+    from srv.schemas import UserPublic
+    from srv.security import get_current_user
+
+    user = UserPublic(id=str(uuid4()), username="benchmark")
+    app_module.app.dependency_overrides[get_current_user] = lambda: user
+    app_module.llm = FakeLLM(latency=llm_latency)
+    iterations = 10 if quick else 50
+    rounds = 3 if quick else 5
+
+    results = {}
+    try:
+        # NOTE: the context manager runs the lifespan (i.e. the real engine, on SQLite)
+        with TestClient(app_module.app) as client:
+            for lines in (10, 1000):
+                data = make_requirements(lines)
+
+                def _analyze():
+                    r = client.post("/analyze", files={"file": ("requirements.txt", data, "text/plain")},
+                                    data={"project_name": f"bench-{lines}"})
+                    if r.status_code != 200:
+                        raise RuntimeError(f"POST /analyze returned {r.status_code}: {r.text}")
+
+                results[f"analyze.post[{lines}]"] = time_sync(_analyze, iterations, rounds)
+    finally:
+        app_module.app.dependency_overrides.clear()
+        app_module.llm = None
+    return results
+
+
+def run(groups: list[str], quick: bool, llm_latency: float) -> dict[str, Any]:
+    results: dict[str, Stats] = {}
+    for group in groups:
+        print(f"Running the {group} benchmarks...", file=sys.stderr)
+        if group == "validators":
+            results.update(asyncio.run(bench_validators(quick)))
+        elif group == "security":
+            results.update(asyncio.run(bench_security(quick)))
+        elif group == "crud":
+            results.update(asyncio.run(bench_crud(quick)))
+        elif group == "analyze":
+            results.update(bench_analyze(quick, llm_latency))
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": quick,
+        "llm_latency": llm_latency,
+        "benchmarks": results,
+    }
+
+
+def compare(baseline: dict[str, Any], current: dict[str, Any], threshold: float) -> list[str]:
+    """
+    Prints how every benchmark changed since the baseline, and returns the names of the ones that got slower by more than `threshold` (e.g. 0.1 for 10%).
+    """
+    regressions = []
+    before, after = baseline["benchmarks"], current["benchmarks"]
+    for name in sorted(before.keys() | after.keys()):
+        if name not in after:
+            print(f"{name:>50}: missing from the results")
+            continue
+        if name not in before:
+            print(f"{name:>50}: {after[name]['median']:12.2f} us (new)")
+            continue
+        old, new = before[name]["median"], after[name]["median"]
+        change = (new - old) / old if old else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  <-- REGRESSION"
+            regressions.append(name)
+        elif change < -threshold:
+            flag = "  (faster)"
+        print(f"{name:>50}: {old:12.2f} us -> {new:12.2f} us ({change:+7.1%}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks and write the results as JSON")
+    run_parser.add_argument("--output", "-o", help="where to write the results (default: stdout)")
+    run_parser.add_argument("--only", nargs="+", choices=GROUPS, default=list(GROUPS))
+    run_parser.add_argument("--quick", action="store_true", help="fewer iterations (e.g. for CI smoke runs)")
+    run_parser.add_argument("--llm-latency", type=float, default=0.0,
+                            help="seconds that every fake LLM call takes in the analyze benchmarks")
+
+    compare_parser = subparsers.add_parser("compare", help="flag regressions against a saved baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("results")
+    compare_parser.add_argument("--threshold", type=float, default=0.10,
+                                help="how much slower a benchmark may get (default: 0.10, i.e. 10%%)")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        with open(args.results, encoding="utf-8") as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        if regressions:
+            sys.exit(f"{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}.")
+        return
+
+    try:
+        results = run([g for g in GROUPS if g in args.only], args.quick, args.llm_latency)
+    finally:
+        shutil.rmtree(DB_DIR, ignore_errors=True)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n", encoding="utf-8")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
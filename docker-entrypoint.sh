@@ -17,13 +17,19 @@ case "${1:-serve}" in
     echo "Running Alembic migrations..."
     alembic upgrade head "$@"
     ;;
+    provision-users)
+    shift
+    require_db
+    echo "Provisioning users..."
+    PYTHONPATH="$APP_DIR/src" exec /api/.venv/bin/python -m cli.provision_users "$@"
+    ;;
     serve)
     shift
     require_db
     echo "Starting API..."
-    exec /api/.venv/bin/fastapi run src/srv/app.py --port 80 --host 0.0.0.0 "$@"
+    PYTHONPATH="$APP_DIR/src" exec /api/.venv/bin/python -m cli.serve "$@"
     ;;
     *)
-    echo "Unknown subcommand: $1 (expected 'serve' or 'migrate')" >&2; exit 2
+    echo "Unknown subcommand: $1 (expected 'serve', 'migrate' or 'provision-users')" >&2; exit 2
     ;;
 esac
\ No newline at end of file
@@ -0,0 +1,34 @@
+"""add idempotency keys
+
+Revision ID: 2b7e4f0c9d15
+Revises: 8c4f1d2e6a90
+Create Date: 2026-10-19 14:12:08.316045
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2b7e4f0c9d15'
+down_revision: Union[str, Sequence[str], None] = '8c4f1d2e6a90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "idempotencykey",
+        sa.Column("key", sa.VARCHAR(200), primary_key=True, nullable=False),
+        sa.Column("fingerprint", sa.VARCHAR(64), nullable=False),
+        sa.Column("response", sa.TEXT, nullable=True),
+        sa.Column("expires_at", sa.Float, nullable=False)
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("idempotencykey")
@@ -0,0 +1,41 @@
+"""add api keys
+
+Revision ID: 5e2a9c1f7b3d
+Revises: bdc4d0bc52c4
+Create Date: 2026-10-19 09:12:44.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mssql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e2a9c1f7b3d'
+down_revision: Union[str, Sequence[str], None] = 'bdc4d0bc52c4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "apikey",
+        sa.Column("id", sa.VARCHAR(36), primary_key=True, nullable=False),
+        sa.Column("user_id", sa.VARCHAR(36), sa.ForeignKey("user.id", ondelete="CASCADE", name="fk_apikey_user_id_user"), nullable=False),
+        sa.Column("name", sa.VARCHAR(100), nullable=False),
+        sa.Column("prefix", sa.VARCHAR(16), nullable=False),
+        sa.Column("hashed_key", sa.VARCHAR(64), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True).with_variant(mssql.DATETIMEOFFSET(precision=6), "mssql"), nullable=False)
+    )
+    op.create_index("ix_apikey_prefix", "apikey", ["prefix"], unique=True)
+    op.create_index("ix_apikey_user_id", "apikey", ["user_id"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_apikey_user_id", "apikey")
+    op.drop_index("ix_apikey_prefix", "apikey")
+    op.drop_table("apikey")
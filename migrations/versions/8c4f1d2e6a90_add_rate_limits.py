@@ -0,0 +1,43 @@
+"""add rate limits
+
+Revision ID: 8c4f1d2e6a90
+Revises: 5e2a9c1f7b3d
+Create Date: 2026-10-19 11:03:27.904512
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c4f1d2e6a90'
+down_revision: Union[str, Sequence[str], None] = '5e2a9c1f7b3d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "ratelimitbucket",
+        sa.Column("key", sa.VARCHAR(100), primary_key=True, nullable=False),
+        sa.Column("tokens", sa.Float, nullable=False),
+        sa.Column("updated_at", sa.Float, nullable=False)
+    )
+
+    op.create_table(
+        "concurrencyslot",
+        sa.Column("id", sa.VARCHAR(36), primary_key=True, nullable=False),
+        sa.Column("key", sa.VARCHAR(100), nullable=False),
+        sa.Column("expires_at", sa.Float, nullable=False)
+    )
+    op.create_index("ix_concurrencyslot_key", "concurrencyslot", ["key"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_concurrencyslot_key", "concurrencyslot")
+    op.drop_table("concurrencyslot")
+    op.drop_table("ratelimitbucket")
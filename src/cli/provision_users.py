@@ -0,0 +1,81 @@
+"""
+Creates many users at once from a CSV file (e.g. when onboarding a team).
+
+The CSV needs a header row with a "username" and a "password" column. The "email" and
+"full_name" columns are optional. Usernames that are already registered are skipped.
+
+Usage (from the "src" directory, or with "src" on the PYTHONPATH):
+    python -m cli.provision_users users.csv
+    cat users.csv | python -m cli.provision_users -
+"""
+import sys
+import csv
+import asyncio
+import argparse
+from time import perf_counter
+from typing import TextIO
+from pydantic import ValidationError
+from core.config import get_settings
+from db.session import init_engine, close_engine, get_sessionmaker
+from services.users import create_users
+from srv.schemas import UserCreate
+
+
+def read_users(f: TextIO) -> list[UserCreate]:
+    """
+    Reads and validates the users in a CSV file. Raises a `ValueError` (pointing at the offending row) if any of them are invalid.
+    """
+    users: list[UserCreate] = []
+    # row 1 is the header
+    for row_num, row in enumerate(csv.DictReader(f), start=2):
+        try:
+            users.append(UserCreate(
+                username=row.get("username") or "",
+                password=row.get("password") or "",
+                email=row.get("email") or None,
+                full_name=row.get("full_name") or None
+            ))
+        except ValidationError as e:
+            raise ValueError(f"Row {row_num} is invalid: {e}") from e
+    return users
+
+
+async def provision(users: list[UserCreate]) -> tuple[int, list[str]]:
+    settings = get_settings()
+    await init_engine(
+        str(settings.db_url),
+        max_retries=5,
+        retry_delay=1.0,
+        startup_mode=settings.db_startup_mode
+    )
+    try:
+        async with get_sessionmaker()() as session:
+            created, skipped = await create_users(session, users)
+    finally:
+        await close_engine()
+    return len(created), skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("csv_file", help="path to the CSV file (or '-' for stdin)")
+    args = parser.parse_args()
+
+    try:
+        if args.csv_file == "-":
+            users = read_users(sys.stdin)
+        else:
+            with open(args.csv_file, newline="", encoding="utf-8") as f:
+                users = read_users(f)
+    except ValueError as e:
+        sys.exit(str(e))
+
+    start = perf_counter()
+    created, skipped = asyncio.run(provision(users))
+    print(f"Created {created} user(s) in {perf_counter() - start:.2f}s.")
+    if skipped:
+        print(f"Skipped {len(skipped)} username(s) that were already registered (or repeated): {', '.join(skipped)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Runs the API in production: one worker process per CPU (or SERVER_WORKERS), on uvloop and
+httptools when they're installed.
+
+On SIGTERM/SIGINT, the workers stop accepting connections and give in-flight requests (e.g.
+analyses that are waiting on the LLM) up to SERVER_GRACEFUL_TIMEOUT seconds to finish before
+they shut down.
+
+The workers share a port, so a scrape of "/metrics" only reaches one of them. With more than one
+worker, they share their metrics through a temporary directory (METRICS_DIR), so that every scrape
+reports all of them.
+
+Usage (from the "src" directory, or with "src" on the PYTHONPATH):
+    python -m cli.serve [--workers 8] [--port 80] [--no-proxy-headers]
+"""
+import os
+import logging
+import shutil
+import argparse
+import tempfile
+from importlib.util import find_spec
+from pathlib import Path
+from typing import Any, Optional
+from core.config import Settings, get_settings
+
+logger = logging.getLogger(__name__)
+
+SRC = Path(__file__).resolve().parents[1]
+
+
+def get_worker_count(settings: Settings, workers: Optional[int] = None) -> int:
+    return max(1, workers or settings.server_workers or os.cpu_count() or 1)
+
+
+def check_worker_settings(settings: Settings, workers: int) -> None:
+    """
+    Makes sure that nothing that has to be shared between the workers is only kept in a worker's memory (and warns about what should be).
+    """
+    if workers > 1 and settings.idempotency_backend == "memory":
+        raise RuntimeError(
+            f'IDEMPOTENCY_BACKEND="memory" does not work with {workers} workers (a retry that lands on '
+            'another worker would run again), so use "database" or SERVER_WORKERS=1.')
+    limited = settings.analyze_rate_limit_per_minute > 0 or settings.analyze_max_concurrent_per_user > 0
+    if workers > 1 and limited and settings.rate_limit_backend == "memory":
+        # NOTE: unlike the idempotency keys, this only makes the limits looser, so it's allowed
+        logger.warning(
+            'With RATE_LIMIT_BACKEND="memory", each of the %d workers enforces the rate limits on its '
+            'own (i.e. a user gets up to %dx the limits). Use "database" to share them.', workers, workers)
+
+
+def get_server_options(settings: Settings, args: argparse.Namespace) -> dict[str, Any]:
+    """
+    Builds the keyword arguments for `uvicorn.run`.
+    """
+    return {
+        # NOTE: the workers build their own app (through the factory), since an app can't be
+        # shared between processes
+        "app": "srv.app:create_app",
+        "factory": True,
+        "host": args.host or settings.server_host,
+        "port": args.port or settings.server_port,
+        "workers": get_worker_count(settings, args.workers),
+        # uvloop and httptools are quite a bit faster than the pure-Python defaults, but they
+        # aren't available everywhere (e.g. uvloop doesn't support Windows)
+        "loop": "uvloop" if find_spec("uvloop") else "asyncio",
+        "http": "httptools" if find_spec("httptools") else "h11",
+        "backlog": settings.server_backlog,
+        "timeout_keep_alive": settings.server_keepalive_timeout,
+        "timeout_graceful_shutdown": settings.server_graceful_timeout,
+        "proxy_headers": args.proxy_headers,
+        "forwarded_allow_ips": args.forwarded_allow_ips,
+        "root_path": args.root_path,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", help="defaults to SERVER_HOST")
+    parser.add_argument("--port", type=int, help="defaults to SERVER_PORT")
+    parser.add_argument("--workers", type=int, help="defaults to SERVER_WORKERS (or 1 per CPU)")
+    parser.add_argument("--proxy-headers", action=argparse.BooleanOptionalAction, default=True,
+                        help="trust the X-Forwarded-* headers from FORWARDED_ALLOW_IPS (e.g. behind a TLS termination proxy)")
+    parser.add_argument("--forwarded-allow-ips", default=None)
+    parser.add_argument("--root-path", default="")
+    args = parser.parse_args()
+
+    # the workers are separate processes, so they need to find "src" on their own
+    os.environ["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [str(SRC), os.environ.get("PYTHONPATH")]))
+
+    import uvicorn
+    settings = get_settings()
+    options = get_server_options(settings, args)
+    check_worker_settings(settings, options["workers"])
+    # the workers share a port (so a scrape only reaches one of them), so they share their metrics
+    # through a directory instead (see "srv/routers/metrics.py")
+    metrics_dir = None
+    if options["workers"] > 1 and settings.metrics_enabled and not settings.metrics_dir:
+        metrics_dir = tempfile.mkdtemp(prefix="licenseguard-metrics-")
+        os.environ["METRICS_DIR"] = metrics_dir
+    try:
+        uvicorn.run(**options)
+    finally:
+        if metrics_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
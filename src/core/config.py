@@ -1,4 +1,5 @@
 from functools import lru_cache
+from typing import Literal
 from pydantic import SecretStr
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from sqlalchemy.engine import URL
@@ -12,10 +13,147 @@ class Settings(BaseSettings):
         env_file=ROOT / ".env", env_file_encoding='utf-8')
 
     openai_api_key: SecretStr | None = None
+    # points the LLM at another OpenAI-compatible server (e.g. "benchmarks/mock_openai.py" during
+    # load tests); the real OpenAI API is used by default
+    openai_base_url: str | None = None
+    # records the LLM's analyses to `llm_cassette_path` ("record"), or answers every analysis from
+    # there without calling the LLM at all ("replay"; e.g. for benchmarks and regression tests)
+    llm_cassette_mode: Literal["off", "record", "replay"] = "off"
+    llm_cassette_path: Path = ROOT / "data" / "llm_cassette.jsonl"
+    # LangChain is imported on the first analysis by default (so that workers boot quickly); turn
+    # this on to import it on startup instead
+    llm_preload: bool = False
     jwt_secret_key: SecretStr | None = None
     jwt_algorithm: str = "HS256"
     jwt_access_token_expire_minutes: int = 30
+    # how many verified JWTs to remember (0 turns the cache off)
+    jwt_decode_cache_size: int = 4096
+    # API keys are stored as HMACs keyed with this secret (defaults to JWT_SECRET_KEY)
+    api_key_secret: SecretStr | None = None
     db_url: str | URL | None = None
+    # optional read replica; read-only service calls are routed here when it's set
+    db_read_url: str | URL | None = None
+    # "create_all" creates any missing tables at boot; "verify" only checks that the database is
+    # at the latest Alembic revision (i.e. you ran the migrations), which is much cheaper
+    db_startup_mode: Literal["create_all", "verify"] = "create_all"
+    # write-behind outbox for events: events are spooled to disk and written to the DB in bulk by
+    # a background task, so that requests don't have to wait on DB commits
+    event_outbox_enabled: bool = False
+    event_outbox_dir: Path = ROOT / "data" / "outbox"
+    event_outbox_batch_size: int = 500
+    event_outbox_flush_interval: float = 0.05
+    # fsync every spooled event (survives power loss, but costs a disk flush per event)
+    event_outbox_fsync: bool = False
+    # how many events can wait to be written before requests have to write their events themselves
+    # (this is what caps the outbox's memory while the DB is down)
+    event_outbox_max_pending: int = 10000
+    # bcrypt runs in a pool of threads (instead of on the event loop); this caps how many hashes
+    # can run at once
+    password_hash_workers: int = 4
+    # new passwords are hashed with this scheme; hashes made with any other scheme (or cost) are
+    # still accepted, and upgraded the next time their user logs in
+    password_hash_scheme: Literal["bcrypt", "pbkdf2_sha256", "sha256_crypt", "sha512_crypt"] = "bcrypt"
+    # the cost (i.e. rounds) of the scheme; leave unset for passlib's default (bcrypt: 12)
+    password_hash_rounds: int | None = None
+    # while a user is cached, a verified JWT for them is trusted without looking them up in the DB
+    # (entries never outlive the token that cached them). NOTE: every worker has its own cache, and
+    # saving a user only clears the cache of the worker that saved it, so the other workers can keep
+    # using the old user for up to `auth_user_cache_ttl` seconds
+    auth_user_cache_enabled: bool = True
+    auth_user_cache_ttl: float = 30.0
+    auth_user_cache_size: int = 1024
+    # the same goes for the users behind API keys, so a revoked key keeps working on the other
+    # workers for up to this many seconds (0 turns the cache off)
+    api_key_cache_ttl: float = 5.0
+    # users that are allowed to use the admin routes (e.g. bulk provisioning)
+    admin_usernames: list[str] = []
+    # bulk provisioning hashes passwords on a pool of processes (defaults to 1 per CPU)
+    bulk_hash_workers: int | None = None
+    bulk_provision_max_users: int = 10000
+    # per-user limits for "POST /analyze", so that one user can't hog the LLM provider's rate
+    # limit. "memory" limits each worker on its own (i.e. with 4 workers, a user effectively gets
+    # 4x the limits); "database" shares the limits across workers, but costs a few small commits
+    # per analysis
+    rate_limit_backend: Literal["memory", "database"] = "memory"
+    # token bucket: a user can start `burst` analyses at once, then `per_minute` more every minute
+    # (0 turns it off)
+    analyze_rate_limit_per_minute: float = 10.0
+    analyze_rate_limit_burst: int = 5
+    # how many analyses a user can have running at once (0 turns it off)
+    analyze_max_concurrent_per_user: int = 2
+    # a running analysis stops counting towards the limit this many seconds after its worker died
+    # without giving its slot back. the slot is extended every `ttl / 3` seconds while the analysis
+    # runs, so a slow one doesn't lose it (only used by the "database" backend)
+    analyze_slot_ttl: float = 300.0
+    # "Idempotency-Key" support for /analyze: the first response per (user, key) is kept for
+    # `idempotency_ttl` seconds and handed back to retries. the "database" backend shares the
+    # responses between workers; "memory" only works with a single worker (see "cli/serve.py")
+    idempotency_backend: Literal["memory", "database"] = "database"
+    idempotency_ttl: float = 86400.0
+    # a FAILED analysis (i.e. the LLM didn't come through) is only kept for this long, so that a
+    # later retry gets another go at the LLM
+    idempotency_failed_ttl: float = 60.0
+    # a request's claim on its key expires after this many seconds, even if its worker died before
+    # it could finish (or give the key back)
+    idempotency_claim_ttl: float = 300.0
+    # how long a retry waits for the original request to finish before giving up with a 409, and
+    # how long the 409 tells it to wait before trying again
+    idempotency_wait_timeout: float = 120.0
+    idempotency_retry_after: int = 5
+    # serves the Prometheus metrics on "/metrics" (keep it away from the public internet, e.g.
+    # by only routing it on an internal port of the load balancer)
+    metrics_enabled: bool = True
+    # the workers share a port, so a scrape only ever reaches one of them. with `metrics_dir` set,
+    # every worker writes its metrics there every `metrics_share_interval` seconds, and "/metrics"
+    # reports all of them (with a "pid" label each). "cli/serve.py" sets it to a temporary directory
+    # whenever it starts more than one worker
+    metrics_dir: Path | None = None
+    metrics_share_interval: float = 5.0
+    # logs are written by a background thread (see "core/logs.py"), as JSON lines by default
+    log_level: str = "INFO"
+    log_format: Literal["json", "text"] = "json"
+    # per-module levels, e.g. LOG_LEVELS='{"srv.security": "WARNING"}'
+    log_levels: dict[str, str] = {}
+    # the fraction of INFO/DEBUG records to keep for noisy modules (warnings and errors are
+    # always kept). "crud.events" logs every single event, i.e. 5 lines per analysis
+    log_sample_rates: dict[str, float] = {"crud.events": 0.1}
+    # request tracing: "console" writes the spans to stdout, and "file" appends them to
+    # `tracing_file` (both as OTLP/JSON lines, which an OpenTelemetry collector can pick up)
+    tracing_exporter: Literal["none", "console", "file"] = "none"
+    tracing_file: Path = ROOT / "data" / "traces.jsonl"
+    # the fraction of traces to keep (requests that come with a "traceparent" follow the caller)
+    tracing_sample_rate: float = 1.0
+    tracing_service_name: str = "licenseguard-api"
+    # event loop lag: every `loop_monitor_interval` seconds, a timer measures how late the loop ran it
+    # (see "event_loop_lag_seconds" on "/metrics"). with `loop_monitor_debug` on, a watchdog thread
+    # also logs what the loop is stuck on whenever it's been blocked for `loop_block_threshold` seconds
+    loop_monitor_enabled: bool = True
+    loop_monitor_interval: float = 0.5
+    loop_block_threshold: float = 0.1
+    loop_monitor_debug: bool = False
+    # per-request profiling: admins can send "X-Profile: 1" (or "?profile=1") to profile a request,
+    # and the profile is written to `profiling_dir`. off by default, since the middleware isn't even
+    # installed then
+    profiling_enabled: bool = False
+    profiling_dir: Path = ROOT / "data" / "profiles"
+    profiling_format: Literal["speedscope", "pstats"] = "speedscope"
+    # production serve mode (see "cli/serve.py"): one worker process per CPU by default
+    server_host: str = "0.0.0.0"
+    server_port: int = 80
+    server_workers: int | None = None
+    server_backlog: int = 2048
+    # keep idle connections open for longer than the load balancer does (e.g. 60s on AWS ALBs),
+    # otherwise it might send a request on a connection that we're about to close
+    server_keepalive_timeout: int = 65
+    # on shutdown, in-flight requests (e.g. analyses waiting on the LLM) get this many seconds to
+    # finish before they're cancelled
+    server_graceful_timeout: int = 60
+    # result-bearing responses (e.g. analyses) at least this big (in bytes) are compressed with
+    # brotli or gzip, if the client accepts it (0 compresses everything)
+    compression_min_size: int = 1024
+    compression_gzip_level: int = 6
+    # brotli goes from 0 to 11; anything above ~5 is too slow to do on every request
+    compression_brotli_quality: int = 4
 
 
 @lru_cache
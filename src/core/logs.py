@@ -0,0 +1,111 @@
+import sys
+import logging
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from typing import Optional, TextIO
+import orjson
+from core.config import Settings
+
+# the attributes that every `LogRecord` has; anything else was passed in through `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message", "asctime", "taskName"}
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats every record as a single line of JSON (which is what log collectors want). Whatever is passed in through `extra` ends up as a field of its own.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        # NOTE: `default=str` makes sure that a weird `extra` can never break logging
+        return orjson.dumps(entry, default=str).decode()
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only a fraction of the records of noisy loggers (e.g. 0.1 keeps every 10th record). Warnings and errors are never dropped.
+    """
+
+    def __init__(self, rates: dict[str, float]) -> None:
+        super().__init__()
+        self.rates = rates
+        self._credit: dict[str, float] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._get_rate(record.name)
+        if rate >= 1:
+            return True
+        # NOTE: every record earns `rate` credit and a record is kept once there's a whole one,
+        # so e.g. 0.25 keeps exactly 1 in 4 records (instead of roughly, like random sampling)
+        credit = self._credit.get(record.name, 1.0 - rate) + rate
+        keep = credit >= 1
+        self._credit[record.name] = credit - 1 if keep else credit
+        return keep
+
+    def _get_rate(self, name: str) -> float:
+        # the most specific logger wins (e.g. "crud.events" before "crud")
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition(".")[0]
+        return 1.0
+
+
+# the listener thread of this worker (if logging was set up)
+listener: Optional[QueueListener] = None
+queue_handler: Optional[QueueHandler] = None
+
+
+def setup_logging(settings: Settings, stream: Optional[TextIO] = None) -> QueueListener:
+    """
+    Sends the app's logs through a queue to a background thread, which does the actual (blocking) writing to `stream` (stdout by default). That way, a slow stdout (e.g. a container's log pipe under load) can't stall the event loop.
+    """
+    global listener, queue_handler  # we gotta modify the pre-existing listener
+    if listener:
+        return listener
+
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JSONFormatter() if settings.log_format == "json" else logging.Formatter(
+        "[%(asctime)s] %(levelname)s %(name)s: %(message)s"))
+
+    queue: SimpleQueue = SimpleQueue()
+    queue_handler = QueueHandler(queue)
+    # dropping records before they're queued up is what makes sampling cheap
+    queue_handler.addFilter(SamplingFilter(settings.log_sample_rates))
+
+    root = logging.getLogger()
+    root.addHandler(queue_handler)
+    root.setLevel(settings.log_level.upper())
+    for name, level in settings.log_levels.items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    listener = QueueListener(queue, handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def shutdown_logging() -> None:
+    """
+    Writes out whatever is left in the queue, then stops the listener thread.
+    """
+    global listener, queue_handler  # we gotta modify the pre-existing listener
+    if queue_handler:
+        logging.getLogger().removeHandler(queue_handler)
+        queue_handler = None
+    if listener:
+        listener.stop()
+        listener = None
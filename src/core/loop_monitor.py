@@ -0,0 +1,116 @@
+import sys
+import asyncio
+import logging
+import threading
+import traceback
+from time import monotonic
+from typing import Optional
+from core.config import Settings
+from core.metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "event_loop_lag_seconds", "How late the event loop ran the lag monitor's timer (i.e. how long other callbacks kept it busy).",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+EVENT_LOOP_LAG_LAST_SECONDS = Gauge(
+    "event_loop_lag_last_seconds", "The most recent event loop lag measurement.")
+EVENT_LOOP_BLOCKED = Counter(
+    "event_loop_blocked", "Times that the event loop lagged behind by at least the blocking threshold.")
+
+
+class LoopMonitor:
+    """
+    Measures the event loop's scheduling delay: every `interval` seconds, a timer checks how late the loop woke it up. A healthy loop wakes it up within a millisecond or so; anything more means that some callback (e.g. a sync call that should've been run in a thread) kept the loop from doing anything else.
+
+    With `debug` on, a watchdog thread also logs the stack of the event loop's thread whenever the timer is overdue by `threshold` seconds, i.e. *while* the loop is still blocked, which points right at the offending call. The stack is sampled once per overdue timer, so a callback that starts blocking right after the timer fired is only caught on the next one.
+    """
+
+    def __init__(self, interval: float = 0.5, threshold: float = 0.1, debug: bool = False) -> None:
+        self.interval = interval
+        self.threshold = threshold
+        self.debug = debug
+        # when the timer should fire next. NOTE: this is always on `monotonic`'s clock, never the loop's,
+        # since the watchdog thread compares against it (and e.g. uvloop's `loop.time()` is libuv's
+        # cached clock, which is only updated once per loop iteration)
+        self._due = monotonic() + interval
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        """
+        Starts measuring (and watching, in debug mode). This has to be called from the event loop that should be monitored.
+        """
+        loop = asyncio.get_running_loop()
+        # asyncio's own debug mode names the slow callbacks too, so make it use the same threshold
+        if loop.get_debug():
+            loop.slow_callback_duration = self.threshold
+        self._task = loop.create_task(self._measure_forever(), name="loop-monitor")
+        if self.debug:
+            self._watchdog = threading.Thread(
+                target=self._watch_forever, args=(threading.get_ident(),), name="loop-watchdog", daemon=True)
+            self._watchdog.start()
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog:
+            await asyncio.to_thread(self._watchdog.join)
+            self._watchdog = None
+
+    async def _measure_forever(self) -> None:
+        while True:
+            self._due = monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, monotonic() - self._due)
+            EVENT_LOOP_LAG_SECONDS.observe(lag)
+            EVENT_LOOP_LAG_LAST_SECONDS.set(lag)
+            if lag >= self.threshold:
+                EVENT_LOOP_BLOCKED.inc()
+
+    def _watch_forever(self, loop_thread_id: int) -> None:
+        # NOTE: this runs on its own thread, so it only reads `_due` (and logs, which is thread-safe);
+        # the metrics are left to the loop
+        reported_due = None
+        while not self._stopped.wait(self.threshold / 2):
+            due = self._due
+            overdue = monotonic() - due
+            if overdue < self.threshold or due == reported_due:
+                continue
+            reported_due = due
+            frame = sys._current_frames().get(loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "(no stack available)\n"
+            logger.warning(
+                "The event loop has been blocked for at least %.3fs. It's currently running:\n%s",
+                overdue, stack.rstrip(), extra={"blocked_seconds": round(overdue, 3)})
+
+
+# the lag monitor of this worker (if it's enabled)
+monitor: Optional[LoopMonitor] = None
+
+
+def start_loop_monitor(settings: Settings) -> Optional[LoopMonitor]:
+    """
+    Starts monitoring the running event loop, if `loop_monitor_enabled` is on.
+    """
+    global monitor  # we gotta modify the pre-existing monitor
+    if monitor or not settings.loop_monitor_enabled:
+        return monitor
+    monitor = LoopMonitor(settings.loop_monitor_interval,
+                          settings.loop_block_threshold, settings.loop_monitor_debug)
+    monitor.start()
+    return monitor
+
+
+async def stop_loop_monitor() -> None:
+    global monitor  # we gotta modify the pre-existing monitor
+    if monitor:
+        await monitor.stop()
+        monitor = None
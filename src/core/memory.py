@@ -0,0 +1,105 @@
+import os
+import gc
+import sys
+import tracemalloc
+from typing import Literal, Optional
+
+# "resource" is POSIX-only, so without it (e.g. on Windows) the peak RSS is reported as 0
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+# the snapshot that diffs are compared to (taken when tracing starts, or on demand)
+baseline: Optional[tracemalloc.Snapshot] = None
+
+# allocations made by tracemalloc itself (or by the import system) are just noise
+SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def get_rss() -> tuple[int, int]:
+    """
+    Returns the current and the peak resident set size (in bytes) of this process.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else 0
+    # Linux reports the peak in KiB, macOS in bytes
+    peak = peak if sys.platform == "darwin" else peak * 1024
+    try:
+        # NOTE: only Linux has /proc; the second field is the resident set (in pages)
+        with open("/proc/self/statm", "rb") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        current = peak
+    return current, peak
+
+
+def get_gc_stats() -> dict[str, object]:
+    stats = gc.get_stats()
+    return {
+        "counts": list(gc.get_count()),
+        "collections": [s["collections"] for s in stats],
+        "collected": [s["collected"] for s in stats],
+        "uncollectable": [s["uncollectable"] for s in stats],
+        "garbage": len(gc.garbage),
+    }
+
+
+def take_snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+
+
+def start_tracing(frames: int = 1) -> None:
+    """
+    Starts tracing allocations (which slows down every allocation and uses extra memory, so don't leave it on) and takes the baseline snapshot.
+    """
+    global baseline     # we gotta modify the pre-existing baseline
+    if tracemalloc.is_tracing() and tracemalloc.get_traceback_limit() != frames:
+        tracemalloc.stop()
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    baseline = take_snapshot()
+
+
+def stop_tracing() -> None:
+    global baseline     # we gotta modify the pre-existing baseline
+    baseline = None
+    tracemalloc.stop()
+
+
+def reset_baseline() -> None:
+    """
+    Makes the current state the one that diffs are compared to.
+    """
+    global baseline     # we gotta modify the pre-existing baseline
+    if tracemalloc.is_tracing():
+        baseline = take_snapshot()
+
+
+def _location(stat) -> str:
+    return " <- ".join(f"{frame.filename}:{frame.lineno}" for frame in stat.traceback)
+
+
+def get_allocation_sites(limit: int = 20, group_by: Literal["lineno", "filename", "traceback"] = "lineno") -> tuple[list[dict], list[dict]]:
+    """
+    Returns the `limit` biggest allocation sites, and the `limit` sites that grew the most since the baseline. Taking a snapshot takes a while with a big heap, so run this in a thread.
+    """
+    if not tracemalloc.is_tracing():
+        return [], []
+    snapshot = take_snapshot()
+    top = [
+        {"location": _location(stat), "size_bytes": stat.size, "count": stat.count}
+        for stat in snapshot.statistics(group_by)[:limit]
+    ]
+    diff = []
+    if baseline is not None:
+        diff = [
+            {"location": _location(stat), "size_bytes": stat.size, "count": stat.count,
+             "size_diff_bytes": stat.size_diff, "count_diff": stat.count_diff}
+            for stat in snapshot.compare_to(baseline, group_by)[:limit]
+        ]
+    return top, diff
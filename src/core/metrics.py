@@ -0,0 +1,291 @@
+import abc
+from bisect import bisect_left
+from math import inf, isnan
+from time import perf_counter
+from typing import Any, Callable, Iterable, Optional
+
+# NOTE: metrics are only ever updated from the event loop's thread, so none of these take locks.
+# if you need to record something from a worker thread, hand the value back to the loop first.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25,
+                   0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0, 30.0, 60.0)
+
+# the Prometheus text exposition format
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _Metric(abc.ABC):
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), registry: Optional["Registry"] = None) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], "_Metric"] = {}
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, *values: str):
+        """
+        Returns the child metric for the given label values (creating it on first use).
+        """
+        if len(values) != len(self.labelnames):
+            raise ValueError(
+                f"{self.name} expects labels {self.labelnames}, got {values}")
+        child = self._children.get(values)
+        if child is None:
+            child = self._new_child()
+            self._children[values] = child
+        return child
+
+    @abc.abstractmethod
+    def _new_child(self) -> Any:
+        ...
+
+    @abc.abstractmethod
+    def samples(self) -> Iterable[tuple[str, dict[str, str], float]]:
+        """
+        Yields `(sample_name, labels, value)` tuples for this metric and all of its children.
+        """
+        ...
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class Counter(_Metric):
+    """A value that only goes up (e.g. the number of requests)."""
+    type_name = "counter"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._value = _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._value.inc(amount)
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def samples(self):
+        if not self.labelnames:
+            yield (f"{self.name}_total", {}, self._value.value)
+            return
+        for values, child in self._children.items():
+            yield (f"{self.name}_total", dict(zip(self.labelnames, values)), child.value)
+
+
+class _GaugeChild:
+    __slots__ = ("value", "_function")
+
+    def __init__(self) -> None:
+        self.value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Computes the value when it's collected, instead of storing it."""
+        self._function = function
+
+    def get(self) -> float:
+        return float(self._function()) if self._function else self.value
+
+
+class Gauge(_Metric):
+    """A value that can go up and down (e.g. the number of in-flight requests)."""
+    type_name = "gauge"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._value = _GaugeChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._value.inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._value.dec(amount)
+
+    def set(self, value: float) -> None:
+        self._value.set(value)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._value.set_function(function)
+
+    def get(self) -> float:
+        return self._value.get()
+
+    def _new_child(self) -> _GaugeChild:
+        return _GaugeChild()
+
+    def samples(self):
+        if not self.labelnames:
+            yield (self.name, {}, self._value.get())
+            return
+        for values, child in self._children.items():
+            yield (self.name, dict(zip(self.labelnames, values)), child.get())
+
+
+class _Timer:
+    """
+    Observes how long the `with` block took (even if it raised).
+    """
+    __slots__ = ("_observe", "_start")
+
+    def __init__(self, observe: Callable[[float], None]) -> None:
+        self._observe = observe
+        self._start = 0.0
+
+    def __enter__(self) -> "_Timer":
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._observe(perf_counter() - self._start)
+
+
+class _HistogramChild:
+    __slots__ = ("upper_bounds", "counts", "sum")
+
+    def __init__(self, upper_bounds: tuple[float, ...]) -> None:
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * len(upper_bounds)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        # only the bucket that the value falls in is incremented; the cumulative counts that
+        # Prometheus expects are computed when the histogram is collected
+        self.counts[bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def time(self) -> _Timer:
+        return _Timer(self.observe)
+
+
+class Histogram(_Metric):
+    """Counts observations (e.g. request durations) in configurable buckets."""
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS, registry: Optional["Registry"] = None) -> None:
+        upper_bounds = tuple(sorted(float(b) for b in buckets))
+        if not upper_bounds or upper_bounds[-1] != inf:
+            upper_bounds += (inf,)
+        self.upper_bounds = upper_bounds
+        super().__init__(name, documentation, labelnames, registry)
+        self._value = _HistogramChild(upper_bounds)
+
+    def observe(self, value: float) -> None:
+        self._value.observe(value)
+
+    @property
+    def count(self) -> int:
+        return self._value.count
+
+    def time(self) -> _Timer:
+        """Times a `with` block."""
+        return _Timer(self._value.observe)
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.upper_bounds)
+
+    def samples(self):
+        if not self.labelnames:
+            yield from self._child_samples(self._value, {})
+            return
+        for values, child in self._children.items():
+            yield from self._child_samples(child, dict(zip(self.labelnames, values)))
+
+    def _child_samples(self, child: _HistogramChild, labels: dict[str, str]):
+        cumulative = 0
+        for upper_bound, count in zip(child.upper_bounds, child.counts):
+            cumulative += count
+            le = "+Inf" if upper_bound == inf else repr(upper_bound)
+            yield (f"{self.name}_bucket", {**labels, "le": le}, cumulative)
+        yield (f"{self.name}_count", labels, cumulative)
+        yield (f"{self.name}_sum", labels, child.sum)
+
+
+class Registry:
+    """Holds every metric of this worker."""
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"A metric named {metric.name} is already registered.")
+        self._metrics[metric.name] = metric
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def collect(self) -> Iterable[_Metric]:
+        return list(self._metrics.values())
+
+
+REGISTRY = Registry()
+
+
+def _format_value(value: float) -> str:
+    if isnan(value):
+        return "NaN"
+    if value in (inf, -inf):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def collect_families(registry: Optional[Registry] = None, const_labels: Optional[dict[str, str]] = None) -> list[dict]:
+    """
+    Returns every metric (and its samples) as plain, JSON-friendly data, with `const_labels` added to every sample. This is what workers hand each other (see "srv/routers/metrics.py").
+    """
+    const_labels = const_labels or {}
+    return [{
+        "name": metric.name,
+        "documentation": metric.documentation,
+        "type": metric.type_name,
+        "samples": [[name, {**labels, **const_labels}, value] for name, labels, value in metric.samples()],
+    } for metric in (registry if registry is not None else REGISTRY).collect()]
+
+
+def generate_latest(registry: Optional[Registry] = None, const_labels: Optional[dict[str, str]] = None, others: Iterable[list[dict]] = ()) -> bytes:
+    """
+    Renders every metric in the Prometheus text format (i.e. what "/metrics" returns). `others` are the `collect_families` of other workers, whose samples are added to the metrics of the same name (so they should have a `const_labels` of their own, e.g. their PID).
+    """
+    families: dict[str, dict] = {}
+    for family in collect_families(registry, const_labels) + [f for other in others for f in other]:
+        merged = families.setdefault(family["name"], {**family, "samples": []})
+        merged["samples"].extend(family["samples"])
+
+    lines = []
+    for family in families.values():
+        documentation = family["documentation"].replace("\\", "\\\\").replace("\n", "\\n")
+        lines.append(f"# HELP {family['name']} {documentation}")
+        lines.append(f"# TYPE {family['name']} {family['type']}")
+        for name, labels, value in family["samples"]:
+            if labels:
+                label_str = ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items())
+                lines.append(f"{name}{{{label_str}}} {_format_value(value)}")
+            else:
+                lines.append(f"{name} {_format_value(value)}")
+    return ("\n".join(lines) + "\n").encode()
@@ -0,0 +1,70 @@
+import cProfile
+from pathlib import Path
+from typing import Literal
+
+# pyinstrument understands async code (time spent awaiting is charged to the coroutine that
+# awaited), but it's a compiled extension, so if it isn't installed we fall back to cProfile
+try:
+    from pyinstrument import Profiler
+except ImportError:  # pragma: no cover
+    Profiler = None
+
+# a thread can only be hooked by one profiler at a time, so we only profile one request at once
+_active = False
+
+
+class RequestProfiler:
+    """
+    Profiles a single request from start to finish.
+
+    The "speedscope" format (the default) uses pyinstrument, which covers the async parts too: time that the request spent awaiting (e.g. the LLM or the database) shows up under the code that awaited it. The result can be opened as a flame graph on https://www.speedscope.app. The "pstats" format uses cProfile instead, which only sees the CPU time of this thread (so other requests that ran in the meantime end up in the profile as well).
+    """
+
+    def __init__(self, fmt: Literal["speedscope", "pstats"] = "speedscope") -> None:
+        if fmt == "speedscope" and Profiler is None:  # pragma: no cover
+            fmt = "pstats"
+        self.format = fmt
+        self._profiler = Profiler(async_mode="enabled") if fmt == "speedscope" else cProfile.Profile()
+
+    @property
+    def suffix(self) -> str:
+        return ".speedscope.json" if self.format == "speedscope" else ".pstats"
+
+    def start(self) -> None:
+        if self.format == "speedscope":
+            self._profiler.start()
+        else:
+            self._profiler.enable()
+
+    def stop(self) -> None:
+        if self.format == "speedscope":
+            self._profiler.stop()
+        else:
+            self._profiler.disable()
+
+    def write(self, path: Path) -> None:
+        """
+        Writes the profile to `path`. This does file I/O, so run it in a thread.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if self.format == "speedscope":
+            from pyinstrument.renderers import SpeedscopeRenderer
+            path.write_text(self._profiler.output(SpeedscopeRenderer()), encoding="utf-8")
+        else:
+            self._profiler.dump_stats(path)
+
+
+def try_start_profiling() -> bool:
+    """
+    Claims the profiler of this worker. Returns `False` if another request is already being profiled.
+    """
+    global _active  # we gotta modify the pre-existing flag
+    if _active:
+        return False
+    _active = True
+    return True
+
+
+def stop_profiling() -> None:
+    global _active  # we gotta modify the pre-existing flag
+    _active = False
@@ -0,0 +1,301 @@
+import sys
+import random
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from pathlib import Path
+from queue import Empty, SimpleQueue
+from time import time_ns
+from typing import Any, Awaitable, Callable, Iterable, Iterator, NamedTuple, Optional, TextIO, TypeVar
+import orjson
+from core.config import Settings
+
+# span kinds and status codes, as OTLP numbers them
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+
+class SpanContext(NamedTuple):
+    """What identifies a span across tasks (and services, through the "traceparent" header)."""
+    trace_id: str
+    span_id: str
+    sampled: bool = True
+
+
+class Span:
+    """
+    A timed operation within a trace. Spans are created by `start_span`, and they're exported when they end (if their trace was sampled).
+    """
+    __slots__ = ("name", "context", "parent_span_id", "kind", "start_ns",
+                 "end_ns", "attributes", "links", "status_code", "status_message")
+
+    def __init__(
+        self,
+        name: str,
+        context: SpanContext,
+        parent_span_id: Optional[str] = None,
+        kind: int = SPAN_KIND_INTERNAL,
+        attributes: Optional[dict[str, Any]] = None,
+        links: Iterable[SpanContext] = ()
+    ) -> None:
+        self.name = name
+        self.context = context
+        self.parent_span_id = parent_span_id
+        self.kind = kind
+        self.start_ns = time_ns()
+        self.end_ns = 0
+        self.attributes = dict(attributes) if attributes else {}
+        self.links = list(links)
+        self.status_code = 0
+        self.status_message = ""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def record_exception(self, e: BaseException) -> None:
+        self.status_code = STATUS_ERROR
+        self.status_message = str(e)
+        self.attributes["exception.type"] = type(e).__name__
+
+    def to_otlp(self) -> dict[str, Any]:
+        """
+        Returns the span in the OTLP/JSON encoding (i.e. what an OpenTelemetry collector accepts).
+        """
+        span: dict[str, Any] = {
+            "traceId": self.context.trace_id,
+            "spanId": self.context.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_to_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": self.status_code, "message": self.status_message} if self.status_code else {},
+        }
+        if self.parent_span_id:
+            span["parentSpanId"] = self.parent_span_id
+        if self.links:
+            span["links"] = [{"traceId": link.trace_id, "spanId": link.span_id} for link in self.links]
+        return span
+
+
+def _to_otlp_attribute(key: str, value: Any) -> dict[str, Any]:
+    # NOTE: bool comes first, since it's a subclass of int
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        # OTLP/JSON encodes 64-bit integers as strings
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class SpanExporter:
+    """
+    Writes finished spans to a file (or a stream, e.g. stdout) in the OTLP/JSON format, one export request per line. The writing happens on a background thread, so ending a span never blocks the event loop.
+    """
+
+    def __init__(self, stream: TextIO, service_name: str, max_batch_size: int = 512, close_stream: bool = False) -> None:
+        self.max_batch_size = max_batch_size
+        self._stream = stream
+        self._close_stream = close_stream
+        self._resource = {"attributes": [_to_otlp_attribute("service.name", service_name)]}
+        self._queue: SimpleQueue[Optional[Span]] = SimpleQueue()
+        self._thread = threading.Thread(target=self._export_forever, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def to_file(cls, path: Path, service_name: str) -> "SpanExporter":
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return cls(open(path, "a", encoding="utf-8"), service_name, close_stream=True)
+
+    def export(self, span: Span) -> None:
+        self._queue.put(span)
+
+    def shutdown(self) -> None:
+        """
+        Writes out the spans that are still queued up, then stops the thread.
+        """
+        self._queue.put(None)
+        self._thread.join()
+        if self._close_stream:
+            self._stream.close()
+
+    def _export_forever(self) -> None:
+        while True:
+            span = self._queue.get()
+            stopping = span is None
+            batch = [] if stopping else [span]
+            # grab whatever else finished in the meantime, so that busy workers write fewer lines
+            while not stopping and len(batch) < self.max_batch_size:
+                try:
+                    span = self._queue.get_nowait()
+                except Empty:
+                    break
+                if span is None:
+                    stopping = True
+                else:
+                    batch.append(span)
+            if batch:
+                self._write(batch)
+            if stopping:
+                return
+
+    def _write(self, batch: list[Span]) -> None:
+        request = {"resourceSpans": [{
+            "resource": self._resource,
+            "scopeSpans": [{"scope": {"name": "licenseguard"}, "spans": [s.to_otlp() for s in batch]}],
+        }]}
+        try:
+            self._stream.write(orjson.dumps(request).decode() + "\n")
+            self._stream.flush()
+        except Exception as e:  # pragma: no cover
+            # a full disk shouldn't take the exporter (or the app) down with it
+            logger.warning("Couldn't export %d span(s): %s", len(batch), e)
+
+
+class Tracer:
+    def __init__(self, exporter: SpanExporter, sample_rate: float = 1.0, rng: Optional[random.Random] = None) -> None:
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self._rng = rng or random.Random()
+
+    def new_context(self, parent: Optional[SpanContext]) -> SpanContext:
+        span_id = f"{self._rng.getrandbits(64):016x}"
+        if parent:
+            return SpanContext(parent.trace_id, span_id, parent.sampled)
+        # sampling is decided once per trace, so a trace is either complete or missing
+        return SpanContext(f"{self._rng.getrandbits(128):032x}", span_id, self._rng.random() < self.sample_rate)
+
+
+# the span that the running code is in (contextvars follow the code into the tasks it creates)
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+# the tracer of this worker (if tracing is enabled)
+tracer: Optional[Tracer] = None
+
+
+def get_current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def get_current_context() -> Optional[SpanContext]:
+    span = _current_span.get()
+    return span.context if span else None
+
+
+@contextmanager
+def _start_span(
+    tracer: Tracer,
+    name: str,
+    kind: int,
+    attributes: Optional[dict[str, Any]],
+    links: Iterable[SpanContext],
+    parent: Optional[SpanContext]
+) -> Iterator[Span]:
+    current = _current_span.get()
+    parent = parent or (current.context if current else None)
+    span = Span(name, tracer.new_context(parent), parent.span_id if parent else None,
+                kind, attributes, links)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.record_exception(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end_ns = time_ns()
+        if span.context.sampled:
+            tracer.exporter.export(span)
+
+
+@contextmanager
+def _no_span() -> Iterator[None]:
+    yield None
+
+
+def start_span(
+    name: str,
+    kind: int = SPAN_KIND_INTERNAL,
+    attributes: Optional[dict[str, Any]] = None,
+    links: Iterable[SpanContext] = (),
+    parent: Optional[SpanContext] = None
+):
+    """
+    Times the `with` block as a span (a child of the current span, or of `parent`). If the block raises, the span is marked as failed. When tracing is off, this yields `None` and costs next to nothing.
+    """
+    if tracer is None:
+        return _no_span()
+    return _start_span(tracer, name, kind, attributes, links, parent)
+
+
+def traced(name: str, kind: int = SPAN_KIND_INTERNAL) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    """
+    Decorator that runs every call of an async function in a span. The signature is kept intact, so it works on FastAPI dependencies too.
+    """
+    def decorator(fn: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        @wraps(fn)
+        async def wrapper(*args, **kwargs) -> T:
+            if tracer is None:
+                return await fn(*args, **kwargs)
+            with _start_span(tracer, name, kind, None, (), None):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[SpanContext]:
+    """
+    Parses a W3C "traceparent" header (e.g. "00-<trace ID>-<span ID>-01"), so that our spans join the caller's trace.
+    """
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        flags = int(parts[3][:2], 16)
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return SpanContext(parts[1], parts[2], bool(flags & 1))
+
+
+def format_traceparent(context: SpanContext) -> str:
+    return f"00-{context.trace_id}-{context.span_id}-{'01' if context.sampled else '00'}"
+
+
+def setup_tracing(settings: Settings, stream: Optional[TextIO] = None) -> Optional[Tracer]:
+    """
+    Starts tracing if an exporter is configured ("console" writes the spans to stdout, "file" appends them to `tracing_file`).
+    """
+    global tracer   # we gotta modify the pre-existing tracer
+    if tracer or settings.tracing_exporter == "none":
+        return tracer
+    if stream is not None:
+        exporter = SpanExporter(stream, settings.tracing_service_name)
+    elif settings.tracing_exporter == "file":
+        exporter = SpanExporter.to_file(settings.tracing_file, settings.tracing_service_name)
+    else:
+        exporter = SpanExporter(sys.stdout, settings.tracing_service_name)
+    tracer = Tracer(exporter, settings.tracing_sample_rate)
+    return tracer
+
+
+def shutdown_tracing() -> None:
+    global tracer   # we gotta modify the pre-existing tracer
+    if tracer:
+        tracer.exporter.shutdown()
+        tracer = None
@@ -0,0 +1,47 @@
+from typing import Optional
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from srv.schemas import ApiKey, User
+
+
+async def get_user_and_hash_by_prefix(session: AsyncSession, prefix: str) -> Optional[tuple[User, str]]:
+    """
+    Retrieves the user that owns the API key with the given prefix, along with the key's hash.
+    """
+    result = await session.exec(
+        select(User, ApiKey.hashed_key)
+        .join(ApiKey, ApiKey.user_id == User.id)
+        .where(ApiKey.prefix == prefix)
+    )
+    row = result.one_or_none()
+    return (row[0], row[1]) if row else None
+
+
+async def select_user_api_keys(session: AsyncSession, user_id: str) -> list[ApiKey]:
+    """
+    Retrieves all of the API keys of a user.
+    """
+    result = await session.exec(select(ApiKey).where(ApiKey.user_id == user_id).order_by(ApiKey.created_at))
+    return list(result.all())
+
+
+async def save_api_key(session: AsyncSession, api_key: ApiKey) -> ApiKey:
+    """
+    Saves an API key to the database.
+    """
+    session.add(api_key)
+    await session.commit()
+    await session.refresh(api_key)
+    return api_key
+
+
+async def delete_api_key(session: AsyncSession, user_id: str, key_id: str) -> Optional[ApiKey]:
+    """
+    Deletes one of a user's API keys. Returns the deleted key, or `None` if the user doesn't have a key with that ID.
+    """
+    result = await session.exec(select(ApiKey).where((ApiKey.id == key_id) & (ApiKey.user_id == user_id)))
+    api_key = result.one_or_none()
+    if api_key:
+        await session.delete(api_key)
+        await session.commit()
+    return api_key
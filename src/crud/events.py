@@ -1,26 +1,43 @@
-from datetime import datetime
+import logging
+from typing import Optional
 from sqlmodel import select
 from sqlmodel.ext.asyncio.session import AsyncSession
-from srv.schemas import Event
+from srv.schemas import Event, EventType
+
+logger = logging.getLogger(__name__)
 
 
 async def upsert_event(session: AsyncSession, logged_evt: Event) -> None:
     """
     Upsert/log a new event into the database.
     """
-    print(
-        f"[{datetime.now()}]: Logging event type \"{logged_evt.event}\" for project \"{logged_evt.project_name}\".")
+    logger.info("Logging event type \"%s\" for project \"%s\".", logged_evt.event.value, logged_evt.project_name,
+                extra={"event_type": logged_evt.event.value, "project_name": logged_evt.project_name, "user_id": logged_evt.user_id})
 
     session.add(logged_evt)
     await session.commit()
     await session.refresh(logged_evt)
 
 
+async def insert_events(session: AsyncSession, events: list[Event], skip_existing: bool = False) -> int:
+    """
+    Inserts many events in a single transaction. If `skip_existing` is set, events whose IDs are already in the database are skipped (useful when replaying events that might've been written already). Returns the number of inserted events.
+    """
+    if skip_existing and events:
+        result = await session.exec(select(Event.id).where(Event.id.in_([e.id for e in events])))
+        existing = set(result.all())
+        events = [e for e in events if e.id not in existing]
+
+    session.add_all(events)
+    await session.commit()
+    return len(events)
+
+
 async def select_project_events(session: AsyncSession, user_id: str, project_name: str) -> list[Event]:
     """
     Filters the database to find all logged events for a specific project and user.
     """
-    result = await session.exec(select(Event).where((Event.user_id == user_id) & (Event.project_name == project_name)))
+    result = await session.exec(select(Event).where((Event.user_id == user_id) & (Event.project_name == project_name)).order_by(Event.timestamp))
     rows = result.all()
     events = []
     for r in rows:
@@ -35,3 +52,16 @@ async def select_project_events(session: AsyncSession, user_id: str, project_nam
             )
         )
     return events
+
+
+async def select_latest_project_result(session: AsyncSession, user_id: str, project_name: str) -> Optional[str]:
+    """
+    Returns the (JSON) content of the most recent completed analysis of a project, if there is one.
+    """
+    result = await session.exec(
+        select(Event.content)
+        .where((Event.user_id == user_id) & (Event.project_name == project_name) & (Event.event == EventType.ANALYSIS_COMPLETED))
+        .order_by(Event.timestamp.desc())
+        .limit(1)
+    )
+    return result.first()
@@ -0,0 +1,59 @@
+from typing import Optional
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from srv.schemas import IdempotencyKey
+
+# how many times we try to claim a key that keeps disappearing right after we lost the race for it
+CLAIM_ATTEMPTS = 3
+
+
+async def claim_idempotency_key(session: AsyncSession, key: str, fingerprint: str, ttl: float, now: float) -> Optional[IdempotencyKey]:
+    """
+    Claims `key` for `ttl` seconds. Returns `None` if we got it, or the record of whoever claimed it first. If the key can't be claimed *or* read after `CLAIM_ATTEMPTS` tries, the last `IntegrityError` is raised.
+    """
+    attempts = 0
+    while True:
+        # an expired key is as good as a new one
+        await session.exec(delete(IdempotencyKey).where((IdempotencyKey.key == key) & (IdempotencyKey.expires_at <= now)))
+        try:
+            session.add(IdempotencyKey(key=key, fingerprint=fingerprint, expires_at=now + ttl))
+            await session.commit()
+            return None
+        except IntegrityError:
+            # NOTE: the primary key is what stops two workers from both claiming the key
+            await session.rollback()
+            attempts += 1
+            if attempts >= CLAIM_ATTEMPTS:
+                raise
+        record = await select_idempotency_key(session, key)
+        if record is not None:
+            return record
+        # whoever beat us to it gave the key back (or it expired) before we could read it, which
+        # doesn't make it ours, so we have to claim it again
+
+
+async def select_idempotency_key(session: AsyncSession, key: str) -> Optional[IdempotencyKey]:
+    result = await session.exec(select(IdempotencyKey).where(IdempotencyKey.key == key))
+    return result.one_or_none()
+
+
+async def complete_idempotency_key(session: AsyncSession, key: str, fingerprint: str, response: str, expires_at: float) -> None:
+    """
+    Stores the response to the request that claimed `key`. If the claim expired and the key was claimed (or completed) by another request since, nothing is stored, so the first response always wins.
+    """
+    await session.exec(
+        update(IdempotencyKey)
+        .where((IdempotencyKey.key == key) & (IdempotencyKey.fingerprint == fingerprint) & (IdempotencyKey.response.is_(None)))
+        .values(response=response, expires_at=expires_at)
+    )
+    await session.commit()
+
+
+async def release_idempotency_key(session: AsyncSession, key: str) -> None:
+    """
+    Gives up a claim on `key` (i.e. when the request failed), so that a retry can have another go.
+    """
+    await session.exec(delete(IdempotencyKey).where((IdempotencyKey.key == key) & (IdempotencyKey.response.is_(None))))
+    await session.commit()
@@ -0,0 +1,87 @@
+from typing import Optional
+from sqlalchemy import case, delete, func, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from srv.schemas import ConcurrencySlot, RateLimitBucket
+
+
+async def take_bucket_token(session: AsyncSession, key: str, rate: float, burst: int, now: float) -> float:
+    """
+    Takes a token from the bucket of `key`, which refills at `rate` tokens per second (up to `burst` tokens). Returns 0 if a token was taken, or how many seconds to wait until one is available.
+    """
+    refilled = RateLimitBucket.tokens + \
+        (now - RateLimitBucket.updated_at) * rate
+    capped = case((refilled > burst, float(burst)), else_=refilled)
+
+    # NOTE: this takes the token in a single UPDATE (which is atomic), so that two workers can't
+    # both take the last token. "tokens" MUST be set before "updated_at", because MySQL applies
+    # the assignments in order (and the refill needs the old "updated_at")
+    for _ in range(2):
+        result = await session.exec(
+            update(RateLimitBucket)
+            .where((RateLimitBucket.key == key) & (capped >= 1))
+            .values(tokens=capped - 1, updated_at=now)
+        )
+        if result.rowcount:
+            await session.commit()
+            return 0.0
+
+        bucket = (await session.exec(select(RateLimitBucket).where(RateLimitBucket.key == key))).one_or_none()
+        if bucket is not None:
+            tokens = min(burst, bucket.tokens + (now - bucket.updated_at) * rate)
+            await session.rollback()
+            if tokens < 1:
+                return (1 - tokens) / rate
+            # another worker refilled the bucket in the meantime, so try the UPDATE again
+            continue
+
+        # this is the first time that we see this key, so it starts with a full bucket
+        try:
+            session.add(RateLimitBucket(key=key, tokens=burst - 1, updated_at=now))
+            await session.commit()
+            return 0.0
+        except IntegrityError:
+            # another worker created the bucket first, so try the UPDATE again
+            await session.rollback()
+    # we lost the race twice in a row, so the bucket is clearly busy
+    return 1.0 / rate
+
+
+async def acquire_concurrency_slot(session: AsyncSession, key: str, limit: int, ttl: float, now: float) -> Optional[str]:
+    """
+    Acquires one of the `limit` slots of `key` for `ttl` seconds. Returns the ID of the slot, or `None` if all of them are taken.
+    """
+    # throw away the slots of jobs that never gave theirs back
+    await session.exec(delete(ConcurrencySlot).where((ConcurrencySlot.key == key) & (ConcurrencySlot.expires_at <= now)))
+    slot = ConcurrencySlot(key=key, expires_at=now + ttl)
+    slot_id = slot.id
+    session.add(slot)
+    await session.commit()
+
+    # NOTE: we claim the slot first and count afterwards. if two workers race for the last slot,
+    # both of them might give theirs back, but they can never both keep it
+    taken = (await session.exec(
+        select(func.count()).select_from(ConcurrencySlot)
+        .where((ConcurrencySlot.key == key) & (ConcurrencySlot.expires_at > now))
+    )).one()
+    if taken > limit:
+        await release_concurrency_slot(session, slot_id)
+        return None
+    return slot_id
+
+
+async def extend_concurrency_slot(session: AsyncSession, slot_id: str, ttl: float, now: float) -> None:
+    """
+    Makes a slot last for another `ttl` seconds.
+    """
+    await session.exec(update(ConcurrencySlot).where(ConcurrencySlot.id == slot_id).values(expires_at=now + ttl))
+    await session.commit()
+
+
+async def release_concurrency_slot(session: AsyncSession, slot_id: str) -> None:
+    """
+    Gives a slot back.
+    """
+    await session.exec(delete(ConcurrencySlot).where(ConcurrencySlot.id == slot_id))
+    await session.commit()
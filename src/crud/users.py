@@ -1,8 +1,20 @@
-from typing import Optional
+from typing import Iterable, Optional
+from sqlalchemy import insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import select
 from sqlmodel.ext.asyncio.session import AsyncSession
 from srv.schemas import User
 
+# SQL Server caps a statement at 2100 parameters, so big "IN (...)" lookups are split up
+IN_CLAUSE_CHUNK_SIZE = 1000
+
+
+def _chunks(values: list[str], size: int = IN_CLAUSE_CHUNK_SIZE) -> Iterable[list[str]]:
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
 
 async def get_user_by_username(session: AsyncSession, username: str) -> Optional[User]:
     """
@@ -23,3 +35,61 @@ async def save_user(session: AsyncSession, user: User) -> User:
     await session.commit()
     await session.refresh(user)
     return user
+
+
+async def select_existing_usernames(session: AsyncSession, usernames: list[str]) -> set[str]:
+    """
+    Returns the subset of `usernames` that are already registered. Uses a single query per 1000 usernames.
+    """
+    existing: set[str] = set()
+    for chunk in _chunks(usernames):
+        result = await session.exec(select(User.username).where(User.username.in_(chunk)))
+        existing.update(result.all())
+    return existing
+
+
+async def insert_users(session: AsyncSession, users: list[User]) -> set[str]:
+    """
+    Inserts many users in a single transaction. Users that conflict with an existing row (e.g. a username that was registered in the meantime) are skipped. Returns the IDs of the users that were inserted.
+    """
+    if not users:
+        return set()
+
+    rows = [u.model_dump() for u in users]
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        await session.exec(pg_insert(User).on_conflict_do_nothing(), params=rows)
+    elif dialect == "sqlite":
+        await session.exec(sqlite_insert(User).on_conflict_do_nothing(), params=rows)
+    elif dialect == "mysql":
+        await session.exec(insert(User).prefix_with("IGNORE"), params=rows)
+    else:
+        await _insert_skipping_conflicts(session, rows)
+
+    # the IDs are brand new, so any of them that are in the table now were inserted by us
+    inserted: set[str] = set()
+    for chunk in _chunks([u.id for u in users]):
+        result = await session.exec(select(User.id).where(User.id.in_(chunk)))
+        inserted.update(result.all())
+    await session.commit()
+    return inserted
+
+
+async def _insert_skipping_conflicts(session: AsyncSession, rows: list[dict]) -> None:
+    """
+    Inserts the rows in one go if none of them conflict, or one at a time (skipping the ones that do) if any of them does. This is for dialects without a "skip on conflict" for INSERTs (e.g. SQL Server).
+    """
+    # NOTE: the savepoints make sure that a conflict only rolls back the failed INSERT, instead of
+    # the whole transaction
+    try:
+        async with session.begin_nested():
+            await session.exec(insert(User), params=rows)
+        return
+    except IntegrityError:
+        pass
+    for row in rows:
+        try:
+            async with session.begin_nested():
+                await session.exec(insert(User), params=[row])
+        except IntegrityError:
+            continue
@@ -1,9 +1,16 @@
-from typing import Any, AsyncGenerator, Optional
+import random
+from functools import lru_cache
+from typing import Any, AsyncGenerator, Literal, Optional
 from asyncio import sleep
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncEngine
-from sqlmodel import SQLModel
+from fastapi import Depends
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncConnection, AsyncEngine
+from sqlalchemy.sql.dml import UpdateBase
+from sqlmodel import SQLModel, Session
 from sqlmodel.ext.asyncio.session import AsyncSession
-from core.config import get_settings
+from core.config import ROOT
+from core.metrics import Gauge
 
 # the database is expected to be async, so we will only allow asynchronous connections
 ALLOWED_CONN_PREFIXES = [
@@ -13,55 +20,212 @@ ALLOWED_CONN_PREFIXES = [
     "mssql+aioodbc://",
 ]
 
-# import the DB_URL variable
-settings = get_settings()
-DB_URL = str(settings.db_url) if settings.db_url else ""
-if not any([DB_URL.startswith(conn_prefix) for conn_prefix in ALLOWED_CONN_PREFIXES]):
-    raise RuntimeError(
-        "Please provide an async DB connection URL (e.g. postgresql+asyncpg://user:pw@host:5432/dbname) for DB_URL.")
 
-# create the engine and local session
+# key in `Session.info` that marks a primary session as having written something
+WROTE_KEY = "licenseguard_wrote"
+# key in `Session.info` that points a replica session at the primary session of the same request
+PRIMARY_INFO_KEY = "licenseguard_primary_info"
+
+
+class PrimarySession(Session):
+    """
+    Sync session class behind every primary `AsyncSession`. Only exists so that we can tell when a request has written to the primary.
+    """
+
+
+class ReplicaSession(Session):
+    """
+    Sync session class behind every read replica `AsyncSession`. Reads go to the replica, unless the primary session from the same request has already written something (i.e. "read your writes").
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        primary_info = self.info.get(PRIMARY_INFO_KEY)
+        wrote = primary_info is not None and primary_info.get(WROTE_KEY, False)
+        # writes should never land on the replica, so send them to the primary as well
+        if engine and (wrote or self._flushing or isinstance(clause, UpdateBase)):
+            return engine.sync_engine
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
+
+
+@event.listens_for(PrimarySession, "after_flush")
+def _mark_primary_wrote(session, flush_context) -> None:
+    session.info[WROTE_KEY] = True
+
+
+class SchemaRevisionError(RuntimeError):
+    """
+    Raised when the database isn't at the Alembic revision that this version of the app expects.
+    """
+
+
+@lru_cache
+def get_head_revisions() -> frozenset[str]:
+    """
+    Returns the head revision(s) of the Alembic migrations that ship with the app.
+    """
+    # alembic is only needed when we're verifying the schema, so import it here
+    from alembic.script import ScriptDirectory
+    return frozenset(ScriptDirectory(str(ROOT / "migrations")).get_heads())
+
+
+def check_db_url(db_url: str, name: str = "DB_URL") -> None:
+    """
+    Makes sure that `db_url` points at an async driver. It's checked when the engine is created (instead of on import), so that the modules can be imported without a configured environment.
+    """
+    if not any([db_url.startswith(conn_prefix) for conn_prefix in ALLOWED_CONN_PREFIXES]):
+        raise RuntimeError(
+            f"Please provide an async DB connection URL (e.g. postgresql+asyncpg://user:pw@host:5432/dbname) for {name}.")
+
+
+def get_retry_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """
+    Returns how long to wait before the next connection attempt, using exponential backoff with "full jitter". The jitter stops a fleet of workers from retrying in lockstep.
+    """
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+async def verify_schema_revision(conn) -> None:
+    """
+    Checks that the database has been migrated to the latest Alembic revision with a single query. Raises a `SchemaRevisionError` if it hasn't.
+    """
+    try:
+        result = await conn.execute(text("SELECT version_num FROM alembic_version"))
+        current = frozenset(row[0] for row in result.all())
+    except Exception as e:
+        raise SchemaRevisionError(
+            f"Unable to read the Alembic revision from the database. Did you run the migrations? ({e})") from e
+
+    expected = get_head_revisions()
+    if current != expected:
+        raise SchemaRevisionError(
+            f"The database is at revision(s) {sorted(current)}, but the app expects {sorted(expected)}. Please run the migrations.")
+
+
+# create the engines and local sessions
 engine: Optional[AsyncEngine] = None
 AsyncSessionLocal: Optional[async_sessionmaker] = None
+read_engine: Optional[AsyncEngine] = None
+AsyncReadSessionLocal: Optional[async_sessionmaker] = None
+
+
+def get_pool_stat(e: Optional[AsyncEngine], stat: str) -> float:
+    """
+    Reads a stat (e.g. "checkedout") of an engine's connection pool. Pools that don't keep connections around (e.g. SQLite's) have no stats, so they're always 0.
+    """
+    pool_stat = getattr(e.sync_engine.pool, stat, None) if e else None
+    # NOTE: `QueuePool.overflow()` goes negative while the pool isn't full yet
+    return max(0.0, float(pool_stat())) if callable(pool_stat) else 0.0
 
 
-async def init_engine(db_url: str, max_retries: int = 10, retry_delay: float = 1.0) -> None:
-    # we gotta modify the pre-existing SQLAlchemy engine & async session
-    global engine, AsyncSessionLocal
+DB_POOL_SIZE = Gauge(
+    "db_pool_size", "Connections that the pool keeps open.", labelnames=("engine",))
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out", "Connections that are currently in use.", labelnames=("engine",))
+DB_POOL_OVERFLOW = Gauge(
+    "db_pool_overflow", "Connections that were opened on top of the pool's size.", labelnames=("engine",))
+# NOTE: these are only computed when the metrics are scraped, so they cost nothing per query
+for _gauge, _stat in ((DB_POOL_SIZE, "size"), (DB_POOL_CHECKED_OUT, "checkedout"), (DB_POOL_OVERFLOW, "overflow")):
+    _gauge.labels("primary").set_function(lambda stat=_stat: get_pool_stat(engine, stat))
+    _gauge.labels("replica").set_function(lambda stat=_stat: get_pool_stat(read_engine, stat))
+
+
+async def init_engine(
+    db_url: str,
+    max_retries: int = 10,
+    retry_delay: float = 1.0,
+    read_db_url: Optional[str] = None,
+    startup_mode: Literal["create_all", "verify"] = "create_all",
+    max_retry_delay: float = 10.0
+) -> None:
+    # we gotta modify the pre-existing SQLAlchemy engines & async sessions
+    global engine, AsyncSessionLocal, read_engine, AsyncReadSessionLocal
     # just exit if the engine has already been initialized
     if engine:
         return
+    check_db_url(db_url)
+    # the read replica is optional, but if it's there then it has to be async too
+    if read_db_url:
+        check_db_url(read_db_url, "DB_READ_URL")
 
     engine = create_async_engine(
         db_url,
         pool_pre_ping=True
     )
     AsyncSessionLocal = async_sessionmaker(
-        engine, expire_on_commit=False, class_=AsyncSession)
+        engine, expire_on_commit=False, class_=AsyncSession, sync_session_class=PrimarySession)
+
+    # the replica gets its own pool so that reads don't compete with writes for connections
+    if read_db_url:
+        read_engine = create_async_engine(
+            read_db_url,
+            pool_pre_ping=True
+        )
+        AsyncReadSessionLocal = async_sessionmaker(
+            read_engine, expire_on_commit=False, class_=AsyncSession, sync_session_class=ReplicaSession)
 
-    # try to acquire a connection to the database in order to create all of the tables
+    # try to acquire a connection to the database, then either create all of the tables or just
+    # verify that the migrations have been run
     last_exc = None
-    for _ in range(max_retries):
+    for attempt in range(max_retries):
         try:
-            async with engine.begin() as conn:
-                await conn.run_sync(SQLModel.metadata.create_all)
-            return
+            conn = await engine.connect()
         except Exception as e:
             last_exc = e
-            await sleep(retry_delay)
+            if attempt < max_retries - 1:
+                await sleep(get_retry_delay(attempt, retry_delay, max_retry_delay))
+            continue
+
+        # once we're connected, a schema problem won't fix itself, so we don't retry it
+        try:
+            if startup_mode == "verify":
+                await verify_schema_revision(conn)
+            else:
+                await create_tables(conn)
+        finally:
+            await conn.close()
+        return
 
     # if we didn't return, then we failed to connect with the database
     raise RuntimeError(
         f"Unable to connect with the database after {max_retries} tries: {last_exc}")
 
 
+async def create_tables(conn: AsyncConnection) -> None:
+    """
+    Creates any missing tables. When several workers boot at once, they can race each other to create the same table, so the loser checks again once the winner is done.
+    """
+    try:
+        await conn.run_sync(SQLModel.metadata.create_all)
+        await conn.commit()
+    except DBAPIError:
+        await conn.rollback()
+        # NOTE: if the error wasn't caused by the race, this raises it again
+        await conn.run_sync(SQLModel.metadata.create_all)
+        await conn.commit()
+
+
 async def close_engine() -> None:
-    global engine   # we gotta modify the pre-existing SQLAlchemy engine
+    # we gotta modify the pre-existing SQLAlchemy engines & async sessions
+    global engine, read_engine, AsyncReadSessionLocal
+    if read_engine:
+        await read_engine.dispose()
+        read_engine = None
+        AsyncReadSessionLocal = None
     if engine:
         await engine.dispose()
         engine = None
 
 
+def get_sessionmaker() -> async_sessionmaker:
+    """
+    Returns the primary session factory, for code that runs outside of a request (e.g. background tasks).
+    """
+    if not AsyncSessionLocal:
+        raise RuntimeError(
+            "The SQLAlchemy engine hasn't been initialized. You must call `init_engine` on app startup.")
+    return AsyncSessionLocal
+
+
 # dependency for FastAPI routes
 async def get_session() -> AsyncGenerator[Any, Any]:
     # if the async session hasn't been initialized, then tell the user that init_engine wasn't
@@ -71,3 +235,20 @@ async def get_session() -> AsyncGenerator[Any, Any]:
             "The SQLAlchemy engine hasn't been initialized. You must call `init_engine` on app startup.")
     async with AsyncSessionLocal() as session:
         yield session
+
+
+# dependency for FastAPI routes that only read from the database
+async def get_read_session(
+    session: AsyncSession = Depends(get_session)
+) -> AsyncGenerator[Any, Any]:
+    """
+    Yields a session bound to the read replica. If there's no replica, then this yields the same primary session as `get_session` (which doesn't cost an extra connection).
+
+    Once the primary session of the same request writes something, the replica session will send its reads to the primary so that the request can always read its own writes.
+    """
+    if not AsyncReadSessionLocal:
+        yield session
+        return
+    async with AsyncReadSessionLocal() as read_session:
+        read_session.sync_session.info[PRIMARY_INFO_KEY] = session.sync_session.info
+        yield read_session
@@ -0,0 +1,81 @@
+import hmac
+from datetime import datetime, timezone
+from typing import Optional
+from sqlmodel.ext.asyncio.session import AsyncSession
+from core.cache import TTLCache
+from core.config import get_settings
+from crud.api_keys import get_user_and_hash_by_prefix, select_user_api_keys, save_api_key, delete_api_key
+from srv.schemas import ApiKey, ApiKeyCreated, ApiKeyPublic, UserPublic
+from srv.security import generate_api_key, get_api_key_prefix, hash_api_key
+
+settings = get_settings()
+
+# cache of users that authenticated with an API key; the keys are the hashes of the API keys.
+# NOTE: the cache is per worker, which is why its TTL is so short (see `revoke_api_key`)
+api_key_cache: TTLCache[str, UserPublic] = TTLCache(
+    maxsize=settings.auth_user_cache_size, ttl=settings.api_key_cache_ttl)
+
+
+async def create_api_key(session: AsyncSession, user: UserPublic, name: str) -> ApiKeyCreated:
+    """
+    Creates a new API key for `user`. The key is only ever returned here; afterwards, only its prefix is shown.
+    """
+    key, prefix = generate_api_key()
+    api_key = ApiKey(
+        user_id=user.id,
+        name=name,
+        prefix=prefix,
+        hashed_key=hash_api_key(key),
+        created_at=datetime.now(timezone.utc)
+    )
+    await save_api_key(session, api_key)
+    return ApiKeyCreated(**ApiKeyPublic.model_validate(api_key).model_dump(), key=key)
+
+
+async def list_api_keys(session: AsyncSession, user: UserPublic) -> list[ApiKeyPublic]:
+    """
+    Returns all of the API keys of `user` (without the keys themselves).
+    """
+    api_keys = await select_user_api_keys(session, user.id)
+    return [ApiKeyPublic.model_validate(api_key) for api_key in api_keys]
+
+
+async def revoke_api_key(session: AsyncSession, user: UserPublic, key_id: str) -> bool:
+    """
+    Deletes one of the API keys of `user`. Returns `False` if the user doesn't have a key with that ID.
+
+    The key stops working right away on this worker, but the other workers might still have it cached for up to `api_key_cache_ttl` seconds.
+    """
+    api_key = await delete_api_key(session, user.id, key_id)
+    if api_key is None:
+        return False
+    # this only clears *our* cache; the other workers find out once their entry expires
+    api_key_cache.pop(api_key.hashed_key)
+    return True
+
+
+async def get_user_by_api_key(session: AsyncSession, key: str) -> Optional[UserPublic]:
+    """
+    Returns the user that owns the API key, or `None` if the key isn't valid. The result is cached for `api_key_cache_ttl` seconds, so that bursts of requests with the same key don't hit the database.
+    """
+    prefix = get_api_key_prefix(key)
+    if prefix is None:
+        return None
+    hashed_key = hash_api_key(key)
+    if settings.auth_user_cache_enabled:
+        user = api_key_cache.get(hashed_key)
+        if user is not None:
+            return user
+
+    row = await get_user_and_hash_by_prefix(session, prefix)
+    if row is None:
+        return None
+    user_in_db, stored_hash = row
+    # constant-time comparison, so that the response time doesn't leak how much of the hash matched
+    if not hmac.compare_digest(hashed_key, stored_hash):
+        return None
+
+    user = UserPublic.model_validate(user_in_db, from_attributes=True)
+    if settings.auth_user_cache_enabled:
+        api_key_cache.set(hashed_key, user)
+    return user
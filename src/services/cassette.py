@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import threading
+from hashlib import sha256
+from pathlib import Path
+from typing import Literal, Optional
+import orjson
+from core.config import get_settings
+from srv.schemas import AnalysisResult
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint_llm_request(model: str, prompt: str, project_name: str, reqs: list[str]) -> str:
+    """
+    Returns a digest of everything that goes into an analysis, except for today's date (otherwise a cassette would only replay on the day that it was recorded). `prompt` should be the prompt *template*, so that changing it invalidates the old recordings.
+    """
+    return sha256(orjson.dumps([model, prompt, project_name, reqs])).hexdigest()
+
+
+class LLMCassette:
+    """
+    Records the LLM's analyses to a JSON lines file, keyed by a fingerprint of the request, and replays them from there. In "replay" mode the LLM is never called, so benchmarks and regression tests can push real (recorded) analyses through the rest of the pipeline without a network.
+
+    The whole cassette is loaded into memory up front, so replaying is a dict lookup (and validating the recorded JSON).
+    """
+
+    def __init__(self, path: Path, mode: Literal["record", "replay"]) -> None:
+        self.path = path
+        self.mode = mode
+        self._entries: dict[str, bytes] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            if self.mode == "replay":
+                logger.warning("The LLM cassette %s doesn't exist, so every analysis will fail.", self.path)
+            return
+        with open(self.path, "rb") as f:
+            for line_num, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = orjson.loads(line)
+                    # NOTE: a re-recorded request appends a new line, and the newest one wins
+                    self._entries[entry["fingerprint"]] = orjson.dumps(entry["response"])
+                except (orjson.JSONDecodeError, KeyError, TypeError):
+                    logger.warning("Skipping line %d of the LLM cassette %s, since it's malformed.", line_num, self.path)
+
+    def get(self, fingerprint: str) -> Optional[AnalysisResult]:
+        response = self._entries.get(fingerprint)
+        return AnalysisResult.model_validate_json(response) if response is not None else None
+
+    async def record(self, fingerprint: str, project_name: str, reqs: list[str], result: AnalysisResult) -> None:
+        """
+        Saves the LLM's analysis (the project name and requirements are saved too, so that the cassette is easy to read).
+        """
+        response = result.model_dump(mode="json")
+        line = orjson.dumps({"fingerprint": fingerprint, "project_name": project_name,
+                            "requirements": reqs, "response": response}) + b"\n"
+        self._entries[fingerprint] = orjson.dumps(response)
+        try:
+            await asyncio.to_thread(self._append, line)
+        except OSError as e:
+            # the analysis itself went fine, so a full disk shouldn't fail it
+            logger.warning("Couldn't record the analysis of %s: %s", project_name, e)
+
+    def _append(self, line: bytes) -> None:
+        # concurrent analyses record from different threads, so the lines mustn't interleave
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "ab") as f:
+                f.write(line)
+
+
+# the cassette of this worker (built on first use by `get_cassette`)
+cassette: Optional[LLMCassette] = None
+
+
+def get_cassette() -> Optional[LLMCassette]:
+    """
+    Returns the LLM cassette, or `None` if `llm_cassette_mode` is "off".
+    """
+    global cassette  # we gotta modify the pre-existing cassette
+    settings = get_settings()
+    if cassette is None and settings.llm_cassette_mode != "off":
+        cassette = LLMCassette(settings.llm_cassette_path, settings.llm_cassette_mode)
+    return cassette
@@ -1,13 +1,38 @@
+from typing import Optional
 from sqlmodel.ext.asyncio.session import AsyncSession
-from crud.events import upsert_event, select_project_events
-from srv.schemas import Event
+from core.metrics import Counter, Histogram
+from core.tracing import start_span
+from crud.events import upsert_event, select_latest_project_result, select_project_events
+from services.outbox import OutboxFull, get_outbox
+from srv.schemas import AnalysisResult, Event, EventType
+
+EVENTS_LOGGED = Counter(
+    "events_logged", "Events that were logged, by type.", labelnames=("event_type",))
+EVENT_WRITE_SECONDS = Histogram(
+    "event_write_seconds", "Time that logging an event took (i.e. the INSERT, or spooling it to the outbox).", labelnames=("event_type",))
+# resolving the children once keeps the label lookups off the hot path
+_EVENT_METRICS = {
+    t: (EVENTS_LOGGED.labels(t.value), EVENT_WRITE_SECONDS.labels(t.value)) for t in EventType
+}
 
 
 async def add_event(session: AsyncSession, event: Event) -> None:
     """
-    Business logic to add a new event.
+    Business logic to add a new event. If the outbox is enabled, the event is spooled and written to the database in the background (so `session` is only used if the outbox is full).
     """
-    await upsert_event(session, event)
+    logged, write_seconds = _EVENT_METRICS[event.event]
+    logged.inc()
+    outbox = get_outbox()
+    with write_seconds.time(), start_span("add_event", attributes={"event.type": event.event.value, "outbox": bool(outbox)}):
+        if outbox:
+            try:
+                outbox.enqueue(event)
+                return
+            except OutboxFull:
+                # the outbox is backed up (probably because the DB is struggling), so this request
+                # has to wait on the DB like it would without the outbox
+                pass
+        await upsert_event(session, event)
 
 
 async def list_events(session: AsyncSession, user_id: str, project_name: str) -> list[Event]:
@@ -16,3 +41,13 @@ async def list_events(session: AsyncSession, user_id: str, project_name: str) ->
     """
     events = await select_project_events(session, user_id, project_name)
     return events
+
+
+async def get_latest_result(session: AsyncSession, user_id: str, project_name: str) -> Optional[AnalysisResult]:
+    """
+    Returns the result of the most recent completed analysis of a project, or `None` if it was never analyzed successfully.
+    """
+    content = await select_latest_project_result(session, user_id, project_name)
+    if content is None:
+        return None
+    return AnalysisResult.model_validate_json(content)
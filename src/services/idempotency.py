@@ -0,0 +1,219 @@
+import asyncio
+from hashlib import sha256
+from math import inf
+from time import monotonic, time
+from typing import Awaitable, Callable, Optional, Protocol, TypeVar
+from pydantic import BaseModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+from core.cache import TTLCache
+from core.config import get_settings
+from crud.idempotency import claim_idempotency_key, complete_idempotency_key, release_idempotency_key, select_idempotency_key
+from db.session import get_sessionmaker
+from srv.schemas import IdempotencyKey
+
+settings = get_settings()
+
+M = TypeVar("M", bound=BaseModel)
+
+# how often the "database" backend checks whether the original request is done
+POLL_INTERVAL = 0.25
+
+
+class IdempotencyError(Exception):
+    def __init__(self, detail: str) -> None:
+        super().__init__(detail)
+        self.detail = detail
+
+
+class IdempotencyKeyReused(IdempotencyError):
+    """
+    Raised when an idempotency key is sent again with a different request.
+    """
+
+
+class IdempotencyKeyInUse(IdempotencyError):
+    """
+    Raised when the request that first used an idempotency key is still running (and we got tired of waiting for it).
+    """
+
+
+class IdempotencyStore(Protocol):
+    async def claim(self, key: str, fingerprint: str, ttl: float) -> Optional[IdempotencyKey]:
+        """
+        Claims `key` for `ttl` seconds. Returns `None` if we got it, or the record of whoever claimed it first (its `response` is `None` while that request is still running).
+        """
+        ...
+
+    async def complete(self, key: str, fingerprint: str, response: str, ttl: float) -> None:
+        """
+        Stores the response to the request that claimed `key` (with `fingerprint`), and keeps it for `ttl` seconds. Does nothing if another request has claimed or completed the key since (i.e. our claim expired).
+        """
+        ...
+
+    async def release(self, key: str) -> None:
+        """
+        Gives up a claim on `key` (but never a stored response).
+        """
+        ...
+
+    async def wait(self, key: str, timeout: float) -> None:
+        """
+        Waits (up to `timeout` seconds) for the request that claimed `key` to complete or release it.
+        """
+        ...
+
+
+class InMemoryIdempotencyStore:
+    """
+    Keeps the responses in this worker's memory. A retry that lands on another worker won't find them, so use the "database" backend if you run more than one.
+    """
+
+    def __init__(self, max_keys: int = 100_000, timer: Callable[[], float] = monotonic) -> None:
+        self._timer = timer
+        self._records: TTLCache[str, IdempotencyKey] = TTLCache(
+            maxsize=max_keys, ttl=inf, timer=timer)
+        # set when the request that claimed the key is done (one way or another)
+        self._done: dict[str, asyncio.Event] = {}
+
+    async def claim(self, key: str, fingerprint: str, ttl: float) -> Optional[IdempotencyKey]:
+        record = self._records.get(key)
+        if record is not None:
+            return record
+        self._records.set(key, IdempotencyKey(key=key, fingerprint=fingerprint,
+                          expires_at=self._timer() + ttl), ttl=ttl)
+        # if we took over an expired claim, whoever waits for it shouldn't sleep until their timeout
+        self._wake(key)
+        self._done[key] = asyncio.Event()
+        return None
+
+    async def complete(self, key: str, fingerprint: str, response: str, ttl: float) -> None:
+        record = self._records.get(key)
+        if record is not None and (record.fingerprint != fingerprint or record.response is not None):
+            # our claim expired, and another request claimed the key in the meantime
+            return
+        if record is not None:
+            # NOTE: popping it first makes sure that a `ttl` of 0 doesn't leave the claim behind
+            self._records.pop(key)
+            record.response = response
+            record.expires_at = self._timer() + ttl
+            self._records.set(key, record, ttl=ttl)
+        self._wake(key)
+
+    async def release(self, key: str) -> None:
+        record = self._records.get(key)
+        if record is not None and record.response is None:
+            self._records.pop(key)
+        self._wake(key)
+
+    async def wait(self, key: str, timeout: float) -> None:
+        done = self._done.get(key)
+        if done is None:
+            return
+        try:
+            await asyncio.wait_for(done.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _wake(self, key: str) -> None:
+        done = self._done.pop(key, None)
+        if done is not None:
+            done.set()
+
+
+class DatabaseIdempotencyStore:
+    """
+    Keeps the responses in the database, so that a retry gets the same response no matter which worker (or replica) it lands on.
+    """
+
+    def __init__(self, session_factory: Optional[Callable[[], AsyncSession]] = None, timer: Callable[[], float] = time) -> None:
+        self._session_factory = session_factory
+        # NOTE: this has to be the wall clock, since the timestamps are shared between machines
+        self._timer = timer
+
+    def _new_session(self) -> AsyncSession:
+        return (self._session_factory or get_sessionmaker())()
+
+    async def claim(self, key: str, fingerprint: str, ttl: float) -> Optional[IdempotencyKey]:
+        async with self._new_session() as session:
+            return await claim_idempotency_key(session, key, fingerprint, ttl, self._timer())
+
+    async def complete(self, key: str, fingerprint: str, response: str, ttl: float) -> None:
+        async with self._new_session() as session:
+            await complete_idempotency_key(session, key, fingerprint, response, self._timer() + ttl)
+
+    async def release(self, key: str) -> None:
+        async with self._new_session() as session:
+            await release_idempotency_key(session, key)
+
+    async def wait(self, key: str, timeout: float) -> None:
+        deadline = monotonic() + timeout
+        while monotonic() < deadline:
+            await asyncio.sleep(min(POLL_INTERVAL, max(deadline - monotonic(), 0)))
+            async with self._new_session() as session:
+                record = await select_idempotency_key(session, key)
+            if record is None or record.response is not None:
+                return
+
+
+# the idempotency store of this worker (built on first use)
+idempotency_store: Optional[IdempotencyStore] = None
+
+
+def get_idempotency_store() -> IdempotencyStore:
+    global idempotency_store    # we gotta modify the pre-existing store
+    if idempotency_store is None:
+        if settings.idempotency_backend == "database":
+            idempotency_store = DatabaseIdempotencyStore()
+        else:
+            idempotency_store = InMemoryIdempotencyStore()
+    return idempotency_store
+
+
+def fingerprint_request(*parts: str | bytes) -> str:
+    """
+    Hashes the parts of a request that an idempotency key must always be sent with.
+    """
+    digest = sha256()
+    for part in parts:
+        part = part.encode() if isinstance(part, str) else part
+        # the length prefix stops ("ab", "c") and ("a", "bc") from colliding
+        digest.update(len(part).to_bytes(8, "big") + part)
+    return digest.hexdigest()
+
+
+async def run_idempotently(key: str, fingerprint: str, model: type[M], run: Callable[[], Awaitable[M]], keep_for: Optional[Callable[[M], float]] = None) -> tuple[M, bool]:
+    """
+    Runs `run` at most once per `key` (as long as its response is kept). Retries get the stored response instead, or wait for the original request if it's still running. Returns the response, and whether it was replayed.
+
+    The response is kept for `idempotency_ttl` seconds, unless `keep_for` returns another number of seconds for it.
+
+    Only successful responses are stored: if `run` raises, the key is released, so that the retry runs again.
+
+    Raises an `IdempotencyKeyReused` if the key was first sent with a different request, or an `IdempotencyKeyInUse` if the original request is still running after `idempotency_wait_timeout` seconds.
+    """
+    store = get_idempotency_store()
+    deadline = monotonic() + settings.idempotency_wait_timeout
+    while True:
+        # NOTE: a worker might die halfway through a request, so claims expire
+        record = await store.claim(key, fingerprint, settings.idempotency_claim_ttl)
+        if record is None:
+            break
+        if record.fingerprint != fingerprint:
+            raise IdempotencyKeyReused(
+                "This idempotency key was already used for a different request.")
+        if record.response is not None:
+            return model.model_validate_json(record.response), True
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            raise IdempotencyKeyInUse(
+                "The original request with this idempotency key is still running. Please try again later.")
+        await store.wait(key, remaining)
+
+    try:
+        response = await run()
+    except BaseException:
+        await store.release(key)
+        raise
+    ttl = keep_for(response) if keep_for else settings.idempotency_ttl
+    await store.complete(key, fingerprint, response.model_dump_json(), ttl)
+    return response, False
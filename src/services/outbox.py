@@ -0,0 +1,332 @@
+import os
+import json
+import asyncio
+import logging
+import threading
+from collections import deque
+from pathlib import Path
+from queue import Empty, SimpleQueue
+from typing import Callable, Optional, TextIO
+from uuid import uuid4
+from pydantic import ValidationError
+from sqlalchemy.exc import DisconnectionError, InterfaceError, OperationalError
+from sqlmodel.ext.asyncio.session import AsyncSession
+from core.tracing import SpanContext, get_current_context, start_span
+from crud.events import insert_events
+from db.session import get_retry_delay
+from srv.schemas import Event
+
+# file locks are what stop two workers from draining the same spool. they're POSIX-only, so
+# without them (e.g. on Windows) you should only run one worker per outbox directory
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+SPOOL_SUFFIX = ".jsonl"
+# events that the database kept rejecting end up here (it's a subdirectory, so it's never adopted
+# as a spool)
+DEAD_LETTER_DIR = "dead-letter"
+# tells the spool writer to start the spool over
+_TRUNCATE = object()
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxFull(Exception):
+    """
+    Raised when the outbox already holds `max_pending` events that haven't been written yet.
+    """
+
+
+def is_transient(e: Exception) -> bool:
+    """
+    Whether an error is the database being unreachable (which fixes itself), rather than something about the events themselves.
+    """
+    if getattr(e, "connection_invalidated", False):
+        return True
+    return isinstance(e, (OSError, TimeoutError, asyncio.TimeoutError, DisconnectionError, InterfaceError, OperationalError))
+
+
+class EventOutbox:
+    """
+    Write-behind outbox for events.
+
+    `enqueue` hands the event to a background thread that appends it to a local append-only spool file, adds it to an in-memory queue, then returns right away. A background task drains the queue into the database in bulk. The spool is only truncated once everything in it has been committed, so if the DB is down (or the worker dies), the events are still on disk and get replayed on the next start. The only events that can get lost are the ones that the spool thread hadn't written yet when the process died.
+
+    While the DB is unreachable, a batch is retried for as long as it takes. Any other error is retried `max_attempts` times, after which the batch is split in half (and so on) until the events that the DB rejects are found; those are moved to a dead-letter file in `spool_dir`, so that they don't hold up everything after them. At most `max_pending` events are held in memory; past that, `enqueue` raises `OutboxFull`.
+
+    Every worker owns (and locks) its own spool file in `spool_dir`. On start, a worker adopts any spool files that aren't locked by a live worker.
+    """
+
+    def __init__(
+        self,
+        spool_dir: Path,
+        session_factory: Callable[[], AsyncSession],
+        batch_size: int = 500,
+        flush_interval: float = 0.05,
+        fsync: bool = False,
+        max_pending: int = 10000,
+        max_attempts: int = 5,
+        max_retry_delay: float = 5.0
+    ) -> None:
+        self.spool_dir = Path(spool_dir)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.max_retry_delay = max_retry_delay
+        self._session_factory = session_factory
+        self._pending: deque[Event] = deque()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._in_flight = 0
+        # IDs of replayed events; these might've been committed right before the last worker died
+        self._replayed_ids: set[str] = set()
+        # the spans that enqueued the pending events, so that the batch that writes them can link
+        # back to the requests they came from
+        self._trace_links: dict[str, SpanContext] = {}
+        self._spool: Optional[TextIO] = None
+        self._spool_path: Optional[Path] = None
+        # the lines (or `_TRUNCATE`) that the spool thread still has to write; `None` stops it
+        self._spool_queue: SimpleQueue = SimpleQueue()
+        self._spool_thread: Optional[threading.Thread] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def depth(self) -> int:
+        """The number of events that haven't been committed yet."""
+        return len(self._pending) + self._in_flight
+
+    async def start(self) -> None:
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        name = f"events-{os.getpid()}-{uuid4().hex[:8]}"
+        self._spool_path = self.spool_dir / f"{name}{SPOOL_SUFFIX}"
+        # NOTE: the spool is locked *before* it gets a name that other workers look for, otherwise a
+        # worker that's starting at the same time could adopt (and delete) it before we lock it
+        unlocked_path = self.spool_dir / f"{name}.tmp"
+        self._spool = open(unlocked_path, "a", encoding="utf-8")
+        if fcntl:
+            fcntl.flock(self._spool.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        unlocked_path.rename(self._spool_path)
+        self._spool_thread = threading.Thread(target=self._spool_forever, name="outbox-spool", daemon=True)
+        self._spool_thread.start()
+
+        self._adopt_orphaned_spools()
+        self._task = asyncio.create_task(self._drain_forever())
+
+    def enqueue(self, event: Event) -> None:
+        """
+        Records the event in the spool and schedules it to be written to the database. Throws an `OutboxFull` if there are already `max_pending` events waiting to be written (e.g. because the DB has been down for a while).
+        """
+        if not self._spool:
+            raise RuntimeError(
+                "The event outbox hasn't been started. You must call `start` on app startup.")
+        if len(self._pending) >= self.max_pending:
+            raise OutboxFull(f"The event outbox already holds {len(self._pending)} events.")
+        self._add(event)
+
+    def _add(self, event: Event) -> None:
+        self._spool_queue.put(event.model_dump_json() + "\n")
+        self._pending.append(event)
+        context = get_current_context()
+        if context and context.sampled:
+            self._trace_links[event.id] = context
+        self._wakeup.set()
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """
+        Tries to drain the outbox before shutting down. Anything that couldn't be written within `timeout` seconds stays in the spool and will be replayed on the next start.
+        """
+        self._stopping = True
+        self._wakeup.set()
+        if self._task:
+            try:
+                await asyncio.wait_for(self._task, timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._task = None
+
+        if self._spool_thread:
+            self._spool_queue.put(None)
+            await asyncio.to_thread(self._spool_thread.join)
+            self._spool_thread = None
+        if self._spool:
+            drained = self.depth == 0
+            self._spool.close()
+            self._spool = None
+            # an empty spool is just clutter, so remove it
+            if drained and self._spool_path:
+                self._spool_path.unlink(missing_ok=True)
+
+    def _adopt_orphaned_spools(self) -> None:
+        """
+        Copies the events from spool files that no live worker holds into our own spool, then queues them up.
+        """
+        for path in sorted(self.spool_dir.glob(f"*{SPOOL_SUFFIX}")):
+            if path == self._spool_path:
+                continue
+            try:
+                orphan = open(path, "r+", encoding="utf-8")
+            except FileNotFoundError:
+                continue    # another worker adopted it in the meantime
+            with orphan:
+                if fcntl:
+                    try:
+                        fcntl.flock(orphan.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue    # another worker still owns this spool
+                # another worker might've adopted (and deleted) it between our `open` and `flock`
+                if os.fstat(orphan.fileno()).st_nlink == 0:
+                    continue
+                for line in orphan:
+                    # NOTE: table models don't coerce types in `model_validate_json`, so we parse the
+                    # JSON ourselves first
+                    try:
+                        event = Event.model_validate(json.loads(line))
+                    except (json.JSONDecodeError, ValidationError):
+                        # the worker probably died halfway through writing this line
+                        continue
+                    # NOTE: this skips the `max_pending` check, since these events are already on disk
+                    self._add(event)
+                    self._replayed_ids.add(event.id)
+            path.unlink(missing_ok=True)
+
+        if self._replayed_ids:
+            logger.info("Replaying %d spooled event(s).", len(self._replayed_ids))
+
+    async def _drain_forever(self) -> None:
+        while True:
+            if not self._pending:
+                if self._stopping:
+                    return
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                # give other requests a moment to add to the batch
+                if not self._stopping and len(self._pending) < self.batch_size:
+                    await asyncio.sleep(self.flush_interval)
+                # we might've only been woken up to stop
+                if not self._pending:
+                    continue
+
+            batch = [self._pending.popleft()
+                     for _ in range(min(self.batch_size, len(self._pending)))]
+            self._in_flight = len(batch)
+            await self._write_with_retries(batch)
+            self._in_flight = 0
+            for e in batch:
+                self._trace_links.pop(e.id, None)
+
+            # everything in the spool has been committed (or dead-lettered), so we can start it over.
+            # NOTE: the spool thread writes in order, so this can't drop a line that's still queued up
+            if not self._pending:
+                self._spool_queue.put(_TRUNCATE)
+
+    async def _write_with_retries(self, batch: list[Event]) -> None:
+        """
+        Writes the batch, retrying for as long as the DB is unreachable. If the DB keeps rejecting the batch itself, it's split in half to find the event(s) that it doesn't like, and those are dead-lettered.
+        """
+        links = [self._trace_links[e.id] for e in batch if e.id in self._trace_links]
+        attempt = rejections = 0
+        while True:
+            try:
+                # every attempt gets a span of its own (linked to the requests of the batch),
+                # so that retries show up in the traces
+                with start_span("outbox.write_batch", attributes={"outbox.batch_size": len(batch), "outbox.attempt": attempt + 1}, links=links):
+                    await self._write_batch(batch)
+                return
+            except Exception as e:
+                logger.warning("Failed to write %d event(s) from the outbox (attempt %d): %s",
+                               len(batch), attempt + 1, e)
+                if not is_transient(e):
+                    rejections += 1
+                    if rejections >= self.max_attempts:
+                        error = e
+                        break
+                await asyncio.sleep(get_retry_delay(attempt, 0.1, self.max_retry_delay))
+                attempt += 1
+
+        if len(batch) == 1:
+            await asyncio.to_thread(self._dead_letter, batch[0], error)
+            return
+        middle = len(batch) // 2
+        await self._write_with_retries(batch[:middle])
+        await self._write_with_retries(batch[middle:])
+
+    def _dead_letter(self, event: Event, error: Exception) -> None:
+        path = self.spool_dir / DEAD_LETTER_DIR / f"events{SPOOL_SUFFIX}"
+        logger.error("Giving up on writing event %s from the outbox, it's been moved to %s: %s", event.id, path, error)
+        line = json.dumps({"error": str(error), "event": json.loads(event.model_dump_json())})
+        path.parent.mkdir(exist_ok=True)
+        # NOTE: lines this short are appended in one go, so workers can share the file
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+        self._replayed_ids.discard(event.id)
+
+    def _spool_forever(self) -> None:
+        """
+        Writes the queued up lines to the spool (with a single flush, and fsync, for everything that's queued up at the time), so that the event loop never waits on the disk.
+        """
+        stopping = False
+        while not stopping:
+            item = self._spool_queue.get()
+            items = [item]
+            while True:
+                try:
+                    items.append(self._spool_queue.get_nowait())
+                except Empty:
+                    break
+            stopping = any(item is None for item in items)
+            try:
+                for item in items:
+                    if item is None:
+                        continue
+                    if item is _TRUNCATE:
+                        self._spool.truncate(0)
+                    else:
+                        self._spool.write(item)
+                self._spool.flush()
+                if self.fsync:
+                    os.fsync(self._spool.fileno())
+            except Exception as e:  # pragma: no cover
+                # the events are still in memory, so a full disk only costs us the crash safety
+                logger.warning("Couldn't write to the outbox spool %s: %s", self._spool_path, e)
+
+    async def _write_batch(self, batch: list[Event]) -> None:
+        replayed = [e.id for e in batch if e.id in self._replayed_ids]
+        async with self._session_factory() as session:
+            await insert_events(session, batch, skip_existing=bool(replayed))
+        self._replayed_ids.difference_update(replayed)
+
+
+# the outbox for this worker (if it's enabled)
+outbox: Optional[EventOutbox] = None
+
+
+def get_outbox() -> Optional[EventOutbox]:
+    return outbox
+
+
+async def start_outbox(
+    spool_dir: Path,
+    session_factory: Callable[[], AsyncSession],
+    batch_size: int = 500,
+    flush_interval: float = 0.05,
+    fsync: bool = False,
+    max_pending: int = 10000
+) -> EventOutbox:
+    global outbox   # we gotta modify the pre-existing outbox
+    if outbox:
+        return outbox
+    outbox = EventOutbox(spool_dir, session_factory, batch_size=batch_size,
+                         flush_interval=flush_interval, fsync=fsync, max_pending=max_pending)
+    await outbox.start()
+    return outbox
+
+
+async def stop_outbox(timeout: float = 10.0) -> None:
+    global outbox   # we gotta modify the pre-existing outbox
+    if outbox:
+        await outbox.stop(timeout)
+        outbox = None
@@ -0,0 +1,202 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from math import ceil, inf
+from time import monotonic, time
+from typing import AsyncIterator, Callable, Optional, Protocol
+from uuid import uuid4
+from fastapi import HTTPException, status
+from sqlmodel.ext.asyncio.session import AsyncSession
+from core.cache import TTLCache
+from core.config import get_settings
+from crud.rate_limits import take_bucket_token, acquire_concurrency_slot, extend_concurrency_slot, release_concurrency_slot
+from db.session import get_sessionmaker
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# there's no telling when a running analysis will finish, so this is what we suggest to users
+# that hit the concurrency limit
+CONCURRENCY_RETRY_AFTER = 5.0
+
+
+class RateLimitExceeded(Exception):
+    """
+    Raised when a user has to wait before they can do something again.
+    """
+
+    def __init__(self, detail: str, retry_after: float) -> None:
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class RateLimiter(Protocol):
+    async def take_token(self, key: str, rate: float, burst: int) -> float:
+        """
+        Takes a token from the bucket of `key` (refills at `rate` tokens per second, up to `burst` tokens). Returns 0 if a token was taken, or how many seconds to wait until one is available.
+        """
+        ...
+
+    async def acquire_slot(self, key: str, limit: int, ttl: float) -> Optional[str]:
+        """
+        Acquires one of the `limit` slots of `key`. Returns the ID of the slot, or `None` if all of them are taken.
+        """
+        ...
+
+    async def extend_slot(self, key: str, slot_id: str, ttl: float) -> None:
+        """
+        Makes the slot last for another `ttl` seconds.
+        """
+        ...
+
+    async def release_slot(self, key: str, slot_id: str) -> None:
+        ...
+
+
+class InMemoryRateLimiter:
+    """
+    Keeps the limits in this worker's memory. It's fast, but every worker enforces the limits on its own (i.e. with 4 workers, a user effectively gets 4x the limits).
+    """
+
+    def __init__(self, max_keys: int = 100_000, timer: Callable[[], float] = monotonic) -> None:
+        self._timer = timer
+        # a bucket that had time to refill completely is the same as a missing one, so it can expire
+        self._buckets: TTLCache[str, tuple[float, float]] = TTLCache(
+            maxsize=max_keys, ttl=inf, timer=timer)
+        self._slots: dict[str, set[str]] = {}
+
+    async def take_token(self, key: str, rate: float, burst: int) -> float:
+        now = self._timer()
+        tokens, updated_at = self._buckets.get(key) or (float(burst), now)
+        tokens = min(burst, tokens + (now - updated_at) * rate)
+        if tokens < 1:
+            return (1 - tokens) / rate
+        tokens -= 1
+        self._buckets.set(key, (tokens, now), ttl=(burst - tokens) / rate)
+        return 0.0
+
+    async def acquire_slot(self, key: str, limit: int, ttl: float) -> Optional[str]:
+        slots = self._slots.setdefault(key, set())
+        if len(slots) >= limit:
+            return None
+        slot_id = str(uuid4())
+        slots.add(slot_id)
+        return slot_id
+
+    async def extend_slot(self, key: str, slot_id: str, ttl: float) -> None:
+        # NOTE: the slots in memory never expire (they go away with the worker)
+        pass
+
+    async def release_slot(self, key: str, slot_id: str) -> None:
+        slots = self._slots.get(key)
+        if slots is not None:
+            slots.discard(slot_id)
+            if not slots:
+                del self._slots[key]
+
+
+class DatabaseRateLimiter:
+    """
+    Keeps the limits in the database, so that they hold across every worker (and every replica of the server). Costs a couple of small queries per limited request.
+    """
+
+    def __init__(self, session_factory: Optional[Callable[[], AsyncSession]] = None, timer: Callable[[], float] = time) -> None:
+        # NOTE: the limits are committed in their own sessions (not the request's), so that they
+        # stick even if the request fails
+        self._session_factory = session_factory
+        # NOTE: this has to be the wall clock, since the timestamps are shared between machines
+        self._timer = timer
+
+    def _new_session(self) -> AsyncSession:
+        return (self._session_factory or get_sessionmaker())()
+
+    async def take_token(self, key: str, rate: float, burst: int) -> float:
+        async with self._new_session() as session:
+            return await take_bucket_token(session, key, rate, burst, self._timer())
+
+    async def acquire_slot(self, key: str, limit: int, ttl: float) -> Optional[str]:
+        async with self._new_session() as session:
+            return await acquire_concurrency_slot(session, key, limit, ttl, self._timer())
+
+    async def extend_slot(self, key: str, slot_id: str, ttl: float) -> None:
+        async with self._new_session() as session:
+            await extend_concurrency_slot(session, slot_id, ttl, self._timer())
+
+    async def release_slot(self, key: str, slot_id: str) -> None:
+        async with self._new_session() as session:
+            await release_concurrency_slot(session, slot_id)
+
+
+# the rate limiter of this worker (built on first use)
+rate_limiter: Optional[RateLimiter] = None
+
+
+def get_rate_limiter() -> RateLimiter:
+    global rate_limiter     # we gotta modify the pre-existing rate limiter
+    if rate_limiter is None:
+        if settings.rate_limit_backend == "database":
+            rate_limiter = DatabaseRateLimiter()
+        else:
+            rate_limiter = InMemoryRateLimiter()
+    return rate_limiter
+
+
+async def _keep_slot(limiter: RateLimiter, key: str, slot_id: str, ttl: float) -> None:
+    """
+    Extends the slot every `ttl / 3` seconds until it's cancelled, so that a slow analysis doesn't lose its slot halfway through.
+    """
+    while True:
+        await asyncio.sleep(ttl / 3)
+        try:
+            await limiter.extend_slot(key, slot_id, ttl)
+        except Exception:
+            # NOTE: the next attempt might go through, and the slot has `ttl / 3` seconds to spare
+            logger.exception("Couldn't extend the concurrency slot %s", slot_id)
+
+
+@asynccontextmanager
+async def analysis_quota(user_id: str) -> AsyncIterator[None]:
+    """
+    Holds one of the user's analysis slots while the block runs. Raises a `RateLimitExceeded` if the user started too many analyses recently, or has too many of them running right now.
+    """
+    limiter = get_rate_limiter()
+    key = f"analyze:{user_id}"
+
+    slot_id = None
+    keeper = None
+    if settings.analyze_max_concurrent_per_user > 0:
+        slot_id = await limiter.acquire_slot(key, settings.analyze_max_concurrent_per_user, settings.analyze_slot_ttl)
+        if slot_id is None:
+            raise RateLimitExceeded(
+                f"You can only run {settings.analyze_max_concurrent_per_user} analyses at once. Please wait for one of them to finish.", CONCURRENCY_RETRY_AFTER)
+        keeper = asyncio.create_task(_keep_slot(limiter, key, slot_id, settings.analyze_slot_ttl))
+    try:
+        # NOTE: the token is only taken once we know that the analysis can run, so that a request
+        # that's turned away for having too many analyses running doesn't use up a token too
+        if settings.analyze_rate_limit_per_minute > 0:
+            wait = await limiter.take_token(key, settings.analyze_rate_limit_per_minute / 60, settings.analyze_rate_limit_burst)
+            if wait > 0:
+                raise RateLimitExceeded(
+                    "You've started too many analyses recently. Please try again later.", wait)
+        yield
+    finally:
+        if keeper is not None:
+            keeper.cancel()
+        if slot_id is not None:
+            await limiter.release_slot(key, slot_id)
+
+
+# wraps the work of routes that start an analysis; holds one of the user's analysis slots until
+# the block is done, and turns the limits into 429s
+@asynccontextmanager
+async def enforce_analysis_quota(user_id: str) -> AsyncIterator[None]:
+    try:
+        async with analysis_quota(user_id):
+            yield
+    except RateLimitExceeded as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=e.detail,
+            headers={"Retry-After": str(ceil(e.retry_after))}
+        )
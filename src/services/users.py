@@ -1,8 +1,27 @@
+import logging
+from time import time
 from typing import Optional
 from sqlmodel.ext.asyncio.session import AsyncSession
-from crud.users import get_user_by_username, save_user
+from core.cache import TTLCache
+from core.config import get_settings
+from crud.users import get_user_by_username, save_user, select_existing_usernames, insert_users
 from srv.schemas import UserPublic, UserCreate, User
-from srv.security import verify_pwd, get_hashed_pwd
+from srv.security import verify_pwd, get_hashed_pwd, pwd_needs_rehash, run_in_hash_pool, hash_passwords
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+# cache of authenticated users (see `get_authenticated_user`)
+user_cache: TTLCache[str, UserPublic] = TTLCache(
+    maxsize=settings.auth_user_cache_size, ttl=settings.auth_user_cache_ttl)
+
+
+def invalidate_cached_user(username: str) -> None:
+    """
+    Drops a user from this worker's authenticated-user cache. Call this whenever a user is saved. The other workers keep their cached copy until it expires (i.e. for up to `auth_user_cache_ttl` seconds).
+    """
+    user_cache.pop(username)
 
 
 async def get_user(session: AsyncSession, username: str) -> Optional[UserPublic]:
@@ -16,6 +35,24 @@ async def get_user(session: AsyncSession, username: str) -> Optional[UserPublic]
     return None
 
 
+async def get_authenticated_user(session: AsyncSession, username: str, token_expires_at: Optional[float] = None) -> Optional[UserPublic]:
+    """
+    Like `get_user`, but for users that just proved who they are with a verified token. The result is cached for a short while (and never past `token_expires_at`, a UNIX timestamp), so that repeat requests with the same token don't hit the database.
+    """
+    if not settings.auth_user_cache_enabled:
+        return await get_user(session, username)
+
+    user = user_cache.get(username)
+    if user is not None:
+        return user
+
+    user = await get_user(session, username)
+    if user is not None:
+        ttl = None if token_expires_at is None else token_expires_at - time()
+        user_cache.set(username, user, ttl=ttl)
+    return user
+
+
 async def authenticate_user(session: AsyncSession, username: str, password: str) -> Optional[UserPublic]:
     """
     Given a `username` and `password` associated with a valid user, this will return a `UserPublic`. Otherwise, it will return `None`.
@@ -24,9 +61,20 @@ async def authenticate_user(session: AsyncSession, username: str, password: str)
     user: Optional[User] = await get_user_by_username(session, username)
     if not user:
         return None
-    if not verify_pwd(password, user.hashed_password):
+    if not await run_in_hash_pool(verify_pwd, password, user.hashed_password):
         return None
 
+    # this is the only time that we see the password, so it's our chance to upgrade its hash
+    # whenever the hashing scheme (or its cost) was changed
+    if pwd_needs_rehash(user.hashed_password):
+        try:
+            user.hashed_password = await run_in_hash_pool(get_hashed_pwd, password)
+            await save_user(session, user)
+        except Exception as e:
+            # the old hash still works, so this shouldn't stop the user from logging in
+            await session.rollback()
+            logger.warning("Couldn't rehash the password of '%s': %s", username, e)
+
     # once proven successful, return the user
     return UserPublic.model_validate(user, from_attributes=True)
 
@@ -46,7 +94,7 @@ async def create_user(session: AsyncSession, user: UserCreate) -> UserPublic:
     if existing_user:
         raise ValueError("A user with this username is already registered.")
 
-    hashed_pwd = get_hashed_pwd(user.password)
+    hashed_pwd = await run_in_hash_pool(get_hashed_pwd, user.password)
     user_in_db = User(
         **user.model_dump(),
         hashed_password=hashed_pwd
@@ -54,6 +102,44 @@ async def create_user(session: AsyncSession, user: UserCreate) -> UserPublic:
 
     # use the database layer to save the user
     await save_user(session, user_in_db)
+    invalidate_cached_user(user_in_db.username)
 
     # this should return a valid UserPublic object WITHOUT the password
     return UserPublic.model_validate(user_in_db, from_attributes=True)
+
+
+async def create_users(session: AsyncSession, users: list[UserCreate]) -> tuple[list[UserPublic], list[str]]:
+    """
+    Creates many users at once (e.g. when onboarding a team). Usernames that are already registered (or repeated in `users`) are skipped. Returns the created `UserPublic`s and the skipped usernames.
+    """
+    unique: dict[str, UserCreate] = {}
+    skipped: list[str] = []
+    for user in users:
+        if user.username in unique:
+            skipped.append(user.username)
+        else:
+            unique[user.username] = user
+
+    # check all of the usernames at once, so that we only hash the passwords that we need
+    existing = await select_existing_usernames(session, list(unique))
+    skipped.extend(username for username in unique if username in existing)
+    to_create = [user for username, user in unique.items()
+                 if username not in existing]
+
+    hashed_pwds = await hash_passwords([user.password for user in to_create], workers=settings.bulk_hash_workers)
+    users_in_db = [
+        User(**user.model_dump(exclude={"password"}), hashed_password=hashed_pwd)
+        for user, hashed_pwd in zip(to_create, hashed_pwds)
+    ]
+    inserted_ids = await insert_users(session, users_in_db)
+
+    created: list[UserPublic] = []
+    for user_in_db in users_in_db:
+        if user_in_db.id in inserted_ids:
+            invalidate_cached_user(user_in_db.username)
+            created.append(UserPublic.model_validate(
+                user_in_db, from_attributes=True))
+        else:
+            # someone registered this username while we were hashing
+            skipped.append(user_in_db.username)
+    return created, skipped
@@ -1,19 +1,36 @@
-from typing import Annotated, Optional
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Annotated, Any, AsyncIterator, Optional
 from datetime import datetime, date, timezone
 from email.utils import format_datetime
 from uuid import uuid4
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Form, HTTPException, UploadFile, File, Depends, status
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import SystemMessage, HumanMessage
+from fastapi import APIRouter, FastAPI, Form, Header, HTTPException, Request, Response, UploadFile, File, Depends, status
 from sqlmodel.ext.asyncio.session import AsyncSession
-from core.config import get_settings
+from core.config import Settings, get_settings
+from core.logs import setup_logging, shutdown_logging
+from core.loop_monitor import start_loop_monitor, stop_loop_monitor
+from core.tracing import SPAN_KIND_CLIENT, setup_tracing, shutdown_tracing, start_span
+from core.metrics import Counter, Gauge, Histogram
+from services.cassette import fingerprint_llm_request, get_cassette
 from services.events import add_event
-from db.session import get_session, init_engine, close_engine
+from services.idempotency import IdempotencyKeyInUse, IdempotencyKeyReused, fingerprint_request, run_idempotently
+from services.outbox import start_outbox, stop_outbox
+from services.rate_limits import enforce_analysis_quota
+from db.session import get_session, get_sessionmaker, init_engine, close_engine
 from .schemas import AnalyzeResponse, AnalysisResult, Event, EventType, Status, UserPublic
-from .routers import llm as llm_router, status as status_router, users as users_router
+from .responses import MSGPACK_RESPONSE_DOCS, ORJSONResponse, negotiated_response
+from .routers import admin as admin_router, events as events_router, llm as llm_router, metrics as metrics_router, status as status_router, users as users_router
 from .validators import parse_requirements_file, validate_requirements_file
-from .security import get_current_user
+from .middleware import ProfilingMiddleware, TracingMiddleware
+from .security import get_current_user, shutdown_hash_pool
+
+# NOTE: LangChain (and the OpenAI SDK under it) takes longer to import than the rest of the app
+# combined, so it's only imported when the LLM is first needed (see `get_llm`)
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
+
+logger = logging.getLogger(__name__)
 
 # corresponds to commit 11b42e4
 DEPRECATION_DATE = datetime(2025, 8, 21, 22, 23, 6, tzinfo=timezone.utc)
@@ -21,37 +38,140 @@ DEPRECATION_DATE = datetime(2025, 8, 21, 22, 23, 6, tzinfo=timezone.utc)
 SUNSET_DATE = datetime(2025, 8, 30, 23, 59, 59, tzinfo=timezone.utc)
 
 
-# importing secrets from the .env file
-settings = get_settings()
-if not settings.openai_api_key:
-    raise RuntimeError("OPENAI_API_KEY is required to call the LLM.")
-if not settings.db_url:
-    raise RuntimeError("DB_URL is required to run the server.")
+def check_settings(settings: Settings) -> None:
+    """
+    Makes sure that everything the server needs to run has been configured.
+    """
+    # NOTE: replaying a cassette never calls the LLM, so it doesn't need a key
+    if not settings.openai_api_key and settings.llm_cassette_mode != "replay":
+        raise RuntimeError("OPENAI_API_KEY is required to call the LLM.")
+    if not settings.db_url:
+        raise RuntimeError("DB_URL is required to run the server.")
+
+
+ANALYSES_IN_FLIGHT = Gauge(
+    "analyses_in_flight", "Analyses that are currently running on this worker.")
+ANALYZE_STAGE_SECONDS = Histogram(
+    "analyze_stage_seconds", "Time that each stage of an analysis took.", labelnames=("stage",))
+# resolving the children once keeps the label lookups off the hot path
+UPLOAD_READ_SECONDS = ANALYZE_STAGE_SECONDS.labels("upload_read")
+VALIDATION_SECONDS = ANALYZE_STAGE_SECONDS.labels("validation")
+PARSING_SECONDS = ANALYZE_STAGE_SECONDS.labels("parsing")
+LLM_SECONDS = ANALYZE_STAGE_SECONDS.labels("llm")
+SERIALIZATION_SECONDS = ANALYZE_STAGE_SECONDS.labels("serialization")
+LLM_REQUESTS = Counter(
+    "llm_requests", "Calls to the LLM, by outcome.", labelnames=("outcome",))
+LLM_SUCCEEDED = LLM_REQUESTS.labels("success")
+LLM_FAILED = LLM_REQUESTS.labels("error")
+
+
+async def track_analysis() -> AsyncIterator[None]:
+    """
+    Dependency that counts the analyses that are running (see "analyses_in_flight" on "/metrics").
+    """
+    ANALYSES_IN_FLIGHT.inc()
+    try:
+        yield
+    finally:
+        ANALYSES_IN_FLIGHT.dec()
 
 
 @asynccontextmanager
-async def lifespan(app):
+async def lifespan(app: FastAPI):
+    settings: Settings = app.state.settings
+    check_settings(settings)
+    # from now on, logs are written by a background thread instead of on the event loop
+    setup_logging(settings)
+    setup_tracing(settings)
+    start_loop_monitor(settings)
+    metrics_router.start_metrics_sharing(settings)
     # initialize the SQLAlchemy engine (with retries)
     # NOTE: this line will throw an error if it fails to connect with the database
-    await init_engine(str(settings.db_url), max_retries=5, retry_delay=1.0)
+    await init_engine(
+        str(settings.db_url),
+        max_retries=5,
+        retry_delay=1.0,
+        read_db_url=str(settings.db_read_url) if settings.db_read_url else None,
+        startup_mode=settings.db_startup_mode
+    )
+    # start writing events in the background (this also replays events that were spooled, but
+    # never made it into the database)
+    if settings.event_outbox_enabled:
+        await start_outbox(
+            settings.event_outbox_dir,
+            get_sessionmaker(),
+            batch_size=settings.event_outbox_batch_size,
+            flush_interval=settings.event_outbox_flush_interval,
+            fsync=settings.event_outbox_fsync,
+            max_pending=settings.event_outbox_max_pending
+        )
+    # pay for importing LangChain now, instead of on the first analysis
+    if settings.llm_preload:
+        await asyncio.to_thread(get_llm)
     try:
         yield
     finally:
+        # NOTE: by now, uvicorn has already waited for the in-flight requests (or cancelled them after
+        # `server_graceful_timeout`), so all that's left is to drain the outbox before the engine goes away
+        await stop_outbox()
         await close_engine()
+        shutdown_hash_pool()
+        await metrics_router.stop_metrics_sharing(settings)
+        await stop_loop_monitor()
+        shutdown_tracing()
+        shutdown_logging()
+
+
+# routes that live on the app itself (i.e. not in "routers")
+router = APIRouter()
+
+
+def create_app(settings: Optional[Settings] = None) -> FastAPI:
+    """
+    Builds the FastAPI app. Nothing expensive happens here (the database and the LLM are set up on startup or on first use), so workers can import and build the app quickly.
+    """
+    app = FastAPI(lifespan=lifespan)
+    settings = settings or get_settings()
+    app.state.settings = settings
+    app.include_router(router)
+    app.include_router(users_router.router)
+    app.include_router(events_router.router)
+    app.include_router(admin_router.router)
+    if settings.metrics_enabled:
+        app.include_router(metrics_router.router)
+    if settings.tracing_exporter != "none":
+        app.add_middleware(TracingMiddleware)
+    # NOTE: this is added last, so that it wraps everything else (including the tracing)
+    if settings.profiling_enabled:
+        app.add_middleware(ProfilingMiddleware, directory=settings.profiling_dir,
+                           fmt=settings.profiling_format)
+    # all routes from this router are deprecated as of v0.2.0
+    app.include_router(llm_router.router)
+    # all routes from this router are deprecated as of v0.3.0
+    app.include_router(status_router.router)
+    return app
 
-app = FastAPI(lifespan=lifespan)
-app.include_router(users_router.router)
-# all routes from this router are deprecated as of v0.2.0
-app.include_router(llm_router.router)
-# all routes from this router are deprecated as of v0.3.0
-app.include_router(status_router.router)
 
 # LLM / OpenAI definitions
-llm = ChatOpenAI(
-    model="gpt-4o-mini",
-    temperature=0.0,
-    api_key=settings.openai_api_key,
-)
+# NOTE: built on first use by `get_llm`
+llm: Optional["ChatOpenAI"] = None
+LLM_MODEL = "gpt-4o-mini"
+
+
+def get_llm() -> "ChatOpenAI":
+    global llm  # we gotta modify the pre-existing LLM
+    if llm is None:
+        from langchain_openai import ChatOpenAI
+
+        settings = get_settings()
+        llm = ChatOpenAI(
+            model=LLM_MODEL,
+            temperature=0.0,
+            api_key=settings.openai_api_key,
+            base_url=settings.openai_base_url,
+        )
+    return llm
+
 
 SYSTEM_PROMPT = (
     "You are a license analysis assistant.\n"
@@ -80,7 +200,7 @@ FEW_SHOT = (
 
 
 # this route is deprecated as of v0.2.0 (might be reenabled later on, we'll see!)
-@app.get("/", deprecated=True)
+@router.get("/", deprecated=True)
 async def root() -> None:
     raise HTTPException(
         status_code=status.HTTP_410_GONE,
@@ -100,11 +220,25 @@ async def get_llm_analysis(
     reqs: list[str]
 ) -> Optional[AnalysisResult]:
     """
-    Runs in a FastAPI BackgroundTask. Calls the LLM via LangChain with structured output. Returns the `AnalysisResult`. On error, returns `None`.
+    Runs in a FastAPI BackgroundTask. Calls the LLM via LangChain with structured output. Returns the `AnalysisResult`. On error, returns `None`. If the LLM cassette is on, the analysis is recorded to it (or replayed from it, without calling the LLM).
     """
+    cassette = get_cassette()
+    fingerprint = fingerprint_llm_request(LLM_MODEL, SYSTEM_PROMPT + FEW_SHOT, project_name, reqs) if cassette is not None else ""
+    if cassette is not None and cassette.mode == "replay":
+        result = cassette.get(fingerprint)
+        if result is None:
+            LLM_FAILED.inc()
+            logger.warning("get_llm_analysis has no recorded response for %s.", project_name,
+                           extra={"project_name": project_name, "fingerprint": fingerprint})
+            return None
+        LLM_SUCCEEDED.inc()
+        return result
+
     try:
+        from langchain_core.messages import SystemMessage, HumanMessage
+
         # bind the Pydantic output schema directly to the LLM
-        structured_llm = llm.with_structured_output(AnalysisResult)
+        structured_llm = get_llm().with_structured_output(AnalysisResult)
 
         messages = [
             SystemMessage(content=SYSTEM_PROMPT.format(
@@ -120,35 +254,52 @@ async def get_llm_analysis(
             ))
         ]
 
-        result: AnalysisResult = AnalysisResult.model_validate(await structured_llm.ainvoke(messages))
+        with LLM_SECONDS.time(), start_span("llm.invoke", kind=SPAN_KIND_CLIENT, attributes={"project_name": project_name, "llm.requirements": len(reqs)}):
+            result: AnalysisResult = AnalysisResult.model_validate(await structured_llm.ainvoke(messages))
+        LLM_SUCCEEDED.inc()
+        if cassette is not None:
+            await cassette.record(fingerprint, project_name, reqs, result)
         return result
 
     except Exception as e:
-        print(
-            f"[{datetime.now()}] get_llm_analysis failed for {project_name}: {e}")
+        LLM_FAILED.inc()
+        logger.warning("get_llm_analysis failed for %s: %s", project_name, e,
+                       extra={"project_name": project_name})
         return None
 
 
-@app.post(
+@router.post(
     "/analyze",
     response_model=AnalyzeResponse,
     status_code=status.HTTP_200_OK,
+    response_class=ORJSONResponse,
+    responses=MSGPACK_RESPONSE_DOCS,
 )
 async def analyze_dependencies(
+    request: Request,
     file: Annotated[UploadFile, File(
         description="A requirements.txt file (text/plain).")],
     project_name: Annotated[str, Form(
         description="The name of the project")],
     user: Annotated[UserPublic, Depends(get_current_user)],
+    _in_flight: Annotated[None, Depends(track_analysis)],
     session: AsyncSession = Depends(get_session),
-) -> AnalyzeResponse:
+    idempotency_key: Annotated[Optional[str], Header(
+        min_length=1, max_length=100, description="A unique key per analysis, so that retries don't start it again")] = None,
+) -> Response:
     """
     Accepts a requirements.txt file upload and a project name, analyzes each license associated with the dependencies in the 'requirements.txt' file, and returns the analysis.
 
+    The analysis is returned as JSON, or as MessagePack if the "Accept" header asks for "application/msgpack".
+
+    If the request has an "Idempotency-Key" header, retries with the same key (and the same file and project name) get the first response back (with an "Idempotent-Replayed" header) instead of starting a new analysis. If the first request is still running, the retry waits for it.
+
     Throws a 400 if the uploaded file is empty.
 
     Throws a 401 if the user is unauthorized.
 
+    Throws a 409 (with a "Retry-After" header) if the first request with the same "Idempotency-Key" is still running after a while.
+
     Throws a 415 if the uploaded file has an unsupported MIME type.
 
     Throws a 422 if:
@@ -157,12 +308,57 @@ async def analyze_dependencies(
      - there is a Unicode decode error while processing the file.
      - the requirements.txt file is invalid and cannot be parsed.
      - no valid requirements are found in the file.
+     - the "Idempotency-Key" was already used for a different request.
+
+    Throws a 429 (with a "Retry-After" header) if the user started too many analyses recently, or has too many of them running right now.
 
     Keyword arguments:
 
     file -- an non-empty 'requirements.txt'
 
     project_name -- the name of your project
+
+    idempotency_key -- (optional) a unique key per analysis
+    """
+    async def _analyze() -> AnalyzeResponse:
+        # NOTE: the quota is only enforced here, so that retries that get a stored response
+        # don't count towards it
+        async with enforce_analysis_quota(user.id):
+            return await run_analysis(session, user, file, project_name)
+
+    if not idempotency_key:
+        result = await _analyze()
+        with SERIALIZATION_SECONDS.time():
+            return negotiated_response(request, result)
+
+    settings = get_settings()
+
+    def _keep_for(response: AnalyzeResponse) -> float:
+        # a retry of a FAILED analysis should get another go at the LLM sooner rather than later
+        return settings.idempotency_failed_ttl if response.status == Status.FAILED else settings.idempotency_ttl
+
+    fingerprint = fingerprint_request(project_name, await file.read())
+    # always make sure to reset the file pointer after reading!
+    await file.seek(0)
+    try:
+        result, replayed = await run_idempotently(
+            f"analyze:{user.id}:{idempotency_key}", fingerprint, AnalyzeResponse, _analyze, keep_for=_keep_for)
+    except IdempotencyKeyReused as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_CONTENT, detail=e.detail)
+    except IdempotencyKeyInUse as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=e.detail,
+            headers={"Retry-After": str(settings.idempotency_retry_after)}
+        )
+    with SERIALIZATION_SECONDS.time():
+        return negotiated_response(request, result, headers={"Idempotent-Replayed": "true"} if replayed else None)
+
+
+async def run_analysis(session: AsyncSession, user: UserPublic, file: UploadFile, project_name: str) -> AnalyzeResponse:
+    """
+    Validates the requirements file, asks the LLM to analyze it, and logs an event for every step along the way.
     """
     if len(project_name) < 1 or len(project_name) > 100:
         raise HTTPException(
@@ -171,7 +367,8 @@ async def analyze_dependencies(
         )
 
     # log event (project creation) in the database
-    requirements_content: str = (await file.read()).decode("utf-8")
+    with UPLOAD_READ_SECONDS.time():
+        requirements_content: str = (await file.read()).decode("utf-8")
     await add_event(
         session,
         Event(
@@ -185,7 +382,8 @@ async def analyze_dependencies(
     # always make sure to reset the file pointer after reading!
     await file.seek(0)
     try:
-        await validate_requirements_file(file)  # validate the file
+        with VALIDATION_SECONDS.time():
+            await validate_requirements_file(file)  # validate the file
     except HTTPException as e:
         # if the validation failed for any reason, log event (validation failed) in the database
         await add_event(
@@ -201,7 +399,8 @@ async def analyze_dependencies(
 
     # always make sure to reset the file pointer after reading!
     await file.seek(0)
-    _reqs = await parse_requirements_file(file)  # parse requirements from file
+    with PARSING_SECONDS.time():
+        _reqs = await parse_requirements_file(file)  # parse requirements from file
     # log event (validation success) in the database
     await add_event(
         session,
@@ -244,3 +443,14 @@ async def analyze_dependencies(
         status=Status.COMPLETED if llm_result else Status.FAILED,
         result=llm_result
     )
+
+
+def __getattr__(name: str) -> Any:
+    """
+    Builds the module-level `app` (the one that "fastapi run" and the test suite pick up) the first time that it's asked for, so that importing this module doesn't need a configured environment. For anything else, use `create_app`.
+    """
+    if name == "app":
+        global app  # we gotta set the module-level app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,121 @@
+import re
+import asyncio
+import logging
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Literal
+from urllib.parse import parse_qs
+from uuid import uuid4
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from core.profiling import RequestProfiler, stop_profiling, try_start_profiling
+from core.tracing import SPAN_KIND_SERVER, STATUS_ERROR, format_traceparent, parse_traceparent, start_span
+from .security import get_admin_from_credentials
+
+logger = logging.getLogger(__name__)
+
+
+class TracingMiddleware:
+    """
+    Runs every HTTP request in a server span, which is the parent of every span that the request creates (e.g. for `get_current_user`, the event writes and the LLM call).
+
+    Callers that send a "traceparent" header get their trace continued, and every response gets a "traceparent" header that points at its span, so that a slow request can be looked up in the traces.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        parent = parse_traceparent(headers.get(b"traceparent", b"").decode("latin-1"))
+        with start_span(
+            scope["method"],
+            kind=SPAN_KIND_SERVER,
+            attributes={"http.request.method": scope["method"], "url.path": scope["path"]},
+            parent=parent
+        ) as span:
+            if span is None:
+                await self.app(scope, receive, send)
+                return
+
+            async def send_with_trace(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.response.status_code", message["status"])
+                    if message["status"] >= 500:
+                        span.status_code = STATUS_ERROR
+                    message["headers"] = [*message.get("headers", []),
+                                          (b"traceparent", format_traceparent(span.context).encode())]
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_trace)
+            finally:
+                # the route is only known once the router has matched it
+                route = scope.get("route")
+                if route is not None:
+                    span.name = f"{scope['method']} {route.path}"
+                    span.set_attribute("http.route", route.path)
+
+
+def wants_profile(scope: Scope) -> bool:
+    """
+    Checks whether the request asks to be profiled (with an "X-Profile: 1" header or a "profile=1" query parameter).
+    """
+    for key, value in scope["headers"]:
+        if key == b"x-profile":
+            return value.strip() in (b"1", b"true")
+    query = scope.get("query_string", b"")
+    return b"profile" in query and parse_qs(query.decode("latin-1")).get("profile", [""])[-1] in ("1", "true")
+
+
+class ProfilingMiddleware:
+    """
+    Profiles the requests of admins that ask for it (see `wants_profile`), from the first middleware to the last byte of the response, and writes the profile to `directory`. The name of the profile is sent back in an "X-Profile-Artifact" header.
+
+    NOTE: this is only installed when PROFILING_ENABLED is set, so it costs nothing otherwise.
+    """
+
+    def __init__(self, app: ASGIApp, directory: Path, fmt: Literal["speedscope", "pstats"] = "speedscope") -> None:
+        self.app = app
+        self.directory = Path(directory)
+        self.format = fmt
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        admin = await get_admin_from_credentials(
+            headers.get(b"authorization", b"").decode("latin-1"),
+            headers.get(b"x-api-key", b"").decode("latin-1") or None
+        )
+        # profiling is too expensive to hand out to everyone, and two profilers can't run at once
+        if admin is None or not try_start_profiling():
+            await self.app(scope, receive, send)
+            return
+
+        profiler = RequestProfiler(self.format)
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", scope["path"]).strip("_") or "root"
+        name = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{scope['method']}-{slug}-{uuid4().hex[:8]}{profiler.suffix}"
+
+        async def send_with_artifact(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (b"x-profile-artifact", name.encode())]
+            await send(message)
+
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_artifact)
+        finally:
+            profiler.stop()
+            stop_profiling()
+            try:
+                await asyncio.to_thread(profiler.write, self.directory / name)
+                logger.info("Wrote the profile of %s %s to %s.", scope["method"], scope["path"], name,
+                            extra={"admin": admin.username})
+            except Exception as e:
+                logger.warning("Couldn't write the profile of %s %s: %s", scope["method"], scope["path"], e)
@@ -0,0 +1,171 @@
+import gzip
+from hashlib import sha256
+from typing import Any, Mapping, Optional
+import msgpack
+from fastapi import Request, Response, status
+# NOTE: the routes use it as their `response_class` (for the docs, and for whatever they don't
+# serialize themselves)
+from fastapi.responses import ORJSONResponse  # noqa: F401
+from pydantic import BaseModel
+from core.config import get_settings
+
+# brotli compresses JSON noticeably better than gzip, but it's a compiled extension, so if it
+# isn't installed we just fall back to gzip
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+# older clients still send the unofficial media types
+MSGPACK_MEDIA_TYPES = {MSGPACK_MEDIA_TYPE,
+                       "application/x-msgpack", "application/vnd.msgpack"}
+
+# for the OpenAPI docs of routes that can answer with MessagePack
+MSGPACK_RESPONSE_DOCS: dict[int | str, dict[str, Any]] = {
+    200: {"content": {MSGPACK_MEDIA_TYPE: {}}}
+}
+
+
+class MsgPackResponse(Response):
+    """
+    A MessagePack response, for machine clients that would rather not parse (or download) JSON.
+    """
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def render(self, content: Any) -> bytes:
+        return msgpack.packb(content)
+
+
+def dump_json(content: BaseModel | list[BaseModel]) -> bytes:
+    """
+    Serializes the response model(s) to JSON with pydantic's own serializer, which (unlike a `model_dump()` fed to orjson) doesn't build a dict of the whole response first.
+    """
+    if isinstance(content, list):
+        return ("[" + ",".join(item.model_dump_json() for item in content) + "]").encode()
+    return content.model_dump_json().encode()
+
+
+def _parse_accept(accept: str) -> dict[str, float]:
+    """
+    Returns the quality value of every media type in an "Accept" header.
+    """
+    qualities: dict[str, float] = {}
+    for part in accept.split(","):
+        media_type, *params = part.split(";")
+        media_type = media_type.strip().lower()
+        if not media_type:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[media_type] = max(q, qualities.get(media_type, 0.0))
+    return qualities
+
+
+def prefers_msgpack(accept: Optional[str]) -> bool:
+    """
+    Checks whether the client would rather have MessagePack than JSON. Only clients that ask for MessagePack by name (and don't rank JSON higher) get it; everyone else gets JSON.
+    """
+    if not accept:
+        return False
+    qualities = _parse_accept(accept)
+    msgpack_q = max((qualities.get(t, 0.0) for t in MSGPACK_MEDIA_TYPES), default=0.0)
+    if msgpack_q <= 0:
+        return False
+    json_q = qualities.get("application/json", 0.0)
+    wildcard_q = max(qualities.get("application/*", 0.0), qualities.get("*/*", 0.0))
+    return msgpack_q > json_q and msgpack_q >= wildcard_q
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Picks the best content coding ("br" or "gzip") that the client accepts, based on its "Accept-Encoding" header. Returns `None` if the response should be sent uncompressed.
+    """
+    if not accept_encoding:
+        return None
+    qualities = _parse_accept(accept_encoding)
+    best, best_q = None, 0.0
+    # brotli comes first, so it wins ties
+    for encoding in ("br", "gzip") if brotli else ("gzip",):
+        q = qualities.get(encoding, qualities.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    settings = get_settings()
+    if encoding == "br":
+        return brotli.compress(body, quality=settings.compression_brotli_quality)
+    # a fixed mtime keeps the output (and so the ETag) the same for the same body
+    return gzip.compress(body, compresslevel=settings.compression_gzip_level, mtime=0)
+
+
+def make_etag(body: bytes, media_type: str, encoding: Optional[str] = None) -> str:
+    """
+    Returns a strong ETag for a representation. Since strong ETags promise byte-for-byte equality, the media type and content coding are part of the tag.
+    """
+    digest = sha256(media_type.encode() + b"\n" + body).hexdigest()[:32]
+    return f'"{digest}-{encoding}"' if encoding else f'"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Checks an "If-None-Match" header against our ETag (using the weak comparison that RFC 9110 asks for, i.e. a "W/" prefix is ignored).
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def negotiated_response(
+    request: Request,
+    content: BaseModel | list[BaseModel],
+    status_code: int = 200,
+    headers: Optional[Mapping[str, str]] = None,
+    etag: bool = False
+) -> Response:
+    """
+    Serializes `content` as MessagePack or JSON, depending on what the client accepts, and compresses it with brotli or gzip if it's big enough (and the client accepts that too).
+
+    If `etag` is set, the response gets a strong ETag, and a 304 (without a body) is returned when it matches the request's "If-None-Match" header. Only use it for results that can be retrieved again (i.e. GETs).
+
+    NOTE: returning a response directly skips FastAPI's own (slower) serialization, so `content` must already be the response model.
+    """
+    if prefers_msgpack(request.headers.get("accept")):
+        # NOTE: msgpack needs plain Python objects, so only MessagePack pays for the dicts
+        if isinstance(content, list):
+            data = [item.model_dump(mode="json") for item in content]
+        else:
+            data = content.model_dump(mode="json")
+        response = MsgPackResponse(data, status_code=status_code, headers=headers)
+    else:
+        response = Response(dump_json(content), status_code=status_code,
+                            headers=headers, media_type="application/json")
+    # caches must not hand a MessagePack body to a JSON client (or vice versa), nor a compressed
+    # body to a client that can't decompress it
+    response.headers["Vary"] = "Accept, Accept-Encoding"
+
+    encoding = None
+    if len(response.body) >= get_settings().compression_min_size:
+        encoding = choose_encoding(request.headers.get("accept-encoding"))
+
+    if etag:
+        tag = make_etag(response.body, response.media_type, encoding)
+        if etag_matches(request.headers.get("if-none-match"), tag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": tag, "Vary": response.headers["Vary"]})
+        response.headers["ETag"] = tag
+
+    if encoding:
+        response.body = compress(response.body, encoding)
+        response.headers["Content-Encoding"] = encoding
+        response.headers["Content-Length"] = str(len(response.body))
+    return response
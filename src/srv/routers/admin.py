@@ -0,0 +1,103 @@
+import os
+import asyncio
+import tracemalloc
+from typing import Literal
+from fastapi import APIRouter, Depends, Query
+from core import memory
+from ..schemas import GCStats, MemoryReport, MemoryTracingStart, UserPublic
+from ..security import get_current_admin
+
+router = APIRouter(
+    prefix="/admin/memory",
+    tags=["admin"],
+)
+
+
+async def get_memory_report(limit: int = 20, group_by: Literal["lineno", "filename", "traceback"] = "lineno") -> MemoryReport:
+    current, peak = memory.get_rss()
+    # NOTE: snapshots of a big heap take a while, so they're taken off the event loop
+    top, diff = await asyncio.to_thread(memory.get_allocation_sites, limit, group_by)
+    traced, traced_peak = tracemalloc.get_traced_memory()
+    return MemoryReport(
+        pid=os.getpid(),
+        rss_bytes=current,
+        peak_rss_bytes=peak,
+        gc=GCStats(**memory.get_gc_stats()),
+        tracing=tracemalloc.is_tracing(),
+        traced_bytes=traced,
+        traced_peak_bytes=traced_peak,
+        top=top,
+        diff=diff
+    )
+
+
+@router.get("", response_model=MemoryReport)
+async def read_memory(
+    admin: UserPublic = Depends(get_current_admin),
+    limit: int = Query(default=20, ge=1, le=500),
+    group_by: Literal["lineno", "filename", "traceback"] = "lineno"
+) -> MemoryReport:
+    """
+    Returns the memory usage of the worker that answered (admins only): its RSS, GC stats and, while tracing is on, the biggest allocation sites and the ones that grew the most since the baseline. Every worker has its own memory, so the "pid" tells you which one answered.
+
+    Throws a 401 if the user is unauthorized.
+
+    Throws a 403 if the user isn't an admin.
+
+    Keyword arguments:
+
+    limit -- how many allocation sites to return
+
+    group_by -- group the allocations by "lineno", "filename" or "traceback"
+    """
+    return await get_memory_report(limit, group_by)
+
+
+@router.post("/tracing", response_model=MemoryReport)
+async def start_memory_tracing(
+    body: MemoryTracingStart = MemoryTracingStart(),
+    admin: UserPublic = Depends(get_current_admin)
+) -> MemoryReport:
+    """
+    Starts tracing allocations on the worker that answered (admins only), and takes the baseline snapshot that later reports are compared to. Tracing slows down every allocation, so stop it once you're done.
+
+    Throws a 401 if the user is unauthorized.
+
+    Throws a 403 if the user isn't an admin.
+
+    Keyword arguments:
+
+    body -- how many stack frames to keep per allocation
+    """
+    await asyncio.to_thread(memory.start_tracing, body.frames)
+    return await get_memory_report()
+
+
+@router.post("/baseline", response_model=MemoryReport)
+async def reset_memory_baseline(
+    admin: UserPublic = Depends(get_current_admin)
+) -> MemoryReport:
+    """
+    Takes a new baseline snapshot on the worker that answered (admins only), so that the next reports only show what changed from now on.
+
+    Throws a 401 if the user is unauthorized.
+
+    Throws a 403 if the user isn't an admin.
+    """
+    await asyncio.to_thread(memory.reset_baseline)
+    return await get_memory_report()
+
+
+@router.delete("/tracing", response_model=MemoryReport)
+async def stop_memory_tracing(
+    admin: UserPublic = Depends(get_current_admin)
+) -> MemoryReport:
+    """
+    Stops tracing allocations on the worker that answered (admins only), and frees the memory that the traces took up.
+
+    Throws a 401 if the user is unauthorized.
+
+    Throws a 403 if the user isn't an admin.
+    """
+    memory.stop_tracing()
+    return await get_memory_report()
@@ -0,0 +1,68 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from sqlmodel.ext.asyncio.session import AsyncSession
+from db.session import get_read_session
+from services.events import get_latest_result, list_events
+from ..responses import MSGPACK_RESPONSE_DOCS, ORJSONResponse, negotiated_response
+from ..schemas import AnalysisResult, Event, UserPublic
+from ..security import get_current_user
+
+router = APIRouter(
+    prefix="/projects",
+    tags=["events"],
+)
+
+
+@router.get(
+    "/{project_name}/events",
+    response_model=list[Event],
+    response_class=ORJSONResponse,
+    responses=MSGPACK_RESPONSE_DOCS
+)
+async def read_project_events(
+    project_name: str,
+    request: Request,
+    user: UserPublic = Depends(get_current_user),
+    session: AsyncSession = Depends(get_read_session)
+) -> Response:
+    """
+    Returns every event that was logged for one of the current authenticated user's projects (e.g. when the analysis started, and its result). The events are returned as JSON, or as MessagePack if the "Accept" header asks for "application/msgpack".
+
+    Throws a 401 if the user is unauthorized.
+
+    Keyword arguments:
+
+    project_name -- the name of the project
+    """
+    events = await list_events(session, user.id, project_name)
+    return negotiated_response(request, events, etag=True)
+
+
+@router.get(
+    "/{project_name}/result",
+    response_model=AnalysisResult,
+    response_class=ORJSONResponse,
+    responses={**MSGPACK_RESPONSE_DOCS, 304: {"description": "The result hasn't changed"}}
+)
+async def read_project_result(
+    project_name: str,
+    request: Request,
+    user: UserPublic = Depends(get_current_user),
+    session: AsyncSession = Depends(get_read_session)
+) -> Response:
+    """
+    Returns the result of the latest completed analysis of one of the current authenticated user's projects. The response has a strong ETag, so clients that poll for results should send it back in an "If-None-Match" header; they'll get an empty 304 until the result changes.
+
+    Throws a 401 if the user is unauthorized.
+    Throws a 404 if the project was never analyzed successfully.
+
+    Keyword arguments:
+
+    project_name -- the name of the project
+    """
+    result = await get_latest_result(session, user.id, project_name)
+    if result is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No completed analysis was found for project \"{project_name}\"."
+        )
+    return negotiated_response(request, result, etag=True)
@@ -0,0 +1,121 @@
+import os
+import json
+import asyncio
+import logging
+from pathlib import Path
+from time import time
+from typing import Optional
+from fastapi import APIRouter, Request, Response
+from core.config import Settings
+from core.memory import get_rss
+from core.metrics import CONTENT_TYPE_LATEST, Gauge, collect_families, generate_latest
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(tags=["metrics"])
+
+# every sample says which worker it came from
+WORKER_LABELS = {"pid": str(os.getpid())}
+
+
+def count_open_fds() -> int:
+    # NOTE: only Linux (/proc) and macOS (/dev/fd) list a process's file descriptors
+    for fd_dir in ("/proc/self/fd", "/dev/fd"):
+        try:
+            return len(os.listdir(fd_dir))
+        except OSError:
+            continue
+    return 0
+
+
+# the usual process metrics (named like Prometheus' own clients name them), computed on every scrape
+PROCESS_RESIDENT_MEMORY = Gauge(
+    "process_resident_memory_bytes", "Resident memory size of this worker (in bytes).")
+PROCESS_RESIDENT_MEMORY.set_function(lambda: get_rss()[0])
+PROCESS_OPEN_FDS = Gauge(
+    "process_open_fds", "File descriptors (including sockets and temp files) that this worker has open.")
+PROCESS_OPEN_FDS.set_function(count_open_fds)
+
+
+def _snapshot_path(directory: Path, pid: str) -> Path:
+    return directory / f"worker-{pid}.json"
+
+
+def write_snapshot(directory: Path) -> None:
+    """
+    Writes this worker's metrics to `directory`, for the other workers to report.
+    """
+    path = _snapshot_path(directory, WORKER_LABELS["pid"])
+    tmp_path = path.with_suffix(".tmp")
+    # NOTE: the other workers must never read a half-written snapshot, hence the rename
+    tmp_path.write_text(json.dumps(collect_families(const_labels=WORKER_LABELS)), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def read_snapshots(directory: Path, max_age: float) -> list[list[dict]]:
+    """
+    Reads the metrics of the other workers (skipping the ones that haven't written any in `max_age` seconds, i.e. that are gone).
+    """
+    own_path = _snapshot_path(directory, WORKER_LABELS["pid"])
+    snapshots = []
+    for path in directory.glob("worker-*.json"):
+        try:
+            if path == own_path or path.stat().st_mtime < time() - max_age:
+                continue
+            snapshots.append(json.loads(path.read_text(encoding="utf-8")))
+        except (OSError, ValueError):
+            continue    # the worker is probably just shutting down
+    return snapshots
+
+
+async def _share_forever(directory: Path, interval: float) -> None:
+    while True:
+        try:
+            await asyncio.to_thread(write_snapshot, directory)
+        except OSError as e:
+            logger.warning("Couldn't share this worker's metrics in %s: %s", directory, e)
+        await asyncio.sleep(interval)
+
+
+# the task that shares this worker's metrics (if `metrics_dir` is set)
+sharing_task: Optional[asyncio.Task] = None
+
+
+def start_metrics_sharing(settings: Settings) -> None:
+    """
+    Starts writing this worker's metrics to `metrics_dir` every `metrics_share_interval` seconds, if it's set.
+    """
+    global sharing_task  # we gotta modify the pre-existing task
+    if sharing_task or not settings.metrics_enabled or not settings.metrics_dir:
+        return
+    settings.metrics_dir.mkdir(parents=True, exist_ok=True)
+    sharing_task = asyncio.create_task(
+        _share_forever(settings.metrics_dir, settings.metrics_share_interval), name="metrics-sharing")
+
+
+async def stop_metrics_sharing(settings: Settings) -> None:
+    global sharing_task  # we gotta modify the pre-existing task
+    if sharing_task:
+        sharing_task.cancel()
+        try:
+            await sharing_task
+        except asyncio.CancelledError:
+            pass
+        sharing_task = None
+        # a worker that's gone shouldn't be reported anymore
+        _snapshot_path(settings.metrics_dir, WORKER_LABELS["pid"]).unlink(missing_ok=True)
+
+
+@router.get("/metrics", include_in_schema=False)
+async def read_metrics(request: Request) -> Response:
+    """
+    Returns the metrics (e.g. how long each stage of an analysis takes) in the Prometheus text format. Every sample has a "pid" label that says which worker it came from.
+
+    NOTE: the workers share a port, so a scrape only reaches one of them. With `metrics_dir` set (which "cli/serve.py" does when it starts several workers), the other workers' metrics are included too, as of their last snapshot (at most `metrics_share_interval` seconds ago); otherwise, only this worker's metrics are returned.
+    """
+    settings: Settings = request.app.state.settings
+    others = []
+    if settings.metrics_dir:
+        others = await asyncio.to_thread(
+            read_snapshots, settings.metrics_dir, 3 * settings.metrics_share_interval)
+    return Response(generate_latest(const_labels=WORKER_LABELS, others=others), media_type=CONTENT_TYPE_LATEST)
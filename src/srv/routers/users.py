@@ -1,10 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlmodel.ext.asyncio.session import AsyncSession
-from db.session import get_session
-from services.users import get_user, create_user, authenticate_user
-from ..schemas import Token, UserPublic, UserCreate
-from ..security import create_access_token, get_current_user
+from core.config import get_settings
+from db.session import get_session, get_read_session
+from services.users import create_user, create_users, authenticate_user
+from services.api_keys import create_api_key, list_api_keys, revoke_api_key
+from ..schemas import ApiKeyCreate, ApiKeyCreated, ApiKeyPublic, BulkUserCreate, BulkUserCreateResult, Token, UserPublic, UserCreate
+from ..security import create_access_token, get_current_admin, get_current_user
+
+settings = get_settings()
 
 router = APIRouter(
     prefix="/users",
@@ -45,20 +49,56 @@ async def register_user(
             detail="Password must be at least 4 characters."
         )
 
-    db_user = await get_user(session, username=user_in.username)
-    if db_user:
+    # `create_user` already checks whether the username is taken, so we don't check it twice
+    try:
+        user = await create_user(session, user=user_in)
+    except ValueError as e:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST, detail="A user with this username is already registered.")
-    user = await create_user(session, user=user_in)
+            status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     return user
 
 
+@router.post(
+    "/bulk",
+    response_model=BulkUserCreateResult,
+    status_code=status.HTTP_201_CREATED
+)
+async def register_users(
+    body: BulkUserCreate,
+    admin: UserPublic = Depends(get_current_admin),
+    session: AsyncSession = Depends(get_session)
+) -> BulkUserCreateResult:
+    """
+    Creates many users at once (admins only). Usernames that are already registered are skipped instead of failing the whole request.
+
+    Throws a 401 if the user is unauthorized.
+
+    Throws a 403 if the user isn't an admin.
+
+    Throws a 413 if there are more users than the server allows in one request.
+
+    Throws a 422 if any of the users is invalid (see "POST /users/").
+
+    Keyword arguments:
+
+    body -- a list of `UserCreate` objects
+    """
+    if len(body.users) > settings.bulk_provision_max_users:
+        raise HTTPException(
+            status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+            detail=f"You can only create up to {settings.bulk_provision_max_users} users at once."
+        )
+    created, skipped = await create_users(session, body.users)
+    return BulkUserCreateResult(created=created, skipped=skipped)
+
+
 @router.post(
     "/token",
     response_model=Token
 )
 async def get_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
+    # NOTE: logging in can upgrade the user's password hash (i.e. write), so it has to use the primary
     session: AsyncSession = Depends(get_session)
 ):
     """
@@ -97,3 +137,71 @@ async def read_users_me(
     current_user -- a `UserPublic` object with the current user's credentials
     """
     return current_user
+
+
+@router.post(
+    "/me/api-keys",
+    response_model=ApiKeyCreated,
+    status_code=status.HTTP_201_CREATED
+)
+async def add_api_key(
+    body: ApiKeyCreate,
+    current_user: UserPublic = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session)
+) -> ApiKeyCreated:
+    """
+    Creates a new API key for the current authenticated user. The key can be sent in the "X-API-Key" header (or as the bearer token) instead of a JWT.
+
+    NOTE: the key is only returned ONCE, so store it somewhere safe.
+
+    Throws a 401 if the user is unauthorized.
+
+    Keyword arguments:
+
+    body -- an `ApiKeyCreate` object with a name for the key
+    """
+    return await create_api_key(session, current_user, body.name)
+
+
+@router.get(
+    "/me/api-keys",
+    response_model=list[ApiKeyPublic]
+)
+async def read_api_keys(
+    current_user: UserPublic = Depends(get_current_user),
+    session: AsyncSession = Depends(get_read_session)
+) -> list[ApiKeyPublic]:
+    """
+    Returns the current authenticated user's API keys (without the keys themselves).
+
+    Throws a 401 if the user is unauthorized.
+    """
+    return await list_api_keys(session, current_user)
+
+
+@router.delete(
+    "/me/api-keys/{key_id}",
+    status_code=status.HTTP_204_NO_CONTENT
+)
+async def delete_api_key(
+    key_id: str,
+    current_user: UserPublic = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session)
+) -> Response:
+    """
+    Revokes one of the current authenticated user's API keys. The key stops working within `api_key_cache_ttl` seconds (5 by default), since the other workers might still have it cached.
+
+    Throws a 401 if the user is unauthorized.
+
+    Throws a 404 if the user doesn't have an API key with that ID.
+
+    Keyword arguments:
+
+    key_id -- the ID of the API key
+    """
+    if not await revoke_api_key(session, current_user, key_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="API key not found."
+        )
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
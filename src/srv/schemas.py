@@ -46,6 +46,129 @@ class UserPublic(UserBase):
         from_attributes = True
 
 
+# for API keys:
+class ApiKeyCreate(BaseModel):
+    name: str = Field(min_length=1, max_length=100)
+
+
+class ApiKey(SQLModel, table=True):   # to be used when the API key is stored in the DB
+    id: str = Field(default_factory=lambda: str(uuid4()),
+                     description="API key ID (str hex)", primary_key=True)
+    user_id: str = Field(
+        description="ID of the user who owns the API key", foreign_key="user.id", index=True)
+    name: str = Field(min_length=1, max_length=100)
+    # the public part of the key, so that we can find it without scanning the table
+    prefix: str = Field(max_length=16, unique=True, index=True)
+    # NOTE: the key itself is NEVER stored, only an HMAC of it
+    hashed_key: str = Field(max_length=64)
+    created_at: datetime = Field(
+        sa_column=Column(DateTime(timezone=True), nullable=False))
+
+
+# to be returned to the client (NOTE: should NEVER include the key or its hash)
+class ApiKeyPublic(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: str
+    name: str
+    prefix: str
+    created_at: datetime
+
+
+# only returned once, right after the key was created
+class ApiKeyCreated(ApiKeyPublic):
+    key: str
+
+
+# for rate limiting (only used by the "database" backend):
+class RateLimitBucket(SQLModel, table=True):
+    """
+    The token bucket of a single rate limit key (e.g. a user's analyses).
+    """
+    key: str = Field(primary_key=True, max_length=100)
+    tokens: float
+    # UNIX timestamp of the last time the bucket was refilled
+    updated_at: float
+
+
+class ConcurrencySlot(SQLModel, table=True):
+    """
+    A slot held by a running job (e.g. an analysis). Slots expire, so a worker that died while holding one can't block its user forever.
+    """
+    id: str = Field(default_factory=lambda: str(uuid4()), primary_key=True)
+    key: str = Field(max_length=100, index=True)
+    # UNIX timestamp
+    expires_at: float
+
+
+# for idempotent requests (only used by the "database" backend):
+class IdempotencyKey(SQLModel, table=True):
+    """
+    The response to the first request that was sent with a given idempotency key. While that request is still running, `response` is `None`.
+    """
+    key: str = Field(primary_key=True, max_length=200)
+    # hash of the request, so that a key can't be reused for a different request
+    fingerprint: str = Field(max_length=64)
+    response: Optional[str] = None
+    # UNIX timestamp
+    expires_at: float
+
+
+# for bulk provisioning:
+class BulkUserCreate(BaseModel):
+    users: list[UserCreate]
+
+
+class BulkUserCreateResult(BaseModel):
+    created: list[UserPublic]
+    # usernames that were already registered (or repeated in the request)
+    skipped: list[str]
+
+
+# for memory profiling (admins only):
+class MemoryTracingStart(BaseModel):
+    # how many frames of the stack to keep per allocation (more frames cost more memory)
+    frames: int = Field(default=1, ge=1, le=50)
+
+
+class AllocationSite(BaseModel):
+    """
+    Where memory was allocated (i.e. "file:line", or the whole stack if more than one frame is traced), and how much of it is still alive.
+    """
+    location: str
+    size_bytes: int
+    count: int
+    # compared to the baseline snapshot (only in diffs)
+    size_diff_bytes: Optional[int] = None
+    count_diff: Optional[int] = None
+
+
+class GCStats(BaseModel):
+    # objects that are waiting to be collected, per generation
+    counts: list[int]
+    collections: list[int]
+    collected: list[int]
+    uncollectable: list[int]
+    # objects that the GC found but couldn't free
+    garbage: int
+
+
+class MemoryReport(BaseModel):
+    """
+    The memory usage of the worker that answered (every worker has its own).
+    """
+    pid: int
+    rss_bytes: int
+    peak_rss_bytes: int
+    gc: GCStats
+    tracing: bool
+    traced_bytes: int = 0
+    traced_peak_bytes: int = 0
+    # the biggest allocation sites right now, and the ones that grew the most since the baseline
+    top: list[AllocationSite] = []
+    diff: list[AllocationSite] = []
+
+
 # for analysis results:
 class Status(str, Enum):
     IN_PROGRESS = "in_progress"
@@ -1,25 +1,84 @@
+import os
 import jwt
+import logging
+import hmac
+import secrets
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Annotated, Optional
+from functools import lru_cache
+from hashlib import sha256
+from multiprocessing import get_context
+from time import perf_counter, time
+from typing import Annotated, Any, Callable, Optional, TypeVar
 from fastapi import Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer
+from fastapi.security import APIKeyHeader, OAuth2PasswordBearer
 from jwt.exceptions import InvalidTokenError
 from passlib.context import CryptContext
 from pydantic import SecretStr
 from sqlmodel.ext.asyncio.session import AsyncSession
+from core.cache import TTLCache
 from core.config import get_settings
-from db.session import get_session
+from core.metrics import Gauge, Histogram
+from core.tracing import traced
+from db.session import get_read_session, get_sessionmaker
 from srv.schemas import TokenData, UserPublic
 
+logger = logging.getLogger(__name__)
+
 
 # import the JWT config variables
 settings = get_settings()
 
+# every scheme that we can verify (new hashes always use `settings.password_hash_scheme`)
+PASSWORD_HASH_SCHEMES = ("bcrypt", "pbkdf2_sha256", "sha256_crypt", "sha512_crypt")
+
+
+def build_pwd_context(scheme: str, rounds: Optional[int] = None) -> CryptContext:
+    """
+    Builds a password hashing context that hashes with `scheme` (at the given cost) and still verifies hashes made with any of the other schemes. Hashes made with another scheme or cost are flagged by `needs_update`.
+    """
+    if scheme not in PASSWORD_HASH_SCHEMES:
+        raise ValueError(f"Unsupported password hashing scheme: {scheme}")
+    schemes = [scheme] + [s for s in PASSWORD_HASH_SCHEMES if s != scheme]
+    options = {f"{scheme}__rounds": rounds} if rounds else {}
+    return CryptContext(schemes=schemes, deprecated="auto", **options)
+
+
 # setup password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = build_pwd_context(
+    settings.password_hash_scheme, settings.password_hash_rounds)
+
+# verified JWT claims, keyed by the SHA-256 digest of the token (every entry expires with its token)
+token_cache: TTLCache[bytes, dict[str, Any]] = TTLCache(
+    maxsize=settings.jwt_decode_cache_size, ttl=float("inf"))
 
 # setup OAuth2 scheme; points to the login route
-oauth2 = OAuth2PasswordBearer(tokenUrl="/users/token")
+# NOTE: `auto_error` is off because an API key can stand in for the bearer token
+oauth2 = OAuth2PasswordBearer(tokenUrl="/users/token", auto_error=False)
+# API keys can be sent in this header (or as the bearer token)
+api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
+
+# every API key looks like "lg_<prefix>_<secret>"
+API_KEY_SCHEME = "lg"
+
+
+# bcrypt is slow on purpose, so it runs in its own thread pool (bcrypt releases the GIL while
+# hashing) instead of blocking the event loop
+hash_pool: Optional[ThreadPoolExecutor] = None
+
+HASH_IN_FLIGHT = Gauge(
+    "password_hash_in_flight", "Password hashes/verifications that were submitted but haven't finished yet.")
+HASH_QUEUE_DEPTH = Gauge(
+    "password_hash_queue_depth", "Password hashes/verifications that are waiting for a free thread.")
+HASH_QUEUE_DEPTH.set_function(lambda: max(
+    0, HASH_IN_FLIGHT.get() - settings.password_hash_workers))
+HASH_WAIT_SECONDS = Histogram(
+    "password_hash_wait_seconds", "Time that password hashes/verifications spent waiting for a free thread.")
+HASH_SECONDS = Histogram(
+    "password_hash_seconds", "Time that password hashes/verifications spent running.")
+
+T = TypeVar("T")
 
 
 def verify_pwd(plain: str, hashed: str) -> bool:
@@ -30,6 +89,144 @@ def get_hashed_pwd(plain: str) -> str:
     return pwd_context.hash(plain)
 
 
+def pwd_needs_rehash(hashed: str) -> bool:
+    """
+    Checks whether a hash was made with an outdated scheme or cost (i.e. it should be replaced the next time that we see the password).
+    """
+    try:
+        return pwd_context.needs_update(hashed)
+    except ValueError:
+        # not a hash that any of our schemes recognizes, so there's nothing to upgrade
+        return False
+
+
+def get_hash_pool() -> ThreadPoolExecutor:
+    global hash_pool    # we gotta modify the pre-existing thread pool
+    if hash_pool is None:
+        hash_pool = ThreadPoolExecutor(
+            max_workers=settings.password_hash_workers, thread_name_prefix="pwd-hash")
+    return hash_pool
+
+
+def shutdown_hash_pool() -> None:
+    global hash_pool    # we gotta modify the pre-existing thread pool
+    if hash_pool is not None:
+        hash_pool.shutdown(wait=True)
+        hash_pool = None
+
+
+async def run_in_hash_pool(fn: Callable[..., T], *args: Any) -> T:
+    """
+    Runs a password hashing function (e.g. `verify_pwd` or `get_hashed_pwd`) on the hashing thread pool, so that the event loop can keep serving other requests in the meantime.
+    """
+    submitted = perf_counter()
+    started = 0.0
+
+    def _job() -> T:
+        nonlocal started
+        started = perf_counter()
+        return fn(*args)
+
+    HASH_IN_FLIGHT.inc()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(get_hash_pool(), _job)
+    finally:
+        HASH_IN_FLIGHT.dec()
+        # NOTE: the timings are recorded here (on the event loop) because metrics aren't thread-safe
+        if started:
+            HASH_WAIT_SECONDS.observe(started - submitted)
+            HASH_SECONDS.observe(perf_counter() - started)
+
+
+def _hash_in_processes(passwords: list[str], workers: int) -> list[str]:
+    # NOTE: we "spawn" (instead of "fork") the workers because forking a process that has threads
+    # running (e.g. the DB driver's) isn't safe
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+        chunksize = max(1, len(passwords) // (workers * 4))
+        return list(pool.map(get_hashed_pwd, passwords, chunksize=chunksize))
+
+
+async def hash_passwords(passwords: list[str], workers: Optional[int] = None) -> list[str]:
+    """
+    Hashes many passwords in parallel on a pool of processes (1 per CPU by default). Meant for bulk jobs; for a single password, use `run_in_hash_pool` instead.
+    """
+    if not passwords:
+        return []
+    workers = min(workers or os.cpu_count() or 1, len(passwords))
+    return await asyncio.to_thread(_hash_in_processes, passwords, workers)
+
+
+@lru_cache
+def get_signing_key() -> str:
+    """
+    Resolves the JWT signing key once, instead of on every token that we create or decode.
+    """
+    # if the JWT_SECRET_KEY was imported from the .env file, then we need to unwrap the SecretStr
+    # (NOTE: `str()` would give us the masked "**********" placeholder, not the secret!)
+    # otherwise, it might be an automatically generated value (see core/config.py)
+    if type(settings.jwt_secret_key) is SecretStr:
+        return settings.jwt_secret_key.get_secret_value()
+    if type(settings.jwt_secret_key) is str:
+        return settings.jwt_secret_key
+    raise TypeError("Expected a string (or SecretStr) value")
+
+
+def decode_access_token(token: str) -> dict[str, Any]:
+    """
+    Verifies and decodes a JWT. Verified claims are cached (keyed by a digest of the token) until the token expires, since clients tend to reuse the same token for many requests.
+
+    Raises an `InvalidTokenError` if the token can't be verified.
+    """
+    digest = sha256(token.encode()).digest()
+    claims = token_cache.get(digest)
+    if claims is not None:
+        # NOTE: every caller gets its own copy, so that nobody can change the cached claims
+        return dict(claims)
+
+    claims = jwt.decode(token, get_signing_key(),
+                        algorithms=[settings.jwt_algorithm])
+    # tokens without an expiration date aren't cached, since we wouldn't know when to drop them
+    exp = claims.get("exp")
+    if isinstance(exp, (int, float)):
+        token_cache.set(digest, dict(claims), ttl=exp - time())
+    return claims
+
+
+@lru_cache
+def get_api_key_secret() -> bytes:
+    """
+    Resolves the secret that API keys are hashed with (falls back to the JWT signing key).
+    """
+    if settings.api_key_secret:
+        return settings.api_key_secret.get_secret_value().encode()
+    return get_signing_key().encode()
+
+
+def hash_api_key(key: str) -> str:
+    """
+    Hashes an API key with HMAC-SHA256. API keys are long and random (unlike passwords), so a fast keyed hash is enough; bcrypt would only slow down every request that uses one.
+    """
+    return hmac.new(get_api_key_secret(), key.encode(), sha256).hexdigest()
+
+
+def generate_api_key() -> tuple[str, str]:
+    """
+    Generates a new API key. Returns the key and its prefix (which is how the key is found in the database).
+    """
+    prefix = secrets.token_hex(6)
+    return f"{API_KEY_SCHEME}_{prefix}_{secrets.token_urlsafe(32)}", prefix
+
+
+def get_api_key_prefix(key: str) -> Optional[str]:
+    """
+    Returns the prefix of an API key, or `None` if the value doesn't look like one of our API keys.
+    """
+    parts = key.split("_", 2)
+    if len(parts) != 3 or parts[0] != API_KEY_SCHEME or not parts[1] or not parts[2]:
+        return None
+    return parts[1]
+
+
 def create_access_token(
     data: dict,
     expires_delta: Optional[timedelta] = None
@@ -43,32 +240,19 @@ def create_access_token(
         expire = datetime.now(
             timezone.utc) + timedelta(minutes=settings.jwt_access_token_expire_minutes)
     payload.update({"exp": expire})
-    try:
-        # if the JWT_SECRET_KEY was imported from the .env file, then we need to convert it to a string
-        # otherwise, it might be an automatically generated value (see core/config.py)
-        is_secret_str = type(settings.jwt_secret_key) is SecretStr
-        is_str = type(settings.jwt_secret_key) is str
-        if is_secret_str or is_str:
-            access_token = jwt.encode(
-                payload,
-                str(settings.jwt_secret_key) if is_secret_str else settings.jwt_secret_key,
-                algorithm=settings.jwt_algorithm
-            )
-            return access_token
-
-        else:
-            raise TypeError("Expected a string (or SecretStr) value")
-    except TypeError as e:
-        raise e
+    return jwt.encode(payload, get_signing_key(), algorithm=settings.jwt_algorithm)
 
 
 # dependency for retrieving the current authenticated user
+@traced("get_current_user")
 async def get_current_user(
-    token: Annotated[str, Depends(oauth2)],
-    session: Annotated[AsyncSession, Depends(get_session)]
+    token: Annotated[Optional[str], Depends(oauth2)],
+    session: Annotated[AsyncSession, Depends(get_read_session)],
+    api_key: Annotated[Optional[str], Depends(api_key_header)] = None
 ) -> UserPublic:
     # import services here to avoid a circular dependency
     from services import users as users_service
+    from services import api_keys as api_keys_service
 
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -76,33 +260,66 @@ async def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
 
+    # API keys can also be sent as the bearer token (which is handy for clients that only know
+    # about bearer tokens)
+    if not api_key and token and get_api_key_prefix(token):
+        api_key = token
+    if api_key:
+        user = await api_keys_service.get_user_by_api_key(session, api_key)
+        if user is None:
+            logger.info("Couldn't verify the API key.")
+            raise credentials_exception
+        return user
+
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
     try:
-        # if the JWT_SECRET_KEY was imported from the .env file, then we need to convert it to a string
-        # otherwise, it might be an automatically generated value (see core/config.py)
-        is_secret_str = type(settings.jwt_secret_key) is SecretStr
-        is_str = type(settings.jwt_secret_key) is str
-        if is_secret_str or is_str:
-            payload = jwt.decode(
-                token,
-                str(settings.jwt_secret_key) if is_secret_str else settings.jwt_secret_key,
-                algorithms=[settings.jwt_algorithm]
-            )
-            username: str = payload.get("sub")
-            if username is None:
-                print("Couldn't find the username provided in the JWT!")
-                raise credentials_exception
-            token_data = TokenData(username=username)
-        else:
-            raise TypeError("Expected a string (or SecretStr) value")
-    except TypeError as e:
-        raise e
+        payload = decode_access_token(token)
     except InvalidTokenError:
-        print("Couldn't verify the JWT.")
+        logger.info("Couldn't verify the JWT.")
+        raise credentials_exception
+    username: str = payload.get("sub")
+    if username is None:
+        logger.info("Couldn't find the username provided in the JWT!")
         raise credentials_exception
+    token_data = TokenData(username=username)
 
-    user = await users_service.get_user(session, username=token_data.username)
+    user = await users_service.get_authenticated_user(
+        session, username=token_data.username, token_expires_at=payload.get("exp"))
     if user is None:
-        print(
-            f"Couldn't find a user with the username '{token_data.username}'.")
+        logger.info("Couldn't find a user with the username '%s'.", token_data.username)
         raise credentials_exception
     return user
+
+
+# dependency for routes that only admins can use
+async def get_current_admin(
+    user: Annotated[UserPublic, Depends(get_current_user)]
+) -> UserPublic:
+    if user.username not in settings.admin_usernames:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only admins can do this."
+        )
+    return user
+
+
+async def get_admin_from_credentials(authorization: Optional[str], api_key: Optional[str] = None) -> Optional[UserPublic]:
+    """
+    Authenticates a request outside of FastAPI's dependencies (e.g. in a middleware, before the route runs). Returns the user if they're an admin, otherwise `None`.
+    """
+    scheme, _, token = (authorization or "").partition(" ")
+    token = token.strip() if scheme.lower() == "bearer" else ""
+    if not token and not api_key:
+        return None
+    try:
+        async with get_sessionmaker()() as session:
+            user = await get_current_user(token or None, session, api_key)
+    except HTTPException:
+        return None
+    return user if user.username in settings.admin_usernames else None
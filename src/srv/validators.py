@@ -1,11 +1,13 @@
 import requirements
 from typing import List
 from fastapi import HTTPException, UploadFile, status
+from core.tracing import traced
 
 # only .txt files are allowed to be uploaded
 ALLOWED_CONTENT_TYPES = ("text/plain",)
 
 
+@traced("validate_requirements")
 async def validate_requirements_file(file: UploadFile) -> bool:
     # check if the file has the correct MIME type
     # the content type might have a ";" in it (source: https://greenbytes.de/tech/webdav/rfc2616.html#rfc.section.14.17), so we're accounting for that
@@ -60,6 +62,7 @@ async def validate_requirements_file(file: UploadFile) -> bool:
     return True
 
 
+@traced("parse_requirements")
 async def parse_requirements_file(file: UploadFile) -> List[str]:
     # decode the raw text file (throws an error if the file can't be decoded)
     raw_text: bytes = await file.read()
@@ -1,5 +1,6 @@
 import os
 import io
+import asyncio
 import sys
 import re
 import pytest
@@ -34,8 +35,10 @@ if str(SRC) not in sys.path:
 # NOTE: these imports MUST come after sys.path tweak, otherwise you won't be able to run the test suite
 from db.session import get_session
 from srv.schemas import Event, EventType, AnalysisResult, DependencyReport, User, UserPublic
-from srv.security import get_current_user
+from srv.security import get_current_user, token_cache
 from srv.app import app
+from services.users import user_cache
+from services.api_keys import api_key_cache
 
 # regex taken from this source: https://regex101.com/r/wL7uN1/1
 HEX32 = re.compile(
@@ -44,6 +47,18 @@ HEX32 = re.compile(
 BASE64URL = re.compile(r"^[A-Za-z0-9_-]+$")
 
 
+# the auth caches would otherwise leak users/tokens from one test into the next
+@pytest.fixture(autouse=True)
+def clear_auth_caches() -> Generator[None, None, None]:
+    user_cache.clear()
+    token_cache.clear()
+    api_key_cache.clear()
+    yield
+    user_cache.clear()
+    token_cache.clear()
+    api_key_cache.clear()
+
+
 # using this context manager will ensure FastAPI lifespan/startup/shutdown all end up running
 @pytest.fixture()
 def client(session_override) -> Generator[TestClient, None, None]:
@@ -92,12 +107,13 @@ class FakeLLM:
     Minimal LLM double compatible with:
         structured_llm = llm.with_structured_output(AnalysisResult)
         await structured_llm.ainvoke(messages)
-    Captures messages for assertions.
+    Captures messages for assertions. `latency` (in seconds) makes every call take about as long as a real one (e.g. for benchmarks).
     """
 
-    def __init__(self, return_val=None, should_raise: bool = False):
+    def __init__(self, return_val=None, should_raise: bool = False, latency: float = 0.0):
         self._return = return_val
         self._raise = should_raise
+        self.latency = latency
         self.calls: list[list] = []  # list of message lists
 
     def with_structured_output(self, _):
@@ -105,6 +121,8 @@ class FakeLLM:
 
     async def ainvoke(self, messages):
         self.calls.append(messages)
+        if self.latency:
+            await asyncio.sleep(self.latency)
         if self._raise:
             raise Exception("LLM invocation failed")
         # if no explicit return is supplied, return a plain dict so that it can still be validated as AnalysisResult
@@ -0,0 +1,72 @@
+import os
+import tracemalloc
+import pytest
+from fastapi import status
+from core import memory
+from core.config import get_settings
+
+settings = get_settings()
+
+
+@pytest.fixture
+def as_admin(monkeypatch):
+    # the conftest client is always logged in as "testuser"
+    monkeypatch.setattr(settings, "admin_usernames", ["testuser"])
+    yield
+    # tracing slows down every other test, so never leave it on
+    memory.stop_tracing()
+
+
+def test_memory_report_without_tracing(as_admin, client):
+    """Tests that "GET /admin/memory" reports the RSS and GC stats of the worker, even when tracing is off."""
+    r = client.get("/admin/memory")
+    assert r.status_code == status.HTTP_200_OK, r.text
+    body = r.json()
+
+    assert body["pid"] == os.getpid()
+    assert body["rss_bytes"] > 0
+    assert body["tracing"] is False
+    assert body["top"] == [] and body["diff"] == []
+    assert len(body["gc"]["counts"]) == len(body["gc"]["collections"]) == 3
+
+
+def test_memory_tracing_lifecycle(as_admin, client):
+    """Tests that tracing can be started, reports the allocation sites (and the diff to the baseline), and can be stopped."""
+    r = client.post("/admin/memory/tracing", json={"frames": 2})
+    assert r.status_code == status.HTTP_200_OK, r.text
+    assert r.json()["tracing"] is True
+    assert tracemalloc.get_traceback_limit() == 2
+
+    # allocate something that shows up in the diff
+    leak = [bytearray(1024) for _ in range(200)]
+
+    body = client.get("/admin/memory", params={"limit": 5}).json()
+    assert body["traced_bytes"] > 0
+    assert 0 < len(body["top"]) <= 5
+    assert 0 < len(body["diff"]) <= 5
+    assert any(site["size_diff_bytes"] > 0 for site in body["diff"])
+    assert all(":" in site["location"] for site in body["top"])
+
+    r = client.post("/admin/memory/baseline")
+    assert r.status_code == status.HTTP_200_OK
+    assert memory.baseline is not None
+
+    r = client.delete("/admin/memory/tracing")
+    assert r.status_code == status.HTTP_200_OK
+    assert r.json()["tracing"] is False
+    assert not tracemalloc.is_tracing()
+    del leak
+
+
+def test_memory_rejects_invalid_params(as_admin, client):
+    """Tests that out-of-range parameters are rejected."""
+    assert client.get("/admin/memory", params={"limit": 0}).status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
+    assert client.get("/admin/memory", params={"group_by": "nope"}).status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
+    assert client.post("/admin/memory/tracing", json={"frames": 0}).status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
+
+
+def test_memory_rejects_non_admins(client):
+    """Tests that only admins can profile the memory."""
+    assert client.get("/admin/memory").status_code == status.HTTP_403_FORBIDDEN
+    assert client.post("/admin/memory/tracing").status_code == status.HTTP_403_FORBIDDEN
+    assert not tracemalloc.is_tracing()
@@ -0,0 +1,76 @@
+import io
+import pytest
+from uuid import uuid4
+from fastapi import status
+from core.config import get_settings
+from services.idempotency import InMemoryIdempotencyStore
+from srv.app import app
+from srv.schemas import UserPublic
+from srv.security import get_current_user
+
+
+@pytest.fixture
+def idempotent_client(client, fake_llm, monkeypatch):
+    # every request has to come from the same user for the keys to match
+    user = UserPublic(id=str(uuid4()), username="idempotent")
+    app.dependency_overrides[get_current_user] = lambda: user
+    monkeypatch.setattr("services.idempotency.idempotency_store", InMemoryIdempotencyStore())
+    return client
+
+
+def _analyze(client, key=None, contents=b"requests==2.32.3\n", project_name="untitled"):
+    files = {"file": ("requirements.txt", io.BytesIO(contents), "text/plain")}
+    headers = {"Idempotency-Key": key} if key else {}
+    return client.post("/analyze", files=files, data={"project_name": project_name}, headers=headers)
+
+
+def test_retries_get_the_stored_response(idempotent_client, fake_llm):
+    """Tests that a retry with the same "Idempotency-Key" gets the first response, without calling the LLM again."""
+    first = _analyze(idempotent_client, "ci-run-1")
+    assert first.status_code == status.HTTP_200_OK, first.text
+    assert "idempotent-replayed" not in first.headers
+
+    retry = _analyze(idempotent_client, "ci-run-1")
+    assert retry.status_code == status.HTTP_200_OK, retry.text
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.json() == first.json()
+    assert len(fake_llm.calls) == 1
+
+    # a new key is a new analysis
+    other = _analyze(idempotent_client, "ci-run-2")
+    assert other.json()["project_id"] != first.json()["project_id"]
+    assert len(fake_llm.calls) == 2
+
+
+def test_requests_without_a_key_always_run(idempotent_client, fake_llm):
+    _analyze(idempotent_client)
+    _analyze(idempotent_client)
+    assert len(fake_llm.calls) == 2
+
+
+def test_rejects_a_key_reused_for_another_request(idempotent_client):
+    """Tests that reusing an "Idempotency-Key" with a different file returns a 422."""
+    assert _analyze(idempotent_client, "ci-run-1").status_code == status.HTTP_200_OK
+    r = _analyze(idempotent_client, "ci-run-1", contents=b"numpy==2.0.0\n")
+    assert r.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT, r.text
+
+
+def test_failed_requests_are_not_stored(idempotent_client, fake_llm):
+    """Tests that a retry of a request that was rejected runs again."""
+    r = _analyze(idempotent_client, "ci-run-1", project_name="x" * 101)
+    assert r.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
+    assert _analyze(idempotent_client, "ci-run-1").status_code == status.HTTP_200_OK
+
+
+def test_failed_analyses_are_only_kept_briefly(idempotent_client, fake_llm, monkeypatch):
+    """Tests that a FAILED analysis is kept for `idempotency_failed_ttl` seconds instead of a whole day."""
+    monkeypatch.setattr(get_settings(), "idempotency_failed_ttl", 0.0)
+    fake_llm._raise = True
+    first = _analyze(idempotent_client, "ci-run-1")
+    assert first.json()["status"] == "failed"
+
+    fake_llm._raise = False
+    retry = _analyze(idempotent_client, "ci-run-1")
+    assert "idempotent-replayed" not in retry.headers
+    assert retry.json()["status"] == "completed"
+    assert len(fake_llm.calls) == 2
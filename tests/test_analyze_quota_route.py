@@ -0,0 +1,38 @@
+import io
+import pytest
+from uuid import uuid4
+from fastapi import status
+from core.config import get_settings
+from services.rate_limits import InMemoryRateLimiter
+from srv.app import app
+from srv.schemas import UserPublic
+from srv.security import get_current_user
+
+settings = get_settings()
+
+
+@pytest.fixture
+def limited_client(client, fake_llm, monkeypatch):
+    # every request has to come from the same user for the limits to kick in
+    user = UserPublic(id=str(uuid4()), username="limited")
+    app.dependency_overrides[get_current_user] = lambda: user
+    monkeypatch.setattr("services.rate_limits.rate_limiter", InMemoryRateLimiter())
+    monkeypatch.setattr(settings, "analyze_rate_limit_per_minute", 1.0)
+    monkeypatch.setattr(settings, "analyze_rate_limit_burst", 2)
+    return client
+
+
+def _analyze(client):
+    files = {"file": ("requirements.txt", io.BytesIO(b"requests==2.32.3\n"), "text/plain")}
+    return client.post("/analyze", files=files, data={"project_name": "untitled"})
+
+
+def test_rejects_analyses_over_the_rate_limit(limited_client):
+    """Tests that "POST /analyze" returns a 429 (with a "Retry-After" header) once the user's burst is used up."""
+    assert _analyze(limited_client).status_code == status.HTTP_200_OK
+    assert _analyze(limited_client).status_code == status.HTTP_200_OK
+
+    r = _analyze(limited_client)
+    assert r.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    # 1 analysis per minute means that the next token is a minute away
+    assert 0 < int(r.headers["Retry-After"]) <= 60
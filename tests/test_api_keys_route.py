@@ -0,0 +1,86 @@
+import pytest
+from fastapi import status
+from srv.app import app
+from srv.security import create_access_token, get_current_user
+
+
+def _bearer(token: str) -> dict[str, str]:
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def seeded_client(client_with_seed):
+    # we only need to keep the "get_session" override; the API keys need a real user
+    app.dependency_overrides.pop(get_current_user, None)
+    return client_with_seed
+
+
+def _create_key(client, name: str = "ci") -> dict:
+    token = create_access_token({"sub": "seeded"})
+    r = client.post("/users/me/api-keys", json={"name": name}, headers=_bearer(token))
+    assert r.status_code == status.HTTP_201_CREATED, r.text
+    return r.json()
+
+
+def test_success_create_api_key(seeded_client):
+    """Tests that "POST /users/me/api-keys" returns the new key (once) along with its public details."""
+    body = _create_key(seeded_client)
+
+    assert body["name"] == "ci"
+    assert body["key"].startswith(f"lg_{body['prefix']}_")
+    assert "hashed_key" not in body
+    assert "created_at" in body
+
+
+def test_api_key_authenticates_in_header_and_as_bearer(seeded_client):
+    """Tests that an API key works in the "X-API-Key" header and as the bearer token."""
+    key = _create_key(seeded_client)["key"]
+
+    r = seeded_client.get("/users/me", headers={"X-API-Key": key})
+    assert r.status_code == status.HTTP_200_OK, r.text
+    assert r.json()["username"] == "seeded"
+
+    r = seeded_client.get("/users/me", headers=_bearer(key))
+    assert r.status_code == status.HTTP_200_OK, r.text
+    assert r.json()["username"] == "seeded"
+
+
+def test_rejects_invalid_api_key(seeded_client):
+    """Tests that a made-up key (or a tampered one) results in a 401 error."""
+    key = _create_key(seeded_client)["key"]
+
+    r = seeded_client.get("/users/me", headers={"X-API-Key": key[:-1] + ("A" if key[-1] != "A" else "B")})
+    assert r.status_code == status.HTTP_401_UNAUTHORIZED
+    r = seeded_client.get("/users/me", headers={"X-API-Key": "lg_000000000000_nope"})
+    assert r.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_list_api_keys_hides_the_keys(seeded_client):
+    """Tests that "GET /users/me/api-keys" lists the keys without exposing them."""
+    created = _create_key(seeded_client)
+    token = create_access_token({"sub": "seeded"})
+
+    r = seeded_client.get("/users/me/api-keys", headers=_bearer(token))
+    assert r.status_code == status.HTTP_200_OK, r.text
+    body = r.json()
+    assert [k["id"] for k in body] == [created["id"]]
+    assert "key" not in body[0] and "hashed_key" not in body[0]
+
+
+def test_revoked_api_key_stops_working(seeded_client):
+    """Tests that a key stops working on the worker that revoked it right away (even if it was cached there)."""
+    created = _create_key(seeded_client)
+    token = create_access_token({"sub": "seeded"})
+
+    # warm the cache first
+    r = seeded_client.get("/users/me", headers={"X-API-Key": created["key"]})
+    assert r.status_code == status.HTTP_200_OK, r.text
+
+    r = seeded_client.delete(f"/users/me/api-keys/{created['id']}", headers=_bearer(token))
+    assert r.status_code == status.HTTP_204_NO_CONTENT, r.text
+
+    r = seeded_client.get("/users/me", headers={"X-API-Key": created["key"]})
+    assert r.status_code == status.HTTP_401_UNAUTHORIZED
+
+    r = seeded_client.delete(f"/users/me/api-keys/{created['id']}", headers=_bearer(token))
+    assert r.status_code == status.HTTP_404_NOT_FOUND
@@ -0,0 +1,60 @@
+import os
+import sys
+import subprocess
+import pytest
+from fastapi.testclient import TestClient
+from conftest import SRC
+from core.config import get_settings
+from srv.app import create_app
+
+
+def test_importing_the_app_skips_langchain():
+    """Tests that importing "srv.app" doesn't import LangChain (it's only needed once we call the LLM)."""
+    env = {**os.environ, "PYTHONPATH": str(SRC)}
+    code = "import sys, srv.app; print('langchain_openai' in sys.modules)"
+    out = subprocess.run([sys.executable, "-c", code], env=env,
+                         capture_output=True, text=True, check=True).stdout
+    assert out.strip() == "False"
+
+
+def test_importing_needs_no_environment():
+    """Tests that the modules (and the module-level app) can be imported without DB_URL, OPENAI_API_KEY and the like."""
+    env = {key: value for key, value in os.environ.items()
+           if key not in {"DB_URL", "DB_READ_URL", "OPENAI_API_KEY", "JWT_SECRET_KEY"}}
+    env["PYTHONPATH"] = str(SRC)
+    code = "import db.session; from srv.app import app; print(type(app).__name__)"
+    out = subprocess.run([sys.executable, "-c", code], env=env,
+                         capture_output=True, text=True, check=True).stdout
+    assert out.strip() == "FastAPI"
+
+
+def test_create_app_builds_independent_apps():
+    """Tests that every call to `create_app()` returns a new app with all of the routes."""
+    first, second = create_app(), create_app()
+    assert first is not second
+
+    paths = {route.path for route in first.routes}
+    assert {"/", "/analyze", "/users/token", "/users/me", "/llm/guess"} <= paths
+
+
+def test_missing_openai_api_key_fails_on_startup():
+    """Tests that a missing OPENAI_API_KEY stops the app from starting (instead of from being imported)."""
+    settings = get_settings().model_copy(update={"openai_api_key": None})
+    app = create_app(settings)
+    with pytest.raises(RuntimeError) as ex:
+        with TestClient(app):
+            pass
+    assert "OPENAI_API_KEY" in str(ex.value)
+
+
+@pytest.mark.asyncio
+async def test_track_analysis_counts_running_analyses():
+    """Tests that `track_analysis()` counts an analysis for as long as it's running."""
+    from srv.app import ANALYSES_IN_FLIGHT, track_analysis
+
+    tracker = track_analysis()
+    await tracker.__anext__()
+    assert ANALYSES_IN_FLIGHT.get() == 1
+    with pytest.raises(StopAsyncIteration):
+        await tracker.__anext__()
+    assert ANALYSES_IN_FLIGHT.get() == 0
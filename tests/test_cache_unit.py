@@ -0,0 +1,48 @@
+from core.cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_entries_expire_after_ttl():
+    """Tests that entries are gone once their TTL is up."""
+    clock = FakeClock()
+    cache: TTLCache[str, int] = TTLCache(maxsize=10, ttl=5, timer=clock)
+    cache.set("a", 1)
+    clock.now = 4.9
+    assert cache.get("a") == 1
+    clock.now = 5.0
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_per_entry_ttl_can_only_shorten_the_default():
+    """Tests that a per-entry TTL caps (but never extends) the cache's TTL."""
+    clock = FakeClock()
+    cache: TTLCache[str, int] = TTLCache(maxsize=10, ttl=5, timer=clock)
+    cache.set("short", 1, ttl=1)
+    cache.set("long", 2, ttl=100)
+    cache.set("expired", 3, ttl=-1)
+    clock.now = 2
+    assert cache.get("short") is None
+    assert cache.get("long") == 2
+    assert cache.get("expired") is None
+    clock.now = 5
+    assert cache.get("long") is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    """Tests that the cache never grows past `maxsize`."""
+    cache: TTLCache[str, int] = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1     # "b" is now the least recently used entry
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.pop("a") == 1 and len(cache) == 1
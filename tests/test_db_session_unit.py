@@ -0,0 +1,115 @@
+import pytest
+from uuid import uuid4
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+import db.session as db_session
+from db.session import get_read_session, get_retry_delay, get_head_revisions, init_engine, close_engine, PrimarySession, ReplicaSession, SchemaRevisionError
+from services.users import get_user
+from srv.schemas import User
+
+
+@pytest.mark.asyncio
+async def test_read_session_reuses_primary_session_without_replica(monkeypatch, session_override):
+    """Tests that `get_read_session()` yields the primary session when there's no read replica."""
+    monkeypatch.setattr(db_session, "AsyncReadSessionLocal", None)
+    gen = get_read_session(session_override)
+    assert await anext(gen) is session_override
+    with pytest.raises(StopAsyncIteration):
+        await anext(gen)
+
+
+@pytest.mark.asyncio
+async def test_read_session_reads_own_writes_after_primary_commit(monkeypatch, tmp_path):
+    """Tests that reads go to the replica until the primary session of the same request writes something."""
+    primary = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'primary.db'}")
+    replica = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'replica.db'}")
+    for eng in (primary, replica):
+        async with eng.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all)
+
+    # pretend that the replica is lagging behind the primary
+    async with AsyncSession(replica) as s:
+        s.add(User(id=str(uuid4()), username="replicated", hashed_password="x"))
+        await s.commit()
+
+    monkeypatch.setattr(db_session, "engine", primary)
+    monkeypatch.setattr(db_session, "AsyncReadSessionLocal", async_sessionmaker(
+        replica, expire_on_commit=False, class_=AsyncSession, sync_session_class=ReplicaSession))
+
+    try:
+        async with async_sessionmaker(primary, expire_on_commit=False, class_=AsyncSession, sync_session_class=PrimarySession)() as write_session:
+            gen = get_read_session(write_session)
+            read_session = await anext(gen)
+            assert read_session is not write_session
+
+            # before writing, the replica answers
+            assert await get_user(read_session, "replicated") is not None
+
+            write_session.add(User(id=str(uuid4()), username="brandnew", hashed_password="x"))
+            await write_session.commit()
+
+            # after writing, the primary answers (and it doesn't know about the replica's row)
+            assert await get_user(read_session, "brandnew") is not None
+            assert await get_user(read_session, "replicated") is None
+            await gen.aclose()
+    finally:
+        await primary.dispose()
+        await replica.dispose()
+
+
+async def _stamp(db_url: str, revision: str) -> None:
+    eng = create_async_engine(db_url)
+    async with eng.begin() as conn:
+        await conn.execute(text("CREATE TABLE alembic_version (version_num VARCHAR(32) NOT NULL)"))
+        await conn.execute(text("INSERT INTO alembic_version (version_num) VALUES (:rev)"), {"rev": revision})
+    await eng.dispose()
+
+
+@pytest.mark.asyncio
+async def test_init_engine_verify_mode_accepts_migrated_db(monkeypatch, tmp_path):
+    """Tests that the "verify" startup mode passes when the DB is at the latest Alembic revision."""
+    monkeypatch.setattr(db_session, "engine", None)
+    db_url = f"sqlite+aiosqlite:///{tmp_path / 'migrated.db'}"
+    (head,) = get_head_revisions()
+    await _stamp(db_url, head)
+    try:
+        await init_engine(db_url, max_retries=1, startup_mode="verify")
+        assert db_session.engine is not None
+    finally:
+        await close_engine()
+
+
+@pytest.mark.asyncio
+async def test_init_engine_verify_mode_rejects_outdated_db(monkeypatch, tmp_path):
+    """Tests that the "verify" startup mode fails fast (no retries) when the DB hasn't been migrated."""
+    monkeypatch.setattr(db_session, "engine", None)
+    db_url = f"sqlite+aiosqlite:///{tmp_path / 'outdated.db'}"
+    await _stamp(db_url, "not-a-real-revision")
+    try:
+        with pytest.raises(SchemaRevisionError) as ex:
+            await init_engine(db_url, max_retries=3, retry_delay=60, startup_mode="verify")
+        assert "please run the migrations" in str(ex.value).lower()
+    finally:
+        await close_engine()
+
+
+@pytest.mark.asyncio
+async def test_init_engine_rejects_sync_drivers(monkeypatch):
+    """Tests that a DB_URL (or DB_READ_URL) without an async driver is rejected before any engine is created."""
+    monkeypatch.setattr(db_session, "engine", None)
+    with pytest.raises(RuntimeError) as ex:
+        await init_engine("postgresql://user:pw@localhost/db", max_retries=1)
+    assert "DB_URL" in str(ex.value)
+    with pytest.raises(RuntimeError) as ex:
+        await init_engine("sqlite+aiosqlite://", max_retries=1, read_db_url="sqlite:///replica.db")
+    assert "DB_READ_URL" in str(ex.value)
+    assert db_session.engine is None
+
+
+def test_retry_delay_grows_exponentially_with_jitter():
+    """Tests that retry delays stay between 0 and the (capped) exponential backoff."""
+    for attempt in range(10):
+        delay = get_retry_delay(attempt, 0.5, 4.0)
+        assert 0 <= delay <= min(4.0, 0.5 * 2 ** attempt)
@@ -0,0 +1,207 @@
+import asyncio
+import pytest
+from datetime import date
+from uuid import uuid4
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlmodel.ext.asyncio.session import AsyncSession
+import crud.idempotency
+from core.config import get_settings
+from services.idempotency import DatabaseIdempotencyStore, IdempotencyKeyInUse, IdempotencyKeyReused, InMemoryIdempotencyStore, fingerprint_request, run_idempotently
+from srv.schemas import AnalysisResult
+
+settings = get_settings()
+
+
+# runs the test against both backends
+@pytest.fixture(params=["memory", "database"])
+def store(request, test_engine, monkeypatch):
+    if request.param == "memory":
+        store = InMemoryIdempotencyStore()
+    else:
+        SessionLocal = async_sessionmaker(
+            bind=test_engine, expire_on_commit=False, class_=AsyncSession)
+        store = DatabaseIdempotencyStore(SessionLocal)
+    monkeypatch.setattr("services.idempotency.idempotency_store", store)
+    return store
+
+
+def _result(name: str = "test") -> AnalysisResult:
+    return AnalysisResult(project_name=name, analysis_date=date(2025, 1, 2), files=[])
+
+
+def test_fingerprint_request():
+    assert fingerprint_request("a", b"bc") == fingerprint_request("a", "bc")
+    assert fingerprint_request("ab", "c") != fingerprint_request("a", "bc")
+
+
+@pytest.mark.asyncio
+async def test_store_claim_complete_release(store):
+    key = f"test:{uuid4()}"
+    assert await store.claim(key, "abc", 60) is None
+
+    pending = await store.claim(key, "abc", 60)
+    assert pending.fingerprint == "abc" and pending.response is None
+
+    await store.complete(key, "abc", "{}", 60)
+    assert (await store.claim(key, "abc", 60)).response == "{}"
+    # completed keys can't be released
+    await store.release(key)
+    assert (await store.claim(key, "abc", 60)).response == "{}"
+
+    other = f"test:{uuid4()}"
+    await store.claim(other, "abc", 60)
+    await store.release(other)
+    assert await store.claim(other, "abc", 60) is None
+
+
+@pytest.mark.asyncio
+async def test_run_idempotently_replays_the_first_response(store):
+    """Tests that the function only runs once per key, and that the retries get its response."""
+    key = f"test:{uuid4()}"
+    calls = []
+
+    async def _run():
+        calls.append(1)
+        return _result(f"call {len(calls)}")
+
+    first, replayed = await run_idempotently(key, "abc", AnalysisResult, _run)
+    assert not replayed
+    second, replayed = await run_idempotently(key, "abc", AnalysisResult, _run)
+    assert replayed
+    assert second == first
+    assert len(calls) == 1
+
+    with pytest.raises(IdempotencyKeyReused):
+        await run_idempotently(key, "def", AnalysisResult, _run)
+
+
+@pytest.mark.asyncio
+async def test_run_idempotently_waits_for_the_original_request(store):
+    """Tests that a retry waits for the original request (instead of running again)."""
+    key = f"test:{uuid4()}"
+    started, finish = asyncio.Event(), asyncio.Event()
+    calls = []
+
+    async def _run():
+        calls.append(1)
+        started.set()
+        await finish.wait()
+        return _result()
+
+    original = asyncio.create_task(run_idempotently(key, "abc", AnalysisResult, _run))
+    await started.wait()
+    retry = asyncio.create_task(run_idempotently(key, "abc", AnalysisResult, _run))
+    await asyncio.sleep(0.05)
+    assert not retry.done()
+
+    finish.set()
+    assert (await original) == (_result(), False)
+    assert (await retry) == (_result(), True)
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_run_idempotently_gives_up_waiting(store, monkeypatch):
+    monkeypatch.setattr(settings, "idempotency_wait_timeout", 0.1)
+    key = f"test:{uuid4()}"
+    await store.claim(key, "abc", 60)
+
+    with pytest.raises(IdempotencyKeyInUse):
+        await run_idempotently(key, "abc", AnalysisResult, lambda: _result())
+
+
+@pytest.mark.asyncio
+async def test_run_idempotently_releases_the_key_on_failure(store):
+    """Tests that failed requests aren't stored, so that the retry runs again."""
+    key = f"test:{uuid4()}"
+
+    async def _fail():
+        raise RuntimeError("boom")
+
+    async def _run():
+        return _result()
+
+    with pytest.raises(RuntimeError):
+        await run_idempotently(key, "abc", AnalysisResult, _fail)
+    assert (await run_idempotently(key, "abc", AnalysisResult, _run)) == (_result(), False)
+
+
+@pytest.mark.asyncio
+async def test_expired_keys_can_be_claimed_again(test_engine):
+    SessionLocal = async_sessionmaker(
+        bind=test_engine, expire_on_commit=False, class_=AsyncSession)
+    now = [1000.0]
+    store = DatabaseIdempotencyStore(SessionLocal, timer=lambda: now[0])
+    key = f"test:{uuid4()}"
+
+    assert await store.claim(key, "abc", 60) is None
+    await store.complete(key, "abc", "{}", 60)
+    now[0] += 61
+    assert await store.claim(key, "def", 60) is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", ["memory", "database"])
+async def test_late_finishers_dont_overwrite_the_response(backend, test_engine):
+    """Tests that a request whose claim expired can't store its response over the one of the request that took over the key."""
+    now = [1000.0]
+    if backend == "memory":
+        store = InMemoryIdempotencyStore(timer=lambda: now[0])
+    else:
+        SessionLocal = async_sessionmaker(
+            bind=test_engine, expire_on_commit=False, class_=AsyncSession)
+        store = DatabaseIdempotencyStore(SessionLocal, timer=lambda: now[0])
+    key = f"test:{uuid4()}"
+
+    assert await store.claim(key, "abc", 60) is None
+    now[0] += 61
+    assert await store.claim(key, "def", 60) is None
+    # the first request is still pending, while the second one is waiting on it
+    await store.complete(key, "abc", "{\"late\": true}", 60)
+    assert (await store.claim(key, "def", 60)).response is None
+
+    await store.complete(key, "def", "{}", 60)
+    await store.complete(key, "def", "{\"again\": true}", 60)
+    assert (await store.claim(key, "def", 60)).response == "{}"
+
+
+@pytest.mark.asyncio
+async def test_taking_over_a_claim_wakes_its_waiters():
+    now = [1000.0]
+    store = InMemoryIdempotencyStore(timer=lambda: now[0])
+    key = f"test:{uuid4()}"
+    assert await store.claim(key, "abc", 60) is None
+
+    waiter = asyncio.create_task(store.wait(key, 30))
+    await asyncio.sleep(0)
+    now[0] += 61
+    assert await store.claim(key, "def", 60) is None
+    await asyncio.wait_for(waiter, 1)
+
+
+@pytest.mark.asyncio
+async def test_claim_retries_when_the_winner_disappears(test_engine, monkeypatch):
+    """Tests that losing the race for a key never counts as claiming it, even if the winner's record is gone by the time we look it up."""
+    SessionLocal = async_sessionmaker(
+        bind=test_engine, expire_on_commit=False, class_=AsyncSession)
+    store = DatabaseIdempotencyStore(SessionLocal)
+    key = f"test:{uuid4()}"
+    assert await store.claim(key, "abc", 60) is None
+
+    select = crud.idempotency.select_idempotency_key
+    lookups = []
+
+    async def _flaky_select(session, key):
+        lookups.append(key)
+        # the first lookup just misses the record
+        return None if len(lookups) == 1 else await select(session, key)
+
+    monkeypatch.setattr(crud.idempotency, "select_idempotency_key", _flaky_select)
+    assert (await store.claim(key, "abc", 60)).fingerprint == "abc"
+    assert len(lookups) == 2
+
+    # if the record never shows up, the conflict is raised instead of pretending that we got the key
+    monkeypatch.setattr(crud.idempotency, "select_idempotency_key", lambda session, key: asyncio.sleep(0))
+    with pytest.raises(IntegrityError):
+        await store.claim(key, "abc", 60)
@@ -0,0 +1,78 @@
+import pytest
+import orjson
+import services.cassette as cassette_module
+from services.cassette import LLMCassette, fingerprint_llm_request
+from srv.app import get_llm_analysis
+
+REQS = ["requests==2.32.3", "fastapi>=0.95.0"]
+
+
+@pytest.fixture
+def use_cassette(monkeypatch, tmp_path):
+    def _use(mode: str) -> LLMCassette:
+        cassette = LLMCassette(tmp_path / "cassette.jsonl", mode)
+        monkeypatch.setattr(cassette_module, "cassette", cassette)
+        return cassette
+    yield _use
+
+
+@pytest.mark.asyncio
+async def test_record_then_replay(use_cassette, fake_llm):
+    """Tests that a recorded analysis is replayed from disk, without calling the LLM again."""
+    cassette = use_cassette("record")
+    recorded = await get_llm_analysis("MyProject", REQS)
+    assert recorded is not None
+    assert len(fake_llm.calls) == 1
+
+    lines = cassette.path.read_bytes().splitlines()
+    assert len(lines) == 1
+    assert orjson.loads(lines[0])["requirements"] == REQS
+
+    # a fresh cassette has to read the recording back from the file
+    use_cassette("replay")
+    fake_llm._raise = True
+    assert await get_llm_analysis("MyProject", REQS) == recorded
+    assert len(fake_llm.calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_replay_miss_fails_the_analysis(use_cassette, fake_llm):
+    """Tests that a request that was never recorded fails in replay mode (instead of calling the LLM)."""
+    use_cassette("replay")
+    assert await get_llm_analysis("MyProject", REQS) is None
+    assert fake_llm.calls == []
+
+
+@pytest.mark.asyncio
+async def test_failed_analyses_are_not_recorded(use_cassette, fake_llm):
+    """Tests that only successful analyses end up in the cassette."""
+    cassette = use_cassette("record")
+    fake_llm._raise = True
+    assert await get_llm_analysis("MyProject", REQS) is None
+    assert len(cassette) == 0
+    assert not cassette.path.exists()
+
+
+def test_cassette_skips_malformed_lines_and_newest_wins(tmp_path):
+    """Tests that loading a cassette skips broken lines, and that re-recordings replace older ones."""
+    path = tmp_path / "cassette.jsonl"
+    response = {"project_name": "p", "analysis_date": "2025-01-01", "files": []}
+    path.write_bytes(b"\n".join([
+        orjson.dumps({"fingerprint": "a", "response": response}),
+        b"{not json",
+        orjson.dumps({"fingerprint": "a", "response": {**response, "project_name": "newer"}}),
+    ]))
+    cassette = LLMCassette(path, "replay")
+    assert len(cassette) == 1
+    assert cassette.get("a").project_name == "newer"
+    assert cassette.get("b") is None
+
+
+def test_fingerprint_depends_on_the_request():
+    """Tests that the fingerprint changes with every part of the request (and the prompt)."""
+    base = fingerprint_llm_request("gpt-4o-mini", "prompt", "p", REQS)
+    assert base == fingerprint_llm_request("gpt-4o-mini", "prompt", "p", list(REQS))
+    assert base != fingerprint_llm_request("gpt-4o", "prompt", "p", REQS)
+    assert base != fingerprint_llm_request("gpt-4o-mini", "prompt v2", "p", REQS)
+    assert base != fingerprint_llm_request("gpt-4o-mini", "prompt", "q", REQS)
+    assert base != fingerprint_llm_request("gpt-4o-mini", "prompt", "p", REQS[:1])
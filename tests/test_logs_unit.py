@@ -0,0 +1,67 @@
+import io
+import json
+import logging
+import pytest
+from core.config import get_settings
+from core.logs import JSONFormatter, SamplingFilter, setup_logging, shutdown_logging
+
+
+def _record(name: str = "test", level: int = logging.INFO, msg: str = "hello %s", args=("world",), **extra) -> logging.LogRecord:
+    record = logging.LogRecord(name, level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_json_formatter():
+    """Tests that records are formatted as one line of JSON, with the extras as fields of their own."""
+    line = JSONFormatter().format(_record(project_name="demo", user_id=object()))
+    assert "\n" not in line
+    entry = json.loads(line)
+    assert entry["level"] == "INFO"
+    assert entry["logger"] == "test"
+    assert entry["msg"] == "hello world"
+    assert entry["project_name"] == "demo"
+    # values that JSON can't represent fall back to `str`
+    assert isinstance(entry["user_id"], str)
+
+
+def test_sampling_filter():
+    """Tests that noisy loggers only keep their share of INFO records, but every warning."""
+    f = SamplingFilter({"crud": 0.25, "crud.users": 1.0})
+    kept = [f.filter(_record("crud.events")) for _ in range(100)]
+    assert sum(kept) == 25
+    assert all(f.filter(_record("crud.events", logging.WARNING)) for _ in range(10))
+    # the most specific logger wins, and loggers without a rate keep everything
+    assert all(f.filter(_record("crud.users")) for _ in range(10))
+    assert all(f.filter(_record("srv.app")) for _ in range(10))
+
+
+def test_setup_logging_writes_from_a_background_thread(monkeypatch):
+    """Tests that the logs go through the queue to the stream, respecting per-module levels."""
+    settings = get_settings()
+    monkeypatch.setattr(settings, "log_levels", {"tests.quiet": "WARNING"})
+    stream = io.StringIO()
+    root = logging.getLogger()
+    level = root.level
+    setup_logging(settings, stream)
+    try:
+        logging.getLogger("tests.loud").info("kept", extra={"answer": 42})
+        logging.getLogger("tests.quiet").info("dropped")
+    finally:
+        # stopping the listener flushes the queue
+        shutdown_logging()
+        root.setLevel(level)
+        logging.getLogger("tests.quiet").setLevel(logging.NOTSET)
+
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [line["msg"] for line in lines] == ["kept"]
+    assert lines[0]["answer"] == 42
+
+
+@pytest.mark.parametrize("log_format", ["json", "text"])
+def test_shutdown_logging_is_idempotent(monkeypatch, log_format):
+    monkeypatch.setattr(get_settings(), "log_format", log_format)
+    listener = setup_logging(get_settings(), io.StringIO())
+    assert setup_logging(get_settings()) is listener
+    shutdown_logging()
+    shutdown_logging()
@@ -0,0 +1,61 @@
+import time
+import asyncio
+import logging
+import pytest
+from core.loop_monitor import EVENT_LOOP_BLOCKED, EVENT_LOOP_LAG_SECONDS, LoopMonitor
+
+
+def _block_the_loop(seconds: float) -> None:
+    time.sleep(seconds)
+
+
+@pytest.mark.asyncio
+async def test_monitor_measures_lag():
+    """Tests that blocking the loop shows up in the lag histogram and the blocked counter."""
+    monitor = LoopMonitor(interval=0.01, threshold=0.05)
+    lag_count, blocked = EVENT_LOOP_LAG_SECONDS.count, EVENT_LOOP_BLOCKED._value.value
+    monitor.start()
+    try:
+        await asyncio.sleep(0.03)
+        _block_the_loop(0.1)
+        await asyncio.sleep(0.03)
+    finally:
+        await monitor.stop()
+
+    assert EVENT_LOOP_LAG_SECONDS.count > lag_count
+    assert EVENT_LOOP_BLOCKED._value.value == blocked + 1
+
+
+@pytest.mark.asyncio
+async def test_monitor_logs_blocking_stack_in_debug_mode(caplog):
+    """Tests that the watchdog logs the stack of the blocked loop (once per stall) in debug mode."""
+    monitor = LoopMonitor(interval=0.01, threshold=0.05, debug=True)
+    monitor.start()
+    try:
+        with caplog.at_level(logging.WARNING, logger="core.loop_monitor"):
+            await asyncio.sleep(0.03)
+            _block_the_loop(0.3)
+            await asyncio.sleep(0.03)
+    finally:
+        await monitor.stop()
+
+    records = [r for r in caplog.records if r.name == "core.loop_monitor"]
+    assert len(records) == 1
+    assert "_block_the_loop" in records[0].getMessage()
+    assert records[0].blocked_seconds >= 0.05
+
+
+@pytest.mark.asyncio
+async def test_monitor_stays_quiet_without_debug(caplog):
+    """Tests that nothing is logged when debug mode is off."""
+    monitor = LoopMonitor(interval=0.01, threshold=0.05)
+    monitor.start()
+    try:
+        with caplog.at_level(logging.WARNING, logger="core.loop_monitor"):
+            await asyncio.sleep(0.02)
+            _block_the_loop(0.1)
+            await asyncio.sleep(0.02)
+    finally:
+        await monitor.stop()
+
+    assert not [r for r in caplog.records if r.name == "core.loop_monitor"]
@@ -0,0 +1,64 @@
+import io
+import os
+import json
+from fastapi import status
+from core.metrics import CONTENT_TYPE_LATEST, Counter, Registry, collect_families
+from srv.app import app
+from srv.routers.metrics import read_snapshots, write_snapshot
+
+
+PID = f'pid="{os.getpid()}"'
+
+
+def _sample(text: str, name: str) -> float:
+    # every sample is labeled with the worker's PID
+    name = name[:-1] + f",{PID}}}" if name.endswith("}") else name + f"{{{PID}}}"
+    for line in text.splitlines():
+        if line.startswith(name + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+def test_metrics_cover_every_stage_of_an_analysis(client, fake_llm):
+    """Tests that "GET /metrics" reports the stages, events and LLM outcome of an analysis."""
+    before = client.get("/metrics").text
+    files = {"file": ("requirements.txt", io.BytesIO(b"requests==2.32.3\n"), "text/plain")}
+    assert client.post("/analyze", files=files, data={"project_name": "metrics"}).status_code == status.HTTP_200_OK
+
+    r = client.get("/metrics")
+    assert r.status_code == status.HTTP_200_OK
+    assert r.headers["content-type"] == CONTENT_TYPE_LATEST
+    for stage in ("upload_read", "validation", "parsing", "llm", "serialization"):
+        name = f'analyze_stage_seconds_count{{stage="{stage}"}}'
+        assert _sample(r.text, name) == _sample(before, name) + 1, stage
+    name = 'events_logged_total{event_type="ANALYSIS_COMPLETED"}'
+    assert _sample(r.text, name) == _sample(before, name) + 1
+    name = 'event_write_seconds_count{event_type="PROJECT_CREATED"}'
+    assert _sample(r.text, name) == _sample(before, name) + 1
+    name = 'llm_requests_total{outcome="success"}'
+    assert _sample(r.text, name) == _sample(before, name) + 1
+    assert f'db_pool_checked_out{{engine="primary",{PID}}}' in r.text
+    assert _sample(r.text, "analyses_in_flight") == 0
+    assert _sample(r.text, "process_resident_memory_bytes") > 0
+    assert _sample(r.text, "process_open_fds") > 0
+
+
+def test_metrics_include_the_other_workers(client, tmp_path, monkeypatch):
+    """Tests that "GET /metrics" also reports the metrics that the other workers shared."""
+    monkeypatch.setattr(app.state.settings, "metrics_dir", tmp_path)
+    registry = Registry()
+    Counter("llm_requests", "Calls to the LLM, by outcome.", labelnames=("outcome",), registry=registry).labels("success").inc(7)
+    (tmp_path / "worker-1.json").write_text(json.dumps(collect_families(registry, {"pid": "1"})))
+
+    r = client.get("/metrics")
+    assert 'llm_requests_total{outcome="success",pid="1"} 7.0' in r.text.splitlines()
+    assert r.text.count("# TYPE llm_requests counter") == 1
+
+    # a worker never reports its own snapshot on top of its live metrics
+    write_snapshot(tmp_path)
+    assert (tmp_path / f"worker-{os.getpid()}.json").exists()
+    assert len(read_snapshots(tmp_path, max_age=60)) == 1
+
+    # a worker that stopped sharing its metrics is gone
+    os.utime(tmp_path / "worker-1.json", (0, 0))
+    assert 'pid="1"' not in client.get("/metrics").text
@@ -0,0 +1,108 @@
+import pytest
+from core.metrics import Counter, Gauge, Histogram, Registry, _Metric, collect_families, generate_latest
+
+
+def test_counter_and_labels():
+    """Tests that counters (with and without labels) add up."""
+    registry = Registry()
+    plain = Counter("things", "Things.", registry=registry)
+    labeled = Counter("events", "Events.", labelnames=("type",), registry=registry)
+    plain.inc()
+    plain.inc(2)
+    labeled.labels("a").inc()
+    labeled.labels("a").inc()
+    labeled.labels("b").inc()
+
+    assert list(plain.samples()) == [("things_total", {}, 3.0)]
+    assert sorted(labeled.samples(), key=lambda s: s[1]["type"]) == [
+        ("events_total", {"type": "a"}, 2.0),
+        ("events_total", {"type": "b"}, 1.0),
+    ]
+    with pytest.raises(ValueError):
+        labeled.labels("a", "too many")
+
+
+def test_gauge_with_function():
+    """Tests that gauges can be set directly or computed when collected."""
+    registry = Registry()
+    g = Gauge("in_flight", "In flight.", registry=registry)
+    g.inc(3)
+    g.dec()
+    assert g.get() == 2
+    g.set_function(lambda: 42)
+    assert list(g.samples()) == [("in_flight", {}, 42.0)]
+
+
+def test_histogram_buckets_are_cumulative():
+    """Tests that histograms report cumulative buckets, a count and a sum."""
+    registry = Registry()
+    h = Histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0), registry=registry)
+    for v in (0.05, 0.1, 0.5, 5.0):
+        h.observe(v)
+
+    samples = {(name, labels.get("le")): value for name, labels, value in h.samples()}
+    assert samples[("latency_seconds_bucket", "0.1")] == 2
+    assert samples[("latency_seconds_bucket", "1.0")] == 3
+    assert samples[("latency_seconds_bucket", "+Inf")] == 4
+    assert samples[("latency_seconds_count", None)] == 4
+    assert samples[("latency_seconds_sum", None)] == pytest.approx(5.65)
+
+
+def test_registry_rejects_duplicate_names():
+    registry = Registry()
+    Counter("dupe", "Dupe.", registry=registry)
+    with pytest.raises(ValueError):
+        Gauge("dupe", "Dupe.", registry=registry)
+
+
+def test_histogram_timer():
+    """Tests that `time()` observes the duration of the block, even if it raises."""
+    registry = Registry()
+    h = Histogram("stage_seconds", "Stage.", labelnames=("stage",), registry=registry)
+    with h.labels("a").time():
+        pass
+    with pytest.raises(RuntimeError):
+        with h.labels("a").time():
+            raise RuntimeError("boom")
+    assert h.labels("a").count == 2
+
+
+def test_generate_latest():
+    """Tests that the metrics are rendered in the Prometheus text format."""
+    registry = Registry()
+    Counter("events", "Events.", labelnames=("type",), registry=registry).labels('say "hi"').inc()
+    Gauge("in_flight", "In flight.", registry=registry).set(2)
+    Histogram("latency_seconds", "Latency.", buckets=(0.1,), registry=registry).observe(0.05)
+
+    text = generate_latest(registry).decode()
+    assert text.endswith("\n")
+    lines = text.splitlines()
+    assert "# HELP events Events." in lines
+    assert "# TYPE events counter" in lines
+    assert 'events_total{type="say \\"hi\\""} 1.0' in lines
+    assert "in_flight 2.0" in lines
+    assert 'latency_seconds_bucket{le="0.1"} 1.0' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 1.0' in lines
+    assert "latency_seconds_count 1.0" in lines
+
+
+def test_generate_latest_merges_other_workers():
+    """Tests that the samples of other workers end up under the same metric, told apart by their labels."""
+    registry, other = Registry(), Registry()
+    Counter("events", "Events.", registry=registry).inc()
+    Counter("events", "Events.", registry=other).inc(2)
+    Gauge("only_there", "Only on the other worker.", registry=other).set(3)
+
+    lines = generate_latest(registry, {"pid": "1"}, others=[collect_families(other, {"pid": "2"})]).decode().splitlines()
+    assert lines.count("# TYPE events counter") == 1
+    assert 'events_total{pid="1"} 1.0' in lines
+    assert 'events_total{pid="2"} 2.0' in lines
+    assert 'only_there{pid="2"} 3.0' in lines
+
+
+def test_metric_types_must_implement_samples():
+    class Incomplete(_Metric):
+        type_name = "untyped"
+
+    with pytest.raises(TypeError):
+        Incomplete("incomplete", "Incomplete.", registry=Registry())
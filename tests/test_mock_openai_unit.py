@@ -0,0 +1,70 @@
+import sys
+import httpx
+import pytest
+from pathlib import Path
+from langchain_openai import ChatOpenAI
+import srv.app as app_module
+from srv.app import get_llm_analysis
+from srv.schemas import AnalysisResult
+
+# the OpenAI stand-in lives with the benchmarks, which aren't a package
+BENCHMARKS = Path(__file__).resolve().parents[1] / "benchmarks"
+if str(BENCHMARKS) not in sys.path:
+    sys.path.insert(0, str(BENCHMARKS))
+
+from mock_openai import LatencySampler, MockConfig, create_mock_app  # noqa: E402
+
+
+def _llm(mock_app, max_retries: int = 2) -> ChatOpenAI:
+    # the real client (and its retries), talking to the mock without a socket
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=mock_app), base_url="http://mock/v1")
+    return ChatOpenAI(model="gpt-4o-mini", api_key="mock", base_url="http://mock/v1",
+                      http_async_client=client, max_retries=max_retries)
+
+
+@pytest.mark.asyncio
+async def test_mock_answers_the_real_llm_path(monkeypatch):
+    """Tests that `get_llm_analysis` gets a schema-valid analysis of the prompt's packages from the mock."""
+    mock_app = create_mock_app()
+    monkeypatch.setattr(app_module, "llm", _llm(mock_app))
+
+    result = await get_llm_analysis("MyProject", ["requests==2.32.3", "flask[async]==3.0.3", "numpy"])
+
+    assert isinstance(result, AnalysisResult)
+    assert result.project_name == "MyProject"
+    assert [(f.name, f.version) for f in result.files] == [
+        ("requests", "2.32.3"), ("flask", "3.0.3"), ("numpy", "unknown")]
+    assert mock_app.state.stats["completions"] == 1
+
+
+@pytest.mark.asyncio
+async def test_mock_answers_tool_calls():
+    """Tests that the mock answers with a tool call when the request binds the schema as a tool."""
+    from langchain_core.messages import HumanMessage
+    structured = _llm(create_mock_app()).with_structured_output(AnalysisResult, method="function_calling")
+
+    result = await structured.ainvoke([HumanMessage(
+        "Here are the packages from requirements.txt (one per line). Remember:\n\n"
+        "rich==13.7.1\n\nUse this exact project name: tools (you may infer 'untitled')")])
+
+    assert result.project_name == "tools"
+    assert result.files[0].name == "rich"
+
+
+@pytest.mark.asyncio
+async def test_mock_injects_rate_limits(monkeypatch):
+    """Tests that injected 429s reach the client (which retries them) and are counted."""
+    mock_app = create_mock_app(MockConfig(rate_limit_rate=1.0, retry_after=0.0))
+    monkeypatch.setattr(app_module, "llm", _llm(mock_app, max_retries=1))
+
+    assert await get_llm_analysis("MyProject", ["requests==2.32.3"]) is None
+    # the first attempt, plus the client's retry
+    assert mock_app.state.stats["rate_limited"] == 2
+
+
+def test_lognormal_latency_has_the_configured_mean():
+    """Tests that the lognormal latencies average out to the configured mean."""
+    sampler = LatencySampler(MockConfig(latency="lognormal", latency_mean=1.5, latency_jitter=0.5, seed=42))
+    samples = [sampler.sample() for _ in range(20000)]
+    assert min(samples) > 0
+    assert sum(samples) / len(samples) == pytest.approx(1.5, rel=0.03)
@@ -0,0 +1,171 @@
+import io
+import json
+import asyncio
+import pytest
+import pytest_asyncio
+from uuid import uuid4
+from datetime import datetime, timezone
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from core.config import get_settings
+from core.tracing import setup_tracing, shutdown_tracing, start_span
+from services.outbox import DEAD_LETTER_DIR, EventOutbox, OutboxFull
+from srv.schemas import Event, EventType
+
+
+def _event(project_name: str = "outboxed") -> Event:
+    return Event(
+        user_id=str(uuid4()),
+        project_name=project_name,
+        event=EventType.PROJECT_CREATED,
+        timestamp=datetime.now(timezone.utc)
+    )
+
+
+@pytest_asyncio.fixture
+async def outbox_db(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'outbox.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    try:
+        yield async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    finally:
+        await engine.dispose()
+
+
+async def _stored_ids(session_factory) -> set[str]:
+    async with session_factory() as session:
+        return set((await session.exec(select(Event.id))).all())
+
+
+async def _wait_until_drained(outbox: EventOutbox) -> None:
+    for _ in range(200):
+        if outbox.depth == 0:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("the outbox never drained")
+
+
+@pytest.mark.asyncio
+async def test_enqueued_events_are_written_in_the_background(tmp_path, outbox_db):
+    """Tests that enqueued events end up in the DB and that the spool is emptied afterwards."""
+    outbox = EventOutbox(tmp_path / "spool", outbox_db, flush_interval=0.01)
+    await outbox.start()
+    events = [_event() for _ in range(5)]
+    for e in events:
+        outbox.enqueue(e)
+
+    await _wait_until_drained(outbox)
+    assert await _stored_ids(outbox_db) == {e.id for e in events}
+    assert outbox._spool_path.read_text() == ""
+
+    await outbox.stop()
+    assert list((tmp_path / "spool").iterdir()) == []
+
+
+@pytest.mark.asyncio
+async def test_orphaned_spool_is_replayed_on_start(tmp_path, outbox_db):
+    """Tests that events left behind by a dead worker get replayed (without duplicating ones that made it into the DB)."""
+    spool_dir = tmp_path / "spool"
+    spool_dir.mkdir()
+    committed, lost = _event(), _event()
+    async with outbox_db() as session:
+        session.add(Event.model_validate(committed.model_dump()))
+        await session.commit()
+    # the last line was only half-written when the worker died
+    (spool_dir / "events-1-dead.jsonl").write_text(
+        committed.model_dump_json() + "\n" + lost.model_dump_json() + "\n" + '{"id": "trunc')
+
+    outbox = EventOutbox(spool_dir, outbox_db, flush_interval=0.01)
+    await outbox.start()
+    await _wait_until_drained(outbox)
+    await outbox.stop()
+
+    assert await _stored_ids(outbox_db) == {committed.id, lost.id}
+    assert list(spool_dir.iterdir()) == []
+
+
+@pytest.mark.asyncio
+async def test_events_stay_spooled_while_the_db_is_down(tmp_path, outbox_db):
+    """Tests that events aren't dropped when the DB is unavailable."""
+    def _broken_session_factory():
+        raise ConnectionError("the DB is down")
+
+    spool_dir = tmp_path / "spool"
+    outbox = EventOutbox(spool_dir, _broken_session_factory, flush_interval=0.01)
+    await outbox.start()
+    e = _event()
+    outbox.enqueue(e)
+    await asyncio.sleep(0.05)
+    await outbox.stop(timeout=0.05)
+    assert e.id in "".join(p.read_text() for p in spool_dir.iterdir())
+
+    # once the DB is back, the next worker replays the event
+    outbox = EventOutbox(spool_dir, outbox_db, flush_interval=0.01)
+    await outbox.start()
+    await _wait_until_drained(outbox)
+    await outbox.stop()
+    assert await _stored_ids(outbox_db) == {e.id}
+
+
+@pytest.mark.asyncio
+async def test_rejected_events_are_dead_lettered(tmp_path, outbox_db):
+    """Tests that an event the DB keeps rejecting is split off from its batch and dead-lettered, while the rest of the batch is written."""
+    rejected = _event()
+    async with outbox_db() as session:
+        session.add(Event.model_validate(rejected.model_dump()))
+        await session.commit()
+    spool_dir = tmp_path / "spool"
+    outbox = EventOutbox(spool_dir, outbox_db, flush_interval=0.01, max_attempts=2, max_retry_delay=0.01)
+    await outbox.start()
+    events = [_event(), _event(), rejected, _event()]
+    for e in events:
+        # the duplicate ID makes the DB reject the whole batch
+        outbox.enqueue(e)
+    await _wait_until_drained(outbox)
+    await outbox.stop()
+
+    assert await _stored_ids(outbox_db) == {e.id for e in events}
+    dead = [json.loads(line) for line in (spool_dir / DEAD_LETTER_DIR / "events.jsonl").read_text().splitlines()]
+    assert [d["event"]["id"] for d in dead] == [rejected.id]
+    # the dead letters are never adopted as a spool
+    assert list(spool_dir.glob("*.jsonl")) == []
+
+
+@pytest.mark.asyncio
+async def test_enqueue_refuses_events_once_the_outbox_is_full(tmp_path):
+    """Tests that the outbox doesn't keep piling up events in memory while the DB is down."""
+    def _broken_session_factory():
+        raise ConnectionError("the DB is down")
+
+    outbox = EventOutbox(tmp_path / "spool", _broken_session_factory, flush_interval=0.01, max_pending=2)
+    await outbox.start()
+    outbox.enqueue(_event())
+    outbox.enqueue(_event())
+    with pytest.raises(OutboxFull):
+        outbox.enqueue(_event())
+    await outbox.stop(timeout=0.05)
+
+
+@pytest.mark.asyncio
+async def test_batches_link_back_to_the_requests_that_enqueued_them(tmp_path, outbox_db, monkeypatch):
+    """Tests that the span of a batch write links to the spans that enqueued its events."""
+    monkeypatch.setattr(get_settings(), "tracing_exporter", "console")
+    stream = io.StringIO()
+    setup_tracing(get_settings(), stream)
+    try:
+        outbox = EventOutbox(tmp_path / "spool", outbox_db, flush_interval=0.01)
+        await outbox.start()
+        with start_span("request") as request_span:
+            outbox.enqueue(_event())
+        await _wait_until_drained(outbox)
+        await outbox.stop()
+    finally:
+        shutdown_tracing()
+
+    spans = {span["name"]: span for line in stream.getvalue().splitlines()
+             for span in json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"]}
+    assert spans["outbox.write_batch"]["links"] == [
+        {"traceId": request_span.context.trace_id, "spanId": request_span.context.span_id}]
+    assert outbox._trace_links == {}
@@ -0,0 +1,75 @@
+import pstats
+import json
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from core import profiling
+from srv.middleware import ProfilingMiddleware, wants_profile
+from srv.schemas import UserPublic
+
+
+@pytest.mark.parametrize("headers, query, expected", [
+    ([], b"", False),
+    ([(b"x-profile", b"1")], b"", True),
+    ([(b"x-profile", b"0")], b"", False),
+    ([], b"profile=1", True),
+    ([], b"a=b&profile=true", True),
+    ([], b"profiled=1", False),
+])
+def test_wants_profile(headers, query, expected):
+    assert wants_profile({"headers": headers, "query_string": query}) is expected
+
+
+@pytest.fixture
+def profiled_app(tmp_path, monkeypatch):
+    async def _admin_only(authorization, api_key=None):
+        return UserPublic(id="1", username="admin") if authorization == "Bearer admin" else None
+    monkeypatch.setattr("srv.middleware.get_admin_from_credentials", _admin_only)
+
+    def _build(fmt):
+        app = FastAPI()
+        app.add_middleware(ProfilingMiddleware, directory=tmp_path, fmt=fmt)
+
+        @app.get("/slow")
+        async def slow():
+            return {"total": sum(i * i for i in range(10_000))}
+        return app
+    return _build
+
+
+@pytest.mark.parametrize("fmt", ["speedscope", "pstats"])
+def test_admins_get_a_profile(profiled_app, tmp_path, fmt):
+    """Tests that an admin's request is profiled and that the profile is written to the configured directory."""
+    with TestClient(profiled_app(fmt)) as client:
+        r = client.get("/slow", headers={"X-Profile": "1", "Authorization": "Bearer admin"})
+    assert r.status_code == 200
+    artifact = tmp_path / r.headers["x-profile-artifact"]
+    assert artifact.exists()
+    if fmt == "speedscope":
+        assert artifact.name.endswith(".speedscope.json")
+        assert "profiles" in json.loads(artifact.read_text())
+    else:
+        assert pstats.Stats(str(artifact)).total_calls > 0
+    assert profiling._active is False
+
+
+def test_only_admins_get_profiled(profiled_app, tmp_path):
+    with TestClient(profiled_app("pstats")) as client:
+        r = client.get("/slow?profile=1", headers={"Authorization": "Bearer someone"})
+        assert r.status_code == 200
+        assert "x-profile-artifact" not in r.headers
+        # requests that don't ask for it aren't profiled either
+        r = client.get("/slow", headers={"Authorization": "Bearer admin"})
+        assert "x-profile-artifact" not in r.headers
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_one_profile_at_a_time(profiled_app, tmp_path):
+    assert profiling.try_start_profiling()
+    try:
+        with TestClient(profiled_app("pstats")) as client:
+            r = client.get("/slow", headers={"X-Profile": "1", "Authorization": "Bearer admin"})
+        assert r.status_code == 200
+        assert "x-profile-artifact" not in r.headers
+    finally:
+        profiling.stop_profiling()
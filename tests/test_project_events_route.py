@@ -0,0 +1,98 @@
+import msgpack
+import pytest
+import pytest_asyncio
+from fastapi import status
+from core.config import get_settings
+from services.users import get_user_by_username
+from srv.app import app
+from srv.schemas import UserPublic
+from srv.security import get_current_user
+
+
+@pytest_asyncio.fixture
+async def seeded_user_client(client_with_seed, session_override):
+    # the seeded events belong to the seeded user, so we have to log in as them
+    user = await get_user_by_username(session_override, "seeded")
+    app.dependency_overrides[get_current_user] = lambda: UserPublic.model_validate(
+        user, from_attributes=True)
+    return client_with_seed
+
+
+@pytest.mark.asyncio
+async def test_success_list_project_events(seeded_user_client):
+    """Tests that "GET /projects/{project_name}/events" returns the project's events in order."""
+    r = seeded_user_client.get("/projects/MyCoolCompleteProject/events")
+    assert r.status_code == status.HTTP_200_OK, r.text
+    assert r.headers["content-type"] == "application/json"
+    body = r.json()
+
+    assert [e["event"] for e in body] == [
+        "PROJECT_CREATED", "ANALYSIS_STARTED", "ANALYSIS_COMPLETED"]
+    assert all(e["project_name"] == "MyCoolCompleteProject" for e in body)
+
+
+@pytest.mark.asyncio
+async def test_list_project_events_as_msgpack(seeded_user_client):
+    """Tests that clients that ask for MessagePack get the same events as MessagePack."""
+    as_json = seeded_user_client.get("/projects/MyCoolCompleteProject/events").json()
+    r = seeded_user_client.get("/projects/MyCoolCompleteProject/events",
+                               headers={"Accept": "application/msgpack"})
+    assert r.status_code == status.HTTP_200_OK, r.text
+    assert r.headers["content-type"] == "application/msgpack"
+    assert "Accept" in r.headers["vary"]
+    assert msgpack.unpackb(r.content) == as_json
+
+
+def test_list_events_of_unknown_project(client):
+    """Tests that a project without events returns an empty list."""
+    r = client.get("/projects/nope/events")
+    assert r.status_code == status.HTTP_200_OK, r.text
+    assert r.json() == []
+
+
+@pytest.mark.asyncio
+async def test_success_read_project_result(seeded_user_client):
+    """Tests that "GET /projects/{project_name}/result" returns the latest completed analysis with an ETag."""
+    r = seeded_user_client.get("/projects/MyCoolCompleteProject/result")
+    assert r.status_code == status.HTTP_200_OK, r.text
+    assert r.json()["files"][0]["name"] == "requests"
+    assert r.headers["etag"].startswith('"')
+    assert "Accept-Encoding" in r.headers["vary"]
+
+
+@pytest.mark.asyncio
+async def test_read_project_result_not_modified(seeded_user_client):
+    """Tests that polling with the last ETag returns an empty 304."""
+    etag = seeded_user_client.get("/projects/MyCoolCompleteProject/result").headers["etag"]
+    r = seeded_user_client.get("/projects/MyCoolCompleteProject/result",
+                               headers={"If-None-Match": etag})
+    assert r.status_code == status.HTTP_304_NOT_MODIFIED
+    assert r.content == b""
+    assert r.headers["etag"] == etag
+
+    r = seeded_user_client.get("/projects/MyCoolCompleteProject/result",
+                               headers={"If-None-Match": '"stale"'})
+    assert r.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.asyncio
+async def test_read_project_result_compressed(seeded_user_client, monkeypatch):
+    """Tests that results above the size threshold are compressed for clients that accept it."""
+    monkeypatch.setattr(get_settings(), "compression_min_size", 0)
+    as_json = seeded_user_client.get("/projects/MyCoolCompleteProject/result",
+                                     headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in as_json.headers
+
+    r = seeded_user_client.get("/projects/MyCoolCompleteProject/result",
+                               headers={"Accept-Encoding": "gzip"})
+    assert r.status_code == status.HTTP_200_OK, r.text
+    assert r.headers["content-encoding"] == "gzip"
+    assert r.json() == as_json.json()
+    # compressed and uncompressed representations must not share a strong ETag
+    assert r.headers["etag"] != as_json.headers["etag"]
+
+
+def test_read_result_of_unknown_project(client):
+    """Tests that a project that was never analyzed returns a 404."""
+    r = client.get("/projects/nope/result")
+    assert r.status_code == status.HTTP_404_NOT_FOUND, r.text
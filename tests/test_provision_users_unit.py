@@ -0,0 +1,22 @@
+import io
+import pytest
+from cli.provision_users import read_users
+
+
+def test_read_users_from_csv():
+    """Tests that the provisioning CLI reads users (and their optional columns) from a CSV file."""
+    users = read_users(io.StringIO(
+        "username,password,email,full_name\n"
+        "alice,secret1,alice@example.com,Alice Lastname\n"
+        "bobby,secret2,,\n"
+    ))
+    assert [u.username for u in users] == ["alice", "bobby"]
+    assert users[0].email == "alice@example.com" and users[0].full_name == "Alice Lastname"
+    assert users[1].email is None and users[1].full_name is None
+
+
+def test_read_users_points_at_invalid_rows():
+    """Tests that the provisioning CLI reports which row is invalid."""
+    with pytest.raises(ValueError) as ex:
+        read_users(io.StringIO("username,password\nalice,secret1\njon,secret2\n"))
+    assert "row 3" in str(ex.value).lower()
@@ -0,0 +1,166 @@
+import asyncio
+import pytest
+from uuid import uuid4
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlmodel.ext.asyncio.session import AsyncSession
+from core.config import get_settings
+from services.rate_limits import DatabaseRateLimiter, InMemoryRateLimiter, RateLimitExceeded, analysis_quota
+
+settings = get_settings()
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def db_limiter(test_engine):
+    SessionLocal = async_sessionmaker(
+        bind=test_engine, expire_on_commit=False, class_=AsyncSession)
+    clock = FakeClock()
+    return DatabaseRateLimiter(SessionLocal, timer=clock), clock
+
+
+# runs the test against both backends
+@pytest.fixture(params=["memory", "database"])
+def limiter(request, test_engine):
+    if request.param == "memory":
+        clock = FakeClock()
+        return InMemoryRateLimiter(timer=clock), clock
+    SessionLocal = async_sessionmaker(
+        bind=test_engine, expire_on_commit=False, class_=AsyncSession)
+    clock = FakeClock()
+    return DatabaseRateLimiter(SessionLocal, timer=clock), clock
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_allows_burst_then_refills(limiter):
+    """Tests that a bucket allows `burst` tokens at once, then one more per `1 / rate` seconds."""
+    limiter, clock = limiter
+    key = f"test:{uuid4()}"
+
+    # 2 tokens per second, up to 3 at once
+    for _ in range(3):
+        assert await limiter.take_token(key, 2.0, 3) == 0
+    assert await limiter.take_token(key, 2.0, 3) == pytest.approx(0.5)
+
+    clock.now += 0.25
+    assert await limiter.take_token(key, 2.0, 3) == pytest.approx(0.25)
+    clock.now += 0.25
+    assert await limiter.take_token(key, 2.0, 3) == 0
+    assert await limiter.take_token(key, 2.0, 3) > 0
+
+    # the bucket never holds more than `burst` tokens
+    clock.now += 60
+    for _ in range(3):
+        assert await limiter.take_token(key, 2.0, 3) == 0
+    assert await limiter.take_token(key, 2.0, 3) > 0
+
+
+@pytest.mark.asyncio
+async def test_concurrency_slots(limiter):
+    """Tests that only `limit` slots can be held at once, and that released slots can be reused."""
+    limiter, _ = limiter
+    key = f"test:{uuid4()}"
+
+    first = await limiter.acquire_slot(key, 2, 60)
+    second = await limiter.acquire_slot(key, 2, 60)
+    assert first and second and first != second
+    assert await limiter.acquire_slot(key, 2, 60) is None
+
+    await limiter.release_slot(key, first)
+    third = await limiter.acquire_slot(key, 2, 60)
+    assert third is not None
+    await limiter.release_slot(key, second)
+    await limiter.release_slot(key, third)
+
+
+@pytest.mark.asyncio
+async def test_db_concurrency_slots_expire(db_limiter):
+    """Tests that a slot that was never given back (e.g. the worker died) expires."""
+    limiter, clock = db_limiter
+    key = f"test:{uuid4()}"
+
+    assert await limiter.acquire_slot(key, 1, 60) is not None
+    assert await limiter.acquire_slot(key, 1, 60) is None
+    clock.now += 61
+    assert await limiter.acquire_slot(key, 1, 60) is not None
+
+
+@pytest.mark.asyncio
+async def test_analysis_quota_limits_concurrent_analyses(monkeypatch):
+    """Tests that `analysis_quota()` holds a slot while the block runs and gives it back afterwards."""
+    monkeypatch.setattr("services.rate_limits.rate_limiter", InMemoryRateLimiter())
+    monkeypatch.setattr(settings, "analyze_rate_limit_per_minute", 0)
+    monkeypatch.setattr(settings, "analyze_max_concurrent_per_user", 1)
+    user_id = str(uuid4())
+
+    started, finish = asyncio.Event(), asyncio.Event()
+
+    async def _analysis():
+        async with analysis_quota(user_id):
+            started.set()
+            await finish.wait()
+
+    task = asyncio.create_task(_analysis())
+    await started.wait()
+    with pytest.raises(RateLimitExceeded) as ex:
+        async with analysis_quota(user_id):
+            pass
+    assert ex.value.retry_after > 0
+
+    # other users aren't affected
+    async with analysis_quota(str(uuid4())):
+        pass
+
+    finish.set()
+    await task
+    async with analysis_quota(user_id):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_concurrency_rejections_dont_use_up_tokens(monkeypatch):
+    """Tests that a request that's turned away for having too many analyses running keeps its token for later."""
+    monkeypatch.setattr("services.rate_limits.rate_limiter", InMemoryRateLimiter())
+    # 2 analyses, and then (practically) never again
+    monkeypatch.setattr(settings, "analyze_rate_limit_per_minute", 0.001)
+    monkeypatch.setattr(settings, "analyze_rate_limit_burst", 2)
+    monkeypatch.setattr(settings, "analyze_max_concurrent_per_user", 1)
+    user_id = str(uuid4())
+
+    async with analysis_quota(user_id):
+        for _ in range(3):
+            with pytest.raises(RateLimitExceeded):
+                async with analysis_quota(user_id):
+                    pass
+    async with analysis_quota(user_id):
+        pass
+    with pytest.raises(RateLimitExceeded) as ex:
+        async with analysis_quota(user_id):
+            pass
+    assert "recently" in ex.value.detail
+
+
+@pytest.mark.asyncio
+async def test_analysis_quota_keeps_extending_its_slot(db_limiter, monkeypatch):
+    """Tests that a slow analysis doesn't lose its slot once `analyze_slot_ttl` is up."""
+    limiter, clock = db_limiter
+    monkeypatch.setattr("services.rate_limits.rate_limiter", limiter)
+    monkeypatch.setattr(settings, "analyze_rate_limit_per_minute", 0)
+    monkeypatch.setattr(settings, "analyze_max_concurrent_per_user", 1)
+    monkeypatch.setattr(settings, "analyze_slot_ttl", 0.06)
+    user_id = str(uuid4())
+
+    async with analysis_quota(user_id):
+        for _ in range(3):
+            clock.now += 0.05
+            # gives the slot a chance to be extended
+            await asyncio.sleep(0.03)
+        # without the extensions, the slot would've expired by now
+        assert await limiter.acquire_slot(f"analyze:{user_id}", 1, 0.06) is None
+    assert await limiter.acquire_slot(f"analyze:{user_id}", 1, 0.06) is not None
@@ -0,0 +1,93 @@
+import gzip
+import brotli
+import msgpack
+import orjson
+import pytest
+from datetime import date
+from srv.responses import MsgPackResponse, choose_encoding, compress, dump_json, etag_matches, make_etag, prefers_msgpack
+from srv.schemas import AnalysisResult, DependencyReport
+
+
+@pytest.mark.parametrize("accept, expected", [
+    (None, False),
+    ("", False),
+    ("application/json", False),
+    ("*/*", False),
+    ("application/msgpack", True),
+    ("application/x-msgpack", True),
+    ("application/msgpack, application/json;q=0.5", True),
+    ("application/json, application/msgpack", False),
+    ("application/json;q=0.5, application/msgpack", True),
+    ("application/msgpack;q=0, */*", False),
+    ("application/msgpack;q=0.5, */*", False),
+    ("application/msgpack, */*;q=0.1", True),
+])
+def test_prefers_msgpack(accept, expected):
+    """Tests that only clients that ask for MessagePack by name (and don't rank JSON higher) get it."""
+    assert prefers_msgpack(accept) is expected
+
+
+def test_responses_round_trip():
+    """Tests that the JSON and MessagePack responses decode to the same data."""
+    result = AnalysisResult(
+        project_name="résumé",
+        analysis_date=date(2025, 1, 2),
+        files=[DependencyReport(name="requests", version="2.32.3",
+                                license="Apache-2.0", confidence_score=0.8)]
+    )
+    data = result.model_dump(mode="json")
+
+    json_body = dump_json(result)
+    assert orjson.loads(json_body) == data
+    # non-ASCII characters aren't escaped
+    assert "résumé".encode() in json_body
+    assert orjson.loads(dump_json([result, result])) == [data, data]
+    assert orjson.loads(dump_json([])) == []
+    assert msgpack.unpackb(MsgPackResponse(data).body) == data
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    (None, None),
+    ("identity", None),
+    ("gzip", "gzip"),
+    ("gzip, deflate, br", "br"),
+    ("br;q=0.5, gzip", "gzip"),
+    ("br;q=0, *", "gzip"),
+    ("*", "br"),
+])
+def test_choose_encoding(accept_encoding, expected):
+    """Tests that brotli is preferred over gzip, unless the client ranks gzip higher."""
+    assert choose_encoding(accept_encoding) == expected
+
+
+@pytest.mark.parametrize("if_none_match, expected", [
+    (None, False),
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"xyz", "abc"', True),
+    ('"xyz"', False),
+    ("*", True),
+])
+def test_etag_matches(if_none_match, expected):
+    assert etag_matches(if_none_match, '"abc"') is expected
+
+
+def test_etag_depends_on_representation():
+    """Tests that the same body gets different strong ETags for different media types and encodings."""
+    body = b'{"a": 1}'
+    assert make_etag(body, "application/json") == make_etag(body, "application/json")
+    assert make_etag(body, "application/json") != make_etag(body, "application/msgpack")
+    assert make_etag(body, "application/json") != make_etag(body, "application/json", "gzip")
+
+
+@pytest.mark.parametrize("encoding, decompress", [
+    ("gzip", gzip.decompress),
+    ("br", brotli.decompress),
+])
+def test_compress_round_trip(encoding, decompress):
+    body = orjson.dumps([{"name": f"package-{i}", "license": "MIT"} for i in range(100)])
+    compressed = compress(body, encoding)
+    assert len(compressed) < len(body)
+    assert decompress(compressed) == body
+    # the output is deterministic, so the ETag of a compressed response is stable
+    assert compress(body, encoding) == compressed
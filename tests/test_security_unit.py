@@ -1,4 +1,5 @@
 from uuid import uuid4
+import threading
 import pytest
 import jwt
 from datetime import timedelta
@@ -7,7 +8,8 @@ from unittest.mock import AsyncMock
 from conftest import BASE64URL
 from core.config import get_settings
 from srv.schemas import UserPublic
-from srv.security import verify_pwd, get_hashed_pwd, create_access_token, get_current_user
+from jwt.exceptions import InvalidTokenError
+from srv.security import verify_pwd, get_hashed_pwd, hash_passwords, create_access_token, decode_access_token, get_admin_from_credentials, get_current_user, run_in_hash_pool, token_cache, HASH_SECONDS, HASH_WAIT_SECONDS
 
 settings = get_settings()
 
@@ -20,6 +22,31 @@ def test_password_hash_and_verify():
     assert verify_pwd("nope", hashed) is False
 
 
+@pytest.mark.asyncio
+async def test_password_hashing_runs_off_the_event_loop():
+    """Tests that `run_in_hash_pool()` hashes on another thread and records its timings."""
+    hashed_before, waited_before = HASH_SECONDS.count, HASH_WAIT_SECONDS.count
+
+    def _hash_and_report_thread(plain: str) -> tuple[str, int]:
+        return get_hashed_pwd(plain), threading.get_ident()
+
+    hashed, thread_id = await run_in_hash_pool(_hash_and_report_thread, "pw123")
+    assert thread_id != threading.get_ident()
+    assert await run_in_hash_pool(verify_pwd, "pw123", hashed) is True
+    assert HASH_SECONDS.count == hashed_before + 2
+    assert HASH_WAIT_SECONDS.count == waited_before + 2
+
+
+@pytest.mark.asyncio
+async def test_bulk_password_hashing_on_processes():
+    """Tests that `hash_passwords()` hashes every password (in order) on a process pool."""
+    hashed = await hash_passwords(["pw-one", "pw-two"], workers=2)
+    assert len(hashed) == 2
+    assert verify_pwd("pw-one", hashed[0]) is True
+    assert verify_pwd("pw-two", hashed[1]) is True
+    assert await hash_passwords([]) == []
+
+
 def test_produce_jwt_that_can_expire_and_is_decodable():
     """Tests that `create_access_token()` produces a decodable JWT with an expiration date."""
     token = create_access_token({"sub": "johndoe"})
@@ -29,12 +56,40 @@ def test_produce_jwt_that_can_expire_and_is_decodable():
     for b64 in token.split("."):
         assert BASE64URL.match(b64)
 
-    payload = jwt.decode(token, str(settings.jwt_secret_key),
+    payload = jwt.decode(token, settings.jwt_secret_key.get_secret_value(),
                          algorithms=[settings.jwt_algorithm])
     assert payload.get("sub") == "johndoe"
     assert "exp" in payload
 
 
+def test_decoded_tokens_are_cached_until_they_expire(monkeypatch):
+    """Tests that `decode_access_token()` only verifies a token once, and never caches expired or tampered tokens."""
+    calls = []
+    real_decode = jwt.decode
+
+    def _counting_decode(*args, **kwargs):
+        calls.append(args[0])
+        return real_decode(*args, **kwargs)
+    monkeypatch.setattr("srv.security.jwt.decode", _counting_decode)
+
+    token = create_access_token({"sub": "johndoe"})
+    for _ in range(3):
+        assert decode_access_token(token)["sub"] == "johndoe"
+    assert len(calls) == 1 and len(token_cache) == 1
+    # changing the claims doesn't change what the next caller gets
+    decode_access_token(token)["sub"] = "mallory"
+    assert decode_access_token(token)["sub"] == "johndoe"
+
+    # a token with a different signature is a different cache key, so it still gets verified
+    with pytest.raises(InvalidTokenError):
+        decode_access_token(token[:-2] + ("AA" if token[-2:] != "AA" else "BB"))
+
+    expired = create_access_token({"sub": "johndoe"}, expires_delta=timedelta(seconds=-1))
+    with pytest.raises(InvalidTokenError):
+        decode_access_token(expired)
+    assert len(token_cache) == 1
+
+
 @pytest.mark.asyncio(loop_scope="session")
 async def test_get_valid_user_for_valid_token(monkeypatch, session_override):
     """Tests that `get_current_user()` returns a UserPublic for a valid token."""
@@ -74,3 +129,57 @@ async def test_get_current_user_raises_exception_on_invalid_user(monkeypatch, se
     assert ex.value.status_code == 401
     assert "could not validate user credentials" in str(
         ex.value.detail).lower()
+
+
+def test_api_key_format_and_hash():
+    """Tests that generated API keys carry their prefix, and that hashing them is deterministic."""
+    from srv.security import generate_api_key, get_api_key_prefix, hash_api_key
+
+    key, prefix = generate_api_key()
+    assert get_api_key_prefix(key) == prefix
+    assert hash_api_key(key) == hash_api_key(key)
+    assert hash_api_key(key) != hash_api_key(generate_api_key()[0])
+    assert len(hash_api_key(key)) == 64
+
+    # anything else isn't an API key
+    assert get_api_key_prefix("eyJhbGciOiJIUzI1NiJ9.e30.x") is None
+    assert get_api_key_prefix("lg__secret") is None
+
+
+def test_pwd_context_verifies_other_schemes_and_flags_them():
+    """Tests that a context still verifies hashes from other schemes, but flags them for an upgrade."""
+    from srv.security import build_pwd_context
+
+    bcrypt_hash = build_pwd_context("bcrypt", rounds=4).hash("pw123")
+    pbkdf2 = build_pwd_context("pbkdf2_sha256", rounds=1000)
+    assert pbkdf2.verify("pw123", bcrypt_hash) is True
+    assert pbkdf2.needs_update(bcrypt_hash) is True
+    assert pbkdf2.needs_update(pbkdf2.hash("pw123")) is False
+
+    with pytest.raises(ValueError):
+        build_pwd_context("md5_crypt")
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_get_admin_from_credentials(monkeypatch, session_override):
+    """Tests that `get_admin_from_credentials()` only returns users that are admins."""
+    monkeypatch.setattr(
+        "services.users.get_user",
+        AsyncMock(return_value=UserPublic(id=str(uuid4()), username="johndoe"))
+    )
+    monkeypatch.setattr("srv.security.get_sessionmaker", lambda: lambda: _NoSession())
+    token = create_access_token({"sub": "johndoe"})
+
+    assert await get_admin_from_credentials(f"Bearer {token}") is None
+    monkeypatch.setattr(get_settings(), "admin_usernames", ["johndoe"])
+    assert (await get_admin_from_credentials(f"Bearer {token}")).username == "johndoe"
+    assert await get_admin_from_credentials("Bearer not-a-token") is None
+    assert await get_admin_from_credentials(None) is None
+
+
+class _NoSession:
+    async def __aenter__(self):
+        return None
+
+    async def __aexit__(self, *exc_info):
+        return None
@@ -0,0 +1,72 @@
+import os
+import logging
+import pytest
+from cli.serve import check_worker_settings, get_server_options, get_worker_count
+from core.config import get_settings
+
+settings = get_settings()
+
+
+class Args:
+    host = None
+    port = None
+    workers = None
+    proxy_headers = True
+    forwarded_allow_ips = None
+    root_path = ""
+
+
+def test_worker_count_defaults_to_cpu_count(monkeypatch):
+    """Tests that there's one worker per CPU, unless SERVER_WORKERS (or "--workers") says otherwise."""
+    monkeypatch.setattr(settings, "server_workers", None)
+    monkeypatch.setattr(os, "cpu_count", lambda: 8)
+    assert get_worker_count(settings) == 8
+
+    monkeypatch.setattr(settings, "server_workers", 3)
+    assert get_worker_count(settings) == 3
+    assert get_worker_count(settings, workers=5) == 5
+
+    monkeypatch.setattr(settings, "server_workers", None)
+    monkeypatch.setattr(os, "cpu_count", lambda: None)
+    assert get_worker_count(settings) == 1
+
+
+def test_server_options_use_fast_loop_and_parser():
+    """Tests that the server runs the app factory on uvloop/httptools with the configured timeouts."""
+    pytest.importorskip("uvloop")
+    pytest.importorskip("httptools")
+
+    options = get_server_options(settings, Args())
+    assert options["app"] == "srv.app:create_app" and options["factory"] is True
+    assert options["loop"] == "uvloop"
+    assert options["http"] == "httptools"
+    assert options["port"] == settings.server_port
+    assert options["backlog"] == settings.server_backlog
+    assert options["timeout_keep_alive"] == settings.server_keepalive_timeout
+    assert options["timeout_graceful_shutdown"] == settings.server_graceful_timeout
+
+
+def test_memory_backends_need_a_single_worker(monkeypatch, caplog):
+    """Tests that the server refuses to start several workers that would each keep their own idempotency keys (and warns if they would each keep their own rate limits)."""
+    monkeypatch.setattr(settings, "rate_limit_backend", "database")
+    monkeypatch.setattr(settings, "idempotency_backend", "memory")
+    check_worker_settings(settings, 1)
+    with pytest.raises(RuntimeError) as ex:
+        check_worker_settings(settings, 4)
+    assert "IDEMPOTENCY_BACKEND" in str(ex.value)
+
+    monkeypatch.setattr(settings, "idempotency_backend", "database")
+    check_worker_settings(settings, 4)
+
+    # the rate limits only get looser, so that's just a warning (unless they're off)
+    monkeypatch.setattr(settings, "rate_limit_backend", "memory")
+    monkeypatch.setattr(settings, "analyze_rate_limit_per_minute", 10.0)
+    with caplog.at_level(logging.WARNING, logger="cli.serve"):
+        check_worker_settings(settings, 4)
+    assert "RATE_LIMIT_BACKEND" in caplog.text
+    caplog.clear()
+    monkeypatch.setattr(settings, "analyze_rate_limit_per_minute", 0)
+    monkeypatch.setattr(settings, "analyze_max_concurrent_per_user", 0)
+    with caplog.at_level(logging.WARNING, logger="cli.serve"):
+        check_worker_settings(settings, 4)
+    assert not caplog.text
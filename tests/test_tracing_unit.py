@@ -0,0 +1,130 @@
+import io
+import json
+import asyncio
+import inspect
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from core.config import get_settings
+from core import tracing
+from core.tracing import SpanContext, format_traceparent, get_current_context, parse_traceparent, setup_tracing, shutdown_tracing, start_span, traced
+from srv.middleware import TracingMiddleware
+
+
+@pytest.fixture
+def spans(monkeypatch):
+    """Turns tracing on for the test, and returns a function that reads the exported spans."""
+    monkeypatch.setattr(get_settings(), "tracing_exporter", "console")
+    stream = io.StringIO()
+    setup_tracing(get_settings(), stream)
+
+    def _read():
+        # shutting the exporter down flushes it
+        shutdown_tracing()
+        return [span for line in stream.getvalue().splitlines()
+                for rs in json.loads(line)["resourceSpans"]
+                for ss in rs["scopeSpans"]
+                for span in ss["spans"]]
+
+    yield _read
+    shutdown_tracing()
+
+
+def test_spans_are_noops_when_tracing_is_off():
+    assert tracing.tracer is None
+    with start_span("nothing") as span:
+        assert span is None
+    assert get_current_context() is None
+
+
+def test_nested_spans(spans):
+    """Tests that spans nest, and that a failing block marks its span as failed."""
+    with start_span("parent", attributes={"n": 1, "ok": True}) as parent:
+        with start_span("child"):
+            pass
+        with pytest.raises(ValueError):
+            with start_span("failing"):
+                raise ValueError("boom")
+    exported = {s["name"]: s for s in spans()}
+
+    assert exported["child"]["parentSpanId"] == parent.context.span_id
+    assert exported["child"]["traceId"] == exported["parent"]["traceId"]
+    assert "parentSpanId" not in exported["parent"]
+    assert exported["failing"]["status"] == {"code": tracing.STATUS_ERROR, "message": "boom"}
+    assert {"key": "n", "value": {"intValue": "1"}} in exported["parent"]["attributes"]
+    assert {"key": "ok", "value": {"boolValue": True}} in exported["parent"]["attributes"]
+    assert int(exported["parent"]["endTimeUnixNano"]) >= int(exported["parent"]["startTimeUnixNano"])
+
+
+@pytest.mark.asyncio
+async def test_context_follows_background_tasks(spans):
+    """Tests that tasks created within a span (e.g. background tasks) get its context."""
+    async def _background():
+        with start_span("background"):
+            await asyncio.sleep(0)
+
+    with start_span("request") as request_span:
+        await asyncio.create_task(_background())
+    exported = {s["name"]: s for s in spans()}
+    assert exported["background"]["parentSpanId"] == request_span.context.span_id
+
+
+@pytest.mark.asyncio
+async def test_traced_keeps_the_signature(spans):
+    @traced("work")
+    async def work(a: int, b: int = 2) -> int:
+        return a + b
+
+    assert list(inspect.signature(work).parameters) == ["a", "b"]
+    assert await work(1) == 3
+    assert [s["name"] for s in spans()] == ["work"]
+
+
+def test_unsampled_traces_are_not_exported(spans):
+    tracing.tracer.sample_rate = 0.0
+    with start_span("dropped"):
+        with start_span("also dropped"):
+            pass
+    assert spans() == []
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("garbage", None),
+    ("00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01",
+     SpanContext("4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7", True)),
+    ("00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-00",
+     SpanContext("4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7", False)),
+    ("00-00000000000000000000000000000000-00f067aa0ba902b7-01", None),
+])
+def test_parse_traceparent(header, expected):
+    assert parse_traceparent(header) == expected
+    if expected:
+        assert format_traceparent(expected) == header
+
+
+def test_middleware_continues_the_callers_trace(spans):
+    """Tests that every request gets a server span (named after its route) that its dependencies nest under."""
+    @traced("dependency")
+    async def dependency() -> int:
+        return 1
+
+    app = FastAPI()
+    app.add_middleware(TracingMiddleware)
+
+    @app.get("/items/{item_id}")
+    async def read_item(item_id: int, value: int = Depends(dependency)):
+        return {"id": item_id}
+
+    caller = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+    with TestClient(app) as client:
+        r = client.get("/items/1", headers={"traceparent": caller})
+    assert r.status_code == 200
+    exported = {s["name"]: s for s in spans()}
+
+    server = exported["GET /items/{item_id}"]
+    assert server["traceId"] == "4bf92f3577b34da6a3ce929d0e0e4736"
+    assert server["parentSpanId"] == "00f067aa0ba902b7"
+    assert server["kind"] == tracing.SPAN_KIND_SERVER
+    assert exported["dependency"]["parentSpanId"] == server["spanId"]
+    assert parse_traceparent(r.headers["traceparent"]).span_id == server["spanId"]
@@ -0,0 +1,52 @@
+import pytest
+from fastapi import status
+from core.config import get_settings
+
+settings = get_settings()
+
+
+async def _fake_hash_passwords(passwords, workers=None):
+    return [f"hashed:{p}" for p in passwords]
+
+
+@pytest.fixture
+def as_admin(monkeypatch):
+    # the conftest client is always logged in as "testuser"
+    monkeypatch.setattr(settings, "admin_usernames", ["testuser"])
+    monkeypatch.setattr("services.users.hash_passwords", _fake_hash_passwords)
+
+
+def _users(*usernames: str) -> dict:
+    return {"users": [{"username": u, "password": "supersecret"} for u in usernames]}
+
+
+def test_success_bulk_create_users(as_admin, client_with_seed):
+    """Tests that "POST /users/bulk" creates new users and skips the ones that already exist."""
+    r = client_with_seed.post("/users/bulk", json=_users("newuser1", "newuser2", "seeded"))
+    assert r.status_code == status.HTTP_201_CREATED, r.text
+    body = r.json()
+
+    assert sorted(u["username"] for u in body["created"]) == ["newuser1", "newuser2"]
+    assert body["skipped"] == ["seeded"]
+    for u in body["created"]:
+        assert "hashed_password" not in u
+        assert "password" not in u
+
+
+def test_rejects_non_admins(client):
+    """Tests that only admins can bulk create users."""
+    r = client.post("/users/bulk", json=_users("newuser1"))
+    assert r.status_code == status.HTTP_403_FORBIDDEN
+
+
+def test_rejects_too_many_users(as_admin, monkeypatch, client):
+    """Tests that a request with too many users results in a 413 error."""
+    monkeypatch.setattr(settings, "bulk_provision_max_users", 1)
+    r = client.post("/users/bulk", json=_users("newuser1", "newuser2"))
+    assert r.status_code == status.HTTP_413_CONTENT_TOO_LARGE
+
+
+def test_rejects_invalid_users(as_admin, client):
+    """Tests that a single invalid user results in a 422 error."""
+    r = client.post("/users/bulk", json={"users": [{"username": "jon", "password": "test"}]})
+    assert r.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
@@ -1,9 +1,17 @@
 import pytest
+from time import time
+from types import SimpleNamespace
 from uuid import uuid4
+from unittest.mock import AsyncMock
 from pydantic import ValidationError
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
 from conftest import HEX32
-from services.users import authenticate_user, create_user, get_user
+from services.users import authenticate_user, create_user, create_users, get_user, get_authenticated_user, user_cache
 from services.users import get_user_by_username
+from crud.users import insert_users
 from srv.schemas import User, UserPublic, UserCreate
 from srv.security import get_hashed_pwd
 
@@ -187,3 +195,112 @@ async def test_get_user_by_username_and_create_user_roundtrip(session_override):
     obj = found.model_dump_json()
     assert "password" not in obj
     assert "hashed_password" not in obj
+
+
+@pytest.mark.asyncio
+async def test_get_authenticated_user_is_cached_until_invalidated(monkeypatch, session_override):
+    """Tests that `get_authenticated_user()` only hits the DB once, until the user is saved again."""
+    lookup = AsyncMock(return_value=UserPublic(id=str(uuid4()), username="alice"))
+    monkeypatch.setattr("services.users.get_user", lookup)
+
+    for _ in range(3):
+        u = await get_authenticated_user(session_override, "alice", token_expires_at=time() + 60)
+        assert u is not None and u.username == "alice"
+    assert lookup.await_count == 1
+
+    # saving (i.e. re-creating) the user drops the stale entry
+    monkeypatch.setattr("services.users.get_hashed_pwd", lambda _: "hashed:xyz")
+    monkeypatch.setattr("services.users.get_user_by_username", AsyncMock(return_value=None))
+    await create_user(session_override, UserCreate(username="alice", password="test"))
+    await get_authenticated_user(session_override, "alice", token_expires_at=time() + 60)
+    assert lookup.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_get_authenticated_user_does_not_outlive_the_token(monkeypatch, session_override):
+    """Tests that users aren't cached past the expiry of the token that authenticated them."""
+    lookup = AsyncMock(return_value=UserPublic(id=str(uuid4()), username="alice"))
+    monkeypatch.setattr("services.users.get_user", lookup)
+
+    await get_authenticated_user(session_override, "alice", token_expires_at=time() - 1)
+    assert user_cache.get("alice") is None
+    await get_authenticated_user(session_override, "alice", token_expires_at=time() - 1)
+    assert lookup.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_create_users_skips_taken_and_repeated_usernames(monkeypatch, session_override):
+    """Tests that `create_users()` creates new users in one go and skips usernames that are taken or repeated."""
+    hashed_batches = []
+
+    async def _fake_hash_passwords(passwords, workers=None):
+        hashed_batches.append(list(passwords))
+        return [f"hashed:{p}" for p in passwords]
+    monkeypatch.setattr("services.users.hash_passwords", _fake_hash_passwords)
+
+    session_override.add(User(id=str(uuid4()), username="taken", hashed_password="x"))
+    await session_override.commit()
+
+    created, skipped = await create_users(session_override, [
+        UserCreate(username="alice", password="pw-alice"),
+        UserCreate(username="taken", password="pw-taken"),
+        UserCreate(username="bobby", password="pw-bobby"),
+        UserCreate(username="alice", password="pw-again"),
+    ])
+    assert sorted(u.username for u in created) == ["alice", "bobby"]
+    assert sorted(skipped) == ["alice", "taken"]
+    # only the passwords of users that will actually be created get hashed, and all at once
+    assert hashed_batches == [["pw-alice", "pw-bobby"]]
+
+    alice = await get_user_by_username(session_override, "alice")
+    assert alice is not None and alice.hashed_password == "hashed:pw-alice"
+
+
+@pytest.mark.asyncio
+async def test_insert_users_skips_conflicts_without_dialect_support(monkeypatch, tmp_path):
+    """Tests that `insert_users()` skips conflicting users on dialects that can't do it in SQL (e.g. SQL Server), instead of failing the whole batch."""
+    # NOTE: this needs a session of its own, since the fallback rolls back the transaction
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'users.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+        # the migrations make usernames unique (the models don't)
+        await conn.execute(text('CREATE UNIQUE INDEX uq_user_username ON "user" (username)'))
+    try:
+        async with async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)() as session:
+            session.add(User(id=str(uuid4()), username="taken", hashed_password="x"))
+            await session.commit()
+            # pretend that we're on SQL Server (the statements still run on SQLite)
+            monkeypatch.setattr(session, "get_bind", lambda: SimpleNamespace(dialect=SimpleNamespace(name="mssql")))
+
+            users = [User(id=str(uuid4()), username=name, hashed_password="x") for name in ("carol", "taken", "danny")]
+            assert await insert_users(session, users) == {users[0].id, users[2].id}
+            assert await get_user_by_username(session, "danny") is not None
+
+            # without any conflicts, it's still a single INSERT
+            more = [User(id=str(uuid4()), username=name, hashed_password="x") for name in ("erin1", "frank")]
+            assert await insert_users(session, more) == {u.id for u in more}
+    finally:
+        await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_authenticate_user_rehashes_outdated_hash(monkeypatch, session_override):
+    """Tests that `authenticate_user()` upgrades (and saves) a hash that was made with an outdated cost."""
+    from srv.security import build_pwd_context
+
+    old_hash = build_pwd_context("bcrypt", rounds=4).hash("secret")
+    monkeypatch.setattr("srv.security.pwd_context",
+                        build_pwd_context("bcrypt", rounds=5))
+    session_override.add(
+        User(id=str(uuid4()), username="rehashme", hashed_password=old_hash))
+    await session_override.commit()
+
+    u = await authenticate_user(session_override, "rehashme", "secret")
+    assert u is not None
+
+    user = await get_user_by_username(session_override, "rehashme")
+    assert user.hashed_password != old_hash
+    assert user.hashed_password.startswith("$2b$05$")
+    # the new hash still works, and doesn't need another upgrade
+    assert await authenticate_user(session_override, "rehashme", "secret") is not None
+    assert (await get_user_by_username(session_override, "rehashme")).hashed_password == user.hashed_password